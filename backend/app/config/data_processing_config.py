@@ -36,6 +36,7 @@ DEFAULT_DATA_SOURCES = {
         "source_id": "mqtt_pressure_sensor",
         "type": "mqtt",
         "description": "壓力感測器 MQTT 數據源",
+        "pipeline": "pressure_processing",
         "config": {
             "min_pressure": 0,
             "max_pressure": 1000,
@@ -289,37 +290,43 @@ DATA_SOURCE_TYPE_MAPPING = {
         "name": "MQTT",
         "icon": "ApiOutlined",
         "color": "#1890ff",
-        "description": "MQTT 通訊協定數據源"
+        "description": "MQTT 通訊協定數據源",
+        "default_pipeline": "temperature_processing"
     },
     "modbus": {
         "name": "Modbus",
         "icon": "ThunderboltOutlined",
         "color": "#52c41a",
-        "description": "Modbus 通訊協定數據源"
+        "description": "Modbus 通訊協定數據源",
+        "default_pipeline": "modbus_processing"
     },
     "opcua": {
         "name": "OPC UA",
         "icon": "ApiOutlined",
         "color": "#722ed1",
-        "description": "OPC UA 通訊協定數據源"
+        "description": "OPC UA 通訊協定數據源",
+        "default_pipeline": "modbus_processing"
     },
     "postgresql": {
         "name": "PostgreSQL",
         "icon": "DatabaseOutlined",
         "color": "#722ed1",
-        "description": "PostgreSQL 資料庫數據源"
+        "description": "PostgreSQL 資料庫數據源",
+        "default_pipeline": "database_processing"
     },
     "mongodb": {
         "name": "MongoDB",
         "icon": "DatabaseOutlined",
         "color": "#13c2c2",
-        "description": "MongoDB 資料庫數據源"
+        "description": "MongoDB 資料庫數據源",
+        "default_pipeline": "database_processing"
     },
     "influxdb": {
         "name": "InfluxDB",
         "icon": "DatabaseOutlined",
         "color": "#fa8c16",
-        "description": "InfluxDB 時序資料庫數據源"
+        "description": "InfluxDB 時序資料庫數據源",
+        "default_pipeline": "advanced_processing"
     }
 }
 
@@ -1,15 +1,21 @@
+import asyncio
 import os
+import threading
+import time
+from typing import Dict, Optional
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from datetime import datetime, timedelta
 import uuid
 from sqlalchemy import Column, Integer, String, DateTime, Text, Float, Boolean, ForeignKey
 from sqlalchemy.orm import relationship, backref
 from sqlalchemy.ext.declarative import declarative_base
 from urllib.parse import quote_plus
-from sqlalchemy import text
+from sqlalchemy import text, select
 from . import schemas
 from . import models
+from .pagination import keyset_query, model_fields, select_fields
 
 # 嘗試導入 dotenv，如果失敗則使用預設值
 try:
@@ -58,18 +64,159 @@ POSTGRES_HOST = os.getenv('POSTGRES_HOST', 'localhost')
 POSTGRES_PORT = os.getenv('POSTGRES_PORT', '5432')
 POSTGRES_DB = os.getenv('POSTGRES_DB', 'iiplatform')
 
+# 連線池設定（環境變數為預設值，啟動後會以預設的 PostgreSQL 連線記錄覆寫）
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '10'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '20'))
+DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', '30'))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')
+
+
+def build_engine_options(url: str, pool_size: int = None, timeout: int = None) -> dict:
+    """依資料庫類型組出 create_engine 的連線池參數"""
+    if url.startswith('sqlite'):
+        # SQLite 不需要連線池大小設定，只保留跨執行緒使用與斷線檢查
+        return {"connect_args": {"check_same_thread": False}, "pool_pre_ping": DB_POOL_PRE_PING}
+    return {
+        "pool_size": pool_size or DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": timeout or DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
+def to_async_url(url: str) -> str:
+    """把同步連線字串轉為對應的非同步驅動"""
+    if url.startswith('postgresql://'):
+        return 'postgresql+asyncpg://' + url[len('postgresql://'):]
+    if url.startswith('sqlite:///'):
+        return 'sqlite+aiosqlite:///' + url[len('sqlite:///'):]
+    return url
+
+
 # 嘗試建立 PostgreSQL 連線
 try:
     DATABASE_URL = f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
-    engine = create_engine(DATABASE_URL)
+    engine = create_engine(DATABASE_URL, **build_engine_options(DATABASE_URL))
     print("✅ PostgreSQL 連線建立成功")
 except Exception as e:
     print(f"❌ PostgreSQL 連線失敗: {e}")
     print("🔄 使用 SQLite 作為備用資料庫...")
     DATABASE_URL = "sqlite:///./iot.db"
-    engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+    engine = create_engine(DATABASE_URL, **build_engine_options(DATABASE_URL))
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# 目前同步引擎使用的連線池參數 (pool_size, pool_timeout)
+_engine_pool_options = (
+    None if DATABASE_URL.startswith('sqlite')
+    else tuple(build_engine_options(DATABASE_URL)[k] for k in ("pool_size", "pool_timeout"))
+)
+# 背景關閉中的舊非同步引擎（保留參照避免工作被回收）
+_async_disposals = set()
+
+# 非同步引擎：async 端點使用 AsyncSession，查詢時不會阻塞事件迴圈
+ASYNC_DATABASE_URL = os.getenv('ASYNC_DATABASE_URL', to_async_url(DATABASE_URL))
+try:
+    async_engine = create_async_engine(ASYNC_DATABASE_URL, **build_engine_options(ASYNC_DATABASE_URL))
+    AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False, autoflush=False)
+    ASYNC_DB_AVAILABLE = True
+    print("✅ 非同步資料庫引擎建立成功")
+except Exception as e:
+    async_engine = None
+    AsyncSessionLocal = None
+    ASYNC_DB_AVAILABLE = False
+    print(f"⚠️  非同步資料庫引擎不可用（請安裝 asyncpg / aiosqlite）: {e}")
+
+
+def configure_engine_pool(db: Session = None) -> dict:
+    """以預設的 PostgreSQL 連線記錄（connection_pool_size / timeout）重建連線池
+
+    連線池參數與目前相同時不會重建；回傳目前生效的連線池設定。
+    """
+    global engine, async_engine, _engine_pool_options
+    if DATABASE_URL.startswith('sqlite'):
+        return get_pool_status()
+
+    own_session = db is None
+    db = db or SessionLocal()
+    try:
+        record = db.query(models.DatabaseConnection).filter(
+            models.DatabaseConnection.db_type == 'postgresql',
+            models.DatabaseConnection.is_active == True,
+            models.DatabaseConnection.is_default == True
+        ).first()
+    except Exception as e:
+        print(f"⚠️ 讀取連線池設定失敗，沿用預設值: {e}")
+        record = None
+    finally:
+        if own_session:
+            db.close()
+    if record is None:
+        return get_pool_status()
+
+    options = build_engine_options(DATABASE_URL, record.connection_pool_size, record.timeout)
+    pool_options = (options["pool_size"], options["pool_timeout"])
+    if pool_options == _engine_pool_options:
+        return get_pool_status()
+
+    old_engine, engine = engine, create_engine(DATABASE_URL, **options)
+    _engine_pool_options = pool_options
+    SessionLocal.configure(bind=engine)
+    db_manager.postgres_engine = engine
+    old_engine.dispose()
+    if async_engine is not None:
+        old_async, async_engine = async_engine, create_async_engine(
+            ASYNC_DATABASE_URL, **build_engine_options(ASYNC_DATABASE_URL, record.connection_pool_size, record.timeout)
+        )
+        AsyncSessionLocal.configure(bind=async_engine)
+        dispose_async_engine(old_async)
+    print(f"✅ 連線池已套用設定: pool_size={options['pool_size']}, timeout={options['pool_timeout']}")
+    return get_pool_status()
+
+
+def dispose_async_engine(old_engine):
+    """在連線所屬的事件迴圈上關閉舊的非同步引擎的閒置連線"""
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+    if loop is not None:
+        task = loop.create_task(old_engine.dispose())
+        _async_disposals.add(task)
+        task.add_done_callback(_async_disposals.discard)
+        return
+    try:
+        # 由 FastAPI 的執行緒池呼叫時，回到應用程式的事件迴圈執行
+        import anyio.from_thread
+        anyio.from_thread.run(old_engine.dispose)
+    except RuntimeError:
+        # 不在任何事件迴圈中（例如命令列工具），連線也不屬於任何迴圈
+        asyncio.run(old_engine.dispose())
+
+
+def get_pool_status() -> dict:
+    """目前同步 / 非同步連線池的使用狀況"""
+    def describe(pool):
+        status = {"class": type(pool).__name__, "status": pool.status()}
+        if hasattr(pool, "checkedout"):
+            status.update({
+                "size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "checked_in": pool.checkedin(),
+                "overflow": pool.overflow(),
+                "timeout": getattr(pool, "_timeout", None),
+            })
+        return status
+
+    return {
+        "database": engine.dialect.name,
+        "sync": describe(engine.pool),
+        "async": describe(async_engine.pool) if async_engine is not None else None,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
 
 # 資料庫管理類別
 class DatabaseManager:
@@ -169,26 +316,17 @@ def test_database_connections():
 # 設備數據相關函數
 def create_device_data(device_id: str, data: dict):
     """創建設備數據"""
-    # 儲存到 PostgreSQL
-    db = get_postgres_session()
-    try:
-        device = db.query(models.Device).filter(models.Device.device_id == device_id).first()
-        if device:
-            device.last_seen = datetime.utcnow()
-            db.commit()
-    except Exception as e:
-        print(f"PostgreSQL 設備數據更新失敗: {e}")
-    finally:
-        db.close()
+    # 更新設備 last_seen（由存活狀態表合併後批次寫回 PostgreSQL）
+    from .services.heartbeat_service import heartbeat_table
+    heartbeat_table.touch(device_id)
     
     # 儲存到 InfluxDB
     if INFLUXDB_AVAILABLE and db_manager.influx_client:
         try:
             from influxdb_client import Point
-            from influxdb_client.client.write_api import SYNCHRONOUS
+            from .services.timeseries_writer import timeseries_writer
             
             bucket = os.getenv('INFLUXDB_BUCKET', 'iiplatform')
-            write_api = db_manager.influx_client.write_api(write_options=SYNCHRONOUS)
             
             point = Point("device_sensor_data")\
                 .tag("device_id", device_id)\
@@ -196,34 +334,32 @@ def create_device_data(device_id: str, data: dict):
                 .field("humidity", data.get('humidity', 0))\
                 .field("pressure", data.get('pressure', 0))
             
-            write_api.write(bucket=bucket, record=point)
-            print(f"InfluxDB 設備數據儲存成功: {device_id}")
+            # 交由共用的批次寫入服務合併送出
+            timeseries_writer.write(point, bucket=bucket)
         except Exception as e:
             print(f"InfluxDB 設備數據儲存失敗: {e}")
 
-def get_device_history(device_id: str, hours: int = 24):
-    """取得設備歷史數據"""
+def get_device_history(device_id: str, hours: int = 24, resolution: str = None, max_points: int = None,
+                       method: str = "mean", fields=None):
+    """取得設備歷史數據（在 InfluxDB 端依視窗降採樣，回傳欄位式陣列）"""
+    from .services.history_query import query_history
+    end_time = datetime.utcnow()
+    start_time = end_time - timedelta(hours=hours)
+    empty = {"start": start_time.isoformat(), "stop": end_time.isoformat(), "series": []}
     if INFLUXDB_AVAILABLE and db_manager.influx_client:
         try:
-            
             bucket = os.getenv('INFLUXDB_BUCKET', 'iiplatform')
             query_api = db_manager.influx_client.query_api()
-            
-            start_time = datetime.utcnow() - timedelta(hours=hours)
-            
-            query = f'''
-            from(bucket: "{bucket}")
-                |> range(start: {start_time.isoformat()})
-                |> filter(fn: (r) => r["device_id"] == "{device_id}")
-                |> pivot(rowKey:["_time"], columnKey: ["_field"], valueColumn: "_value")
-            '''
-            
-            result = query_api.query(query)
-            return result
+            return query_history(
+                query_api, bucket, device_id, start_time, end_time,
+                resolution=resolution, max_points=max_points, method=method, fields=fields
+            )
+        except ValueError:
+            raise
         except Exception as e:
             print(f"InfluxDB 查詢失敗: {e}")
-            return []
-    return []
+            return empty
+    return empty
 
 # 取得資料庫會話
 def get_postgres_session():
@@ -308,12 +444,41 @@ def create_device(db: Session, device):
     db.refresh(db_device)
     return db_device
 
-def get_devices(db: Session, category_id: int = None):
-    """獲取設備列表"""
-    query = db.query(models.Device)
-    if category_id:
-        query = query.filter(models.Device.category_id == category_id)
-    return query.all()
+# 列表查詢的排序鍵（游標分頁）
+DEVICE_SORT_KEY = (("id", False),)
+ALERT_SORT_KEY = (("id", False),)
+AI_MODEL_USAGE_SORT_KEY = (("created_at", True), ("id", True))
+PLATFORM_IMAGE_SORT_KEY = (("created_at", True), ("id", True))
+DATABASE_CONNECTION_SORT_KEY = (("id", False),)
+
+# 資料庫連線列表可輸出的欄位（不含密碼與連線字串）
+DATABASE_CONNECTION_LIST_FIELDS = (
+    "id", "name", "db_type", "host", "port", "database", "username", "is_active", "is_default",
+    "description", "last_test_time", "last_test_result", "last_test_error", "response_time",
+    "auth_source", "auth_mechanism", "replica_set", "ssl_enabled", "token", "org", "bucket",
+    "timeout", "retry_attempts", "connection_pool_size"
+)
+
+def query_devices_page(category_id: int = None, fields: str = None, cursor: str = None, limit: int = None):
+    """設備列表的游標分頁查詢"""
+    names = select_fields(models.Device, fields, model_fields(models.Device), DEVICE_SORT_KEY)
+    filters = [models.Device.category_id == category_id] if category_id else []
+    return keyset_query(models.Device, names, DEVICE_SORT_KEY, filters, cursor, limit)
+
+def overlay_device_state(row: dict) -> dict:
+    """以記憶體中的存活狀態覆蓋尚未寫回資料庫的 last_seen / status，並附上 last_heartbeat"""
+    from .services.heartbeat_service import heartbeat_table
+    
+    if "device_id" not in row:
+        return row
+    state = heartbeat_table.get(row["device_id"])
+    row["last_heartbeat"] = state["last_heartbeat"] if state else None
+    if state:
+        if "last_seen" in row and state["last_seen"] and (row["last_seen"] is None or state["last_seen"] > row["last_seen"]):
+            row["last_seen"] = state["last_seen"]
+        if "status" in row and state["status"]:
+            row["status"] = state["status"]
+    return row
 
 def update_device(db: Session, device_id: int, update):
     """更新設備"""
@@ -335,6 +500,7 @@ def create_device_category(db: Session, category, created_by: int):
     db.add(db_category)
     db.commit()
     db.refresh(db_category)
+    invalidate_device_category_tree()
     return db_category
 
 def get_device_categories(db: Session, parent_id: int = None, include_inactive: bool = False):
@@ -346,30 +512,77 @@ def get_device_categories(db: Session, parent_id: int = None, include_inactive:
         query = query.filter(models.DeviceCategory.is_active == True)
     return query.all()
 
+# 類別樹快取：類別新增/更新/刪除時遞增版本，下次讀取時重建；
+# 其他行程寫入的變更則靠 TTL 反映
+CATEGORY_TREE_CACHE_TTL = float(os.getenv("CATEGORY_TREE_CACHE_TTL", "60"))
+_category_tree_lock = threading.Lock()
+_category_tree_version = 0
+_category_tree_cache = None  # (version, expires_at, body, etag)
+
+def invalidate_device_category_tree():
+    """類別變更後使快取的類別樹失效"""
+    global _category_tree_version, _category_tree_cache
+    with _category_tree_lock:
+        _category_tree_version += 1
+        _category_tree_cache = None
+
+def build_device_category_tree(db: Session):
+    """以單一查詢取出所有啟用中的類別，在記憶體中 O(n) 組成樹狀結構"""
+    rows = db.query(
+        models.DeviceCategory.id,
+        models.DeviceCategory.parent_id,
+        models.DeviceCategory.name,
+        models.DeviceCategory.display_name,
+        models.DeviceCategory.description,
+        models.DeviceCategory.icon,
+        models.DeviceCategory.color
+    ).filter(models.DeviceCategory.is_active == True).order_by(models.DeviceCategory.id).all()
+
+    nodes = {
+        row.id: {
+            "id": row.id,
+            "name": row.name,
+            "display_name": row.display_name,
+            "description": row.description,
+            "icon": row.icon,
+            "color": row.color,
+            "children": []
+        }
+        for row in rows
+    }
+    tree = []
+    for row in rows:
+        if row.parent_id is None:
+            tree.append(nodes[row.id])
+        elif row.parent_id in nodes:
+            nodes[row.parent_id]["children"].append(nodes[row.id])
+        # 父類別已停用的子樹不會出現在樹中
+    return tree
+
+def get_device_category_tree_cached(db: Session):
+    """取得快取的類別樹，回傳 (JSON 內容, ETag)"""
+    global _category_tree_cache
+    with _category_tree_lock:
+        cache = _category_tree_cache
+        version = _category_tree_version
+    if cache is not None and cache[0] == version and cache[1] > time.monotonic():
+        return cache[2], cache[3]
+
+    import hashlib
+    import json
+    tree = build_device_category_tree(db)
+    body = json.dumps(tree, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    etag = f'"{hashlib.sha1(body).hexdigest()}"'
+    with _category_tree_lock:
+        # 建樹期間若有類別變更，不寫入快取
+        if _category_tree_version == version:
+            _category_tree_cache = (version, time.monotonic() + CATEGORY_TREE_CACHE_TTL, body, etag)
+    return body, etag
+
 def get_device_category_tree(db: Session):
-    """獲取設備類別樹狀結構"""
-    
-    def build_tree(parent_id=None):
-        categories = db.query(models.DeviceCategory).filter(
-            models.DeviceCategory.parent_id == parent_id,
-            models.DeviceCategory.is_active == True
-        ).all()
-        
-        tree = []
-        for category in categories:
-            node = {
-                "id": category.id,
-                "name": category.name,
-                "display_name": category.display_name,
-                "description": category.description,
-                "icon": category.icon,
-                "color": category.color,
-                "children": build_tree(category.id)
-            }
-            tree.append(node)
-        return tree
-    
-    return build_tree()
+    """獲取設備類別樹狀結構（由快取的 JSON 解出，呼叫端修改不影響快取）"""
+    import json
+    return json.loads(get_device_category_tree_cached(db)[0])
 
 def get_device_category(db: Session, category_id: int):
     """獲取單個設備類別"""
@@ -386,6 +599,7 @@ def update_device_category(db: Session, category_id: int, category):
     
     db.commit()
     db.refresh(db_category)
+    invalidate_device_category_tree()
     return db_category
 
 def delete_device_category(db: Session, category_id: int):
@@ -406,6 +620,7 @@ def delete_device_category(db: Session, category_id: int):
     
     db.delete(category)
     db.commit()
+    invalidate_device_category_tree()
     return True
 
 # 警報管理相關函數
@@ -416,6 +631,17 @@ def get_alerts(db: Session, device_id: int = None):
         query = query.filter(models.Alert.device_id == device_id)
     return query.all()
 
+def query_alerts_page(device_id: int = None, fields: str = None, cursor: str = None, limit: int = None):
+    """警報列表的游標分頁查詢"""
+    names = select_fields(models.Alert, fields, model_fields(models.Alert), ALERT_SORT_KEY)
+    filters = [models.Alert.device_id == device_id] if device_id else []
+    return keyset_query(models.Alert, names, ALERT_SORT_KEY, filters, cursor, limit)
+
+def query_database_connections_page(fields: str = None, cursor: str = None, limit: int = None):
+    """資料庫連線列表的游標分頁查詢"""
+    names = select_fields(models.DatabaseConnection, fields, DATABASE_CONNECTION_LIST_FIELDS, DATABASE_CONNECTION_SORT_KEY)
+    return keyset_query(models.DatabaseConnection, names, DATABASE_CONNECTION_SORT_KEY, (), cursor, limit)
+
 # 資料庫連線設定管理
 def create_database_connection_setting(db: Session, setting: schemas.DatabaseConnectionSettingsCreate, created_by: str = None):
     """創建資料庫連線設定"""
@@ -426,12 +652,18 @@ def create_database_connection_setting(db: Session, setting: schemas.DatabaseCon
     db.add(db_setting)
     db.commit()
     db.refresh(db_setting)
+    dynamic_db_manager.invalidate()
     return db_setting
 
 def get_database_connection_settings(db: Session, skip: int = 0, limit: int = 100):
     """獲取所有資料庫連線設定"""
     return db.query(models.DatabaseConnectionSettings).offset(skip).limit(limit).all()
 
+async def get_database_connection_settings_async(db: AsyncSession, skip: int = 0, limit: int = 100):
+    """獲取所有資料庫連線設定（非同步）"""
+    result = await db.execute(select(models.DatabaseConnectionSettings).offset(skip).limit(limit))
+    return result.scalars().all()
+
 def get_database_connection_setting_by_type(db: Session, db_type: str):
     """根據類型獲取資料庫連線設定"""
     return db.query(models.DatabaseConnectionSettings).filter(
@@ -457,6 +689,7 @@ def update_database_connection_setting(db: Session, setting_id: int, setting: sc
         db_setting.updated_at = datetime.utcnow()
         db.commit()
         db.refresh(db_setting)
+        dynamic_db_manager.invalidate()
     return db_setting
 
 def delete_database_connection_setting(db: Session, setting_id: int):
@@ -467,6 +700,7 @@ def delete_database_connection_setting(db: Session, setting_id: int):
     if db_setting:
         db.delete(db_setting)
         db.commit()
+        dynamic_db_manager.invalidate()
     return db_setting
 
 def check_first_time_setup(db: Session):
@@ -517,6 +751,7 @@ def create_ai_model(db: Session, model: schemas.AIModelCreate, created_by: str =
     )
     db.add(db_model)
     db.commit()
+    invalidate_ai_model_stats()
     db.refresh(db_model)
     return db_model
 
@@ -531,6 +766,10 @@ def get_ai_model(db: Session, model_id: int):
     """根據 ID 獲取 AI Model"""
     return db.query(models.AIModel).filter(models.AIModel.id == model_id).first()
 
+async def get_ai_model_async(db: AsyncSession, model_id: int):
+    """根據 ID 獲取 AI Model（非同步）"""
+    return await db.get(models.AIModel, model_id)
+
 def update_ai_model(db: Session, model_id: int, model: schemas.AIModelUpdate):
     """更新 AI Model"""
     db_model = get_ai_model(db, model_id)
@@ -540,6 +779,7 @@ def update_ai_model(db: Session, model_id: int, model: schemas.AIModelUpdate):
             setattr(db_model, field, value)
         db_model.updated_at = datetime.utcnow()
         db.commit()
+        invalidate_ai_model_stats()
         db.refresh(db_model)
     return db_model
 
@@ -549,6 +789,7 @@ def delete_ai_model(db: Session, model_id: int):
     if db_model:
         db.delete(db_model)
         db.commit()
+        invalidate_ai_model_stats()
     return db_model
 
 def toggle_ai_model_status(db: Session, model_id: int):
@@ -558,6 +799,7 @@ def toggle_ai_model_status(db: Session, model_id: int):
         db_model.status = 'active' if db_model.status == 'inactive' else 'inactive'
         db_model.updated_at = datetime.utcnow()
         db.commit()
+        invalidate_ai_model_stats()
         db.refresh(db_model)
     return db_model
 
@@ -573,6 +815,9 @@ def create_ai_model_usage(db: Session, usage: schemas.AIModelUsageCreate):
     
     db.commit()
     db.refresh(db_usage)
+
+    from .services.ai_model_rollup_service import ai_model_rollups
+    ai_model_rollups.record_usage(db_usage.model_id, db_usage.created_at, db_usage.processing_time, db_usage.success)
     return db_usage
 
 def get_ai_model_usage(db: Session, model_id: int, skip: int = 0, limit: int = 100):
@@ -581,43 +826,86 @@ def get_ai_model_usage(db: Session, model_id: int, skip: int = 0, limit: int = 1
         models.AIModelUsage.model_id == model_id
     ).offset(skip).limit(limit).all()
 
+def query_ai_model_usage_page(model_id: int, fields: str = None, cursor: str = None, limit: int = None):
+    """AI Model 使用記錄的游標分頁查詢（依建立時間由新到舊）"""
+    names = select_fields(models.AIModelUsage, fields, model_fields(models.AIModelUsage), AI_MODEL_USAGE_SORT_KEY)
+    filters = [models.AIModelUsage.model_id == model_id]
+    return keyset_query(models.AIModelUsage, names, AI_MODEL_USAGE_SORT_KEY, filters, cursor, limit)
+
 def create_ai_model_performance(db: Session, performance: schemas.AIModelPerformanceCreate):
     """創建 AI Model 性能記錄"""
     db_performance = models.AIModelPerformance(**performance.dict())
     db.add(db_performance)
     db.commit()
     db.refresh(db_performance)
+
+    from .services.ai_model_rollup_service import ai_model_rollups, GAUGES
+    ai_model_rollups.record_performance(
+        db_performance.model_id,
+        db_performance.timestamp,
+        db_performance.request_count,
+        db_performance.error_count,
+        db_performance.avg_latency,
+        **{name: getattr(db_performance, name) for name in GAUGES}
+    )
     return db_performance
 
-def get_ai_model_performance(db: Session, model_id: int, hours: int = 24):
-    """獲取 AI Model 性能記錄"""
-    from datetime import timedelta
+def get_ai_model_performance(db: Session, model_id: int, hours: int = 24, resolution: str = None):
+    """獲取 AI Model 性能分桶（由彙總表讀取，不掃描原始記錄）"""
+    from .services.ai_model_rollup_service import ai_model_rollups
+    resolution = resolution or ai_model_rollups.auto_resolution(hours)
+    # 先寫回尚未寫入的變動，讓最新的分桶也能查到
+    ai_model_rollups.flush()
     start_time = datetime.utcnow() - timedelta(hours=hours)
-    
-    return db.query(models.AIModelPerformance).filter(
-        models.AIModelPerformance.model_id == model_id,
-        models.AIModelPerformance.timestamp >= start_time
-    ).order_by(models.AIModelPerformance.timestamp.desc()).all()
-
-def get_ai_model_stats(db: Session):
-    """獲取 AI Model 統計信息"""
-    total_models = db.query(models.AIModel).count()
-    active_models = db.query(models.AIModel).filter(models.AIModel.status == 'active').count()
-    uploading_models = db.query(models.AIModel).filter(models.AIModel.status == 'uploading').count()
-    
-    # 獲取不同類型的模型數量
-    type_counts = db.query(
+    return resolution, ai_model_rollups.query(db, model_id, resolution, start_time)
+
+# AI Model 統計快取：模型新增、更新、刪除、切換狀態時失效；
+# 其他行程寫入的變更則靠 TTL 反映
+AI_MODEL_STATS_CACHE_TTL = float(os.getenv("AI_MODEL_STATS_CACHE_TTL", "60"))
+_ai_model_stats_lock = threading.Lock()
+_ai_model_stats_version = 0
+_ai_model_stats_cache = None  # (version, expires_at, stats)
+
+def invalidate_ai_model_stats():
+    """AI Model 變更後使快取的統計失效"""
+    global _ai_model_stats_version, _ai_model_stats_cache
+    with _ai_model_stats_lock:
+        _ai_model_stats_version += 1
+        _ai_model_stats_cache = None
+
+def compute_ai_model_stats(db: Session):
+    """以單一條件聚合查詢計算各類型的總數、啟用數與上傳中數量"""
+    from sqlalchemy import case, func
+    rows = db.query(
         models.AIModel.type,
-        db.func.count(models.AIModel.id)
+        func.count(models.AIModel.id),
+        func.sum(case((models.AIModel.status == 'active', 1), else_=0)),
+        func.sum(case((models.AIModel.status == 'uploading', 1), else_=0)),
     ).group_by(models.AIModel.type).all()
-    
+
     return {
-        'total': total_models,
-        'active': active_models,
-        'uploading': uploading_models,
-        'types': dict(type_counts)
+        'total': sum(row[1] for row in rows),
+        'active': sum(int(row[2] or 0) for row in rows),
+        'uploading': sum(int(row[3] or 0) for row in rows),
+        'types': {row[0]: row[1] for row in rows}
     }
 
+def get_ai_model_stats(db: Session):
+    """獲取 AI Model 統計信息"""
+    global _ai_model_stats_cache
+    with _ai_model_stats_lock:
+        cache = _ai_model_stats_cache
+        version = _ai_model_stats_version
+    if cache is not None and cache[0] == version and cache[1] > time.monotonic():
+        return dict(cache[2], types=dict(cache[2]['types']))
+
+    stats = compute_ai_model_stats(db)
+    with _ai_model_stats_lock:
+        # 查詢期間若有模型變更，不寫入快取
+        if _ai_model_stats_version == version:
+            _ai_model_stats_cache = (version, time.monotonic() + AI_MODEL_STATS_CACHE_TTL, stats)
+    return dict(stats, types=dict(stats['types']))
+
 # 平台內容管理
 def create_platform_content(db: Session, content: schemas.PlatformContentCreate, created_by: str = None):
     """創建平台內容"""
@@ -641,6 +929,16 @@ def get_platform_content(db: Session, section: str = None, content_type: str = N
     
     return query.order_by(models.PlatformContent.sort_order).all()
 
+async def get_platform_content_async(db: AsyncSession, section: str = None, content_type: str = None):
+    """獲取平台內容（非同步）"""
+    query = select(models.PlatformContent).where(models.PlatformContent.is_active == True)
+    if section:
+        query = query.where(models.PlatformContent.section == section)
+    if content_type:
+        query = query.where(models.PlatformContent.content_type == content_type)
+    result = await db.execute(query.order_by(models.PlatformContent.sort_order))
+    return result.scalars().all()
+
 def update_platform_content(db: Session, content_id: int, content: schemas.PlatformContentUpdate):
     """更新平台內容"""
     db_content = db.query(models.PlatformContent).filter(models.PlatformContent.id == content_id).first()
@@ -710,10 +1008,23 @@ def get_platform_images(db: Session, category: str = None, is_active: bool = Tru
     
     return query.order_by(models.PlatformImage.created_at.desc()).all()
 
+def query_platform_images_page(category: str = None, is_active: bool = True, fields: str = None,
+                               cursor: str = None, limit: int = None):
+    """平台圖片的游標分頁查詢（依建立時間由新到舊）"""
+    names = select_fields(models.PlatformImage, fields, model_fields(models.PlatformImage), PLATFORM_IMAGE_SORT_KEY)
+    filters = [models.PlatformImage.is_active == is_active]
+    if category:
+        filters.append(models.PlatformImage.category == category)
+    return keyset_query(models.PlatformImage, names, PLATFORM_IMAGE_SORT_KEY, filters, cursor, limit)
+
 def get_platform_image(db: Session, image_id: int):
     """根據 ID 獲取平台圖片"""
     return db.query(models.PlatformImage).filter(models.PlatformImage.id == image_id).first()
 
+async def get_platform_image_async(db: AsyncSession, image_id: int):
+    """根據 ID 獲取平台圖片（非同步）"""
+    return await db.get(models.PlatformImage, image_id)
+
 def update_platform_image(db: Session, image_id: int, image: schemas.PlatformImageUpdate):
     """更新平台圖片"""
     db_image = get_platform_image(db, image_id)
@@ -748,177 +1059,403 @@ def get_platform_images_by_category(db: Session):
 db_manager = DatabaseManager() 
 
 # 在 DatabaseManager 類別後添加新的動態連線管理器
+class PooledConnection:
+    """登記在連線註冊表中的一個連線池（SQLAlchemy 引擎或資料庫客戶端）"""
+
+    def __init__(self, db_type: str, setting: dict, resource):
+        self.db_type = db_type
+        self.setting_id = setting["id"]
+        self.fingerprint = setting["fingerprint"]
+        self.resource = resource
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.last_health_check = self.created_at
+        self.borrows = 0
+        self.health_failures = 0
+
+    def close(self):
+        try:
+            if hasattr(self.resource, 'dispose'):
+                self.resource.dispose()
+            elif hasattr(self.resource, 'close'):
+                self.resource.close()
+        except Exception as e:
+            print(f"⚠️ 關閉連線時發生錯誤: {e}")
+
+    def utilization(self) -> dict:
+        """連線池使用狀況"""
+        stats = {
+            "db_type": self.db_type,
+            "setting_id": self.setting_id,
+            "borrows": self.borrows,
+            "health_failures": self.health_failures,
+            "age_seconds": time.monotonic() - self.created_at,
+            "idle_seconds": time.monotonic() - self.last_used,
+        }
+        if self.db_type == "postgresql":
+            pool = self.resource.pool
+            stats.update({
+                "pool_size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "overflow": pool.overflow(),
+            })
+        elif self.db_type == "mongodb":
+            stats["max_pool_size"] = self.resource.options.pool_options.max_pool_size
+        elif self.db_type == "influxdb":
+            stats["max_pool_size"] = self.resource.api_client.configuration.connection_pool_maxsize
+        return stats
+
+
 class DynamicDatabaseManager:
-    """動態資料庫連線管理器"""
-    
-    def __init__(self):
-        self.connections = {}  # 快取連線
-        self.settings_cache = {}  # 快取設定
-    
-    def get_connection_by_type(self, db_type: str, db_session: Session):
+    """動態資料庫連線管理器
+
+    依資料庫連線設定為每種資料庫維護一個連線池：PostgreSQL 為 SQLAlchemy
+    引擎的連線池，MongoDB 為 MongoClient 的 maxPoolSize，InfluxDB 為 HTTP
+    連線池。設定快照只在設定版本變更（本程序內的新增/更新/刪除，或定期
+    比對資料表的更新時間）時重新讀取，取用連線時不需查詢設定表。閒置超過
+    idle_ttl 的連線池會被關閉；距上次檢查超過 health_check_interval 的
+    連線在借出前會先檢查健康狀態，失敗則重建。
+    """
+
+    def __init__(self, idle_ttl: float = None, health_check_interval: float = None,
+                 settings_recheck_interval: float = None, max_pool_size: int = None):
+        self.idle_ttl = idle_ttl or float(os.getenv('DB_REGISTRY_IDLE_TTL', '600'))
+        self.health_check_interval = health_check_interval or float(os.getenv('DB_REGISTRY_HEALTH_INTERVAL', '30'))
+        self.settings_recheck_interval = settings_recheck_interval or float(os.getenv('DB_REGISTRY_SETTINGS_RECHECK', '30'))
+        self.max_pool_size = max_pool_size or int(os.getenv('DB_REGISTRY_MAX_POOL_SIZE', str(DB_POOL_SIZE + DB_MAX_OVERFLOW)))
+        self.connections: Dict[str, PooledConnection] = {}  # cache_key -> 連線池
+        self.settings_cache: Dict[str, dict] = {}  # db_type -> 設定快照
+        self.settings_version = 0
+        self._loaded_version = -1
+        self._settings_marker = None
+        self._last_settings_check = 0.0
+        self._lock = threading.RLock()
+        self._create_locks: Dict[str, threading.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.settings_loads = 0
+
+    def invalidate(self):
+        """設定已變更：下次取用時重新讀取設定快照"""
+        with self._lock:
+            self.settings_version += 1
+
+    def get_connection_by_type(self, db_type: str, db_session: Session = None):
         """根據類型獲取資料庫連線"""
         try:
-            # 從資料庫獲取設定
-            setting = database.get_database_connection_setting_by_type(db_session, db_type)
-            if not setting or not setting.is_active:
+            setting = self._get_setting(db_type, db_session)
+            if not setting:
                 return None
-            
-            # 檢查快取
-            cache_key = f"{db_type}_{setting.id}"
-            if cache_key in self.connections:
-                return self.connections[cache_key]
-            
-            # 建立新連線
-            connection = self._create_connection(setting)
-            if connection:
-                self.connections[cache_key] = connection
-                self.settings_cache[cache_key] = setting
-            
-            return connection
-            
+
+            cache_key = f"{db_type}_{setting['id']}"
+            self._evict_idle()
+            with self._lock:
+                entry = self.connections.get(cache_key)
+                create_lock = self._create_locks.setdefault(cache_key, threading.Lock())
+
+            if entry is None or entry.fingerprint != setting["fingerprint"]:
+                with create_lock:
+                    with self._lock:
+                        entry = self.connections.get(cache_key)
+                    if entry is None or entry.fingerprint != setting["fingerprint"]:
+                        entry = self._replace(cache_key, setting)
+                        if entry is None:
+                            return None
+                        with self._lock:
+                            self.misses += 1
+                        return self._borrow(entry)
+
+            if not self._check_health(entry):
+                with create_lock:
+                    entry = self._replace(cache_key, setting)
+                if entry is None:
+                    return None
+            with self._lock:
+                self.hits += 1
+            return self._borrow(entry)
+
         except Exception as e:
             print(f"❌ 建立 {db_type} 連線失敗: {e}")
             return None
-    
-    def _create_connection(self, setting):
+
+    def _borrow(self, entry: PooledConnection):
+        entry.last_used = time.monotonic()
+        entry.borrows += 1
+        return entry.resource
+
+    def _replace(self, cache_key: str, setting: dict) -> Optional[PooledConnection]:
+        """建立新的連線池並取代舊的"""
+        resource = self._create_connection(setting)
+        entry = PooledConnection(setting["db_type"], setting, resource) if resource is not None else None
+        with self._lock:
+            old = self.connections.pop(cache_key, None)
+            if entry is not None:
+                self.connections[cache_key] = entry
+        if old is not None:
+            old.close()
+        return entry
+
+    def _check_health(self, entry: PooledConnection) -> bool:
+        """距上次檢查超過 health_check_interval 時，借出前先確認連線可用"""
+        now = time.monotonic()
+        if now - entry.last_health_check < self.health_check_interval:
+            return True
+        entry.last_health_check = now
+        try:
+            self._ping(entry.db_type, entry.resource)
+            return True
+        except Exception as e:
+            entry.health_failures += 1
+            print(f"⚠️ {entry.db_type} 連線健康檢查失敗，重新建立: {e}")
+            return False
+
+    def _ping(self, db_type: str, resource):
+        if db_type == "postgresql":
+            with resource.connect() as conn:
+                conn.execute(text("SELECT 1"))
+        elif db_type == "mongodb":
+            resource.admin.command('ping')
+        elif db_type == "influxdb":
+            if not resource.ping():
+                raise ConnectionError("InfluxDB ping 失敗")
+
+    def _evict_idle(self):
+        """關閉閒置超過 idle_ttl 的連線池"""
+        now = time.monotonic()
+        with self._lock:
+            expired = [key for key, entry in self.connections.items() if now - entry.last_used > self.idle_ttl]
+            evicted = [self.connections.pop(key) for key in expired]
+            self.evictions += len(evicted)
+        for entry in evicted:
+            entry.close()
+
+    def _get_setting(self, db_type: str, db_session: Session = None) -> Optional[dict]:
+        """從設定快照取得設定；版本變更時才重新讀取設定表"""
+        if self._loaded_version != self.settings_version or self._settings_changed(db_session):
+            self._load_settings(db_session)
+        return self.settings_cache.get(db_type)
+
+    def _settings_changed(self, db_session: Session = None) -> bool:
+        """定期比對設定表的筆數與最後更新時間（其他程序修改設定時也能察覺）"""
+        now = time.monotonic()
+        if now - self._last_settings_check < self.settings_recheck_interval:
+            return False
+        self._last_settings_check = now
+        marker = self._read_settings_marker(db_session)
+        return marker != self._settings_marker
+
+    def _read_settings_marker(self, db_session: Session = None):
+        from sqlalchemy import func
+        session = db_session or SessionLocal()
+        try:
+            row = session.query(
+                func.count(models.DatabaseConnectionSettings.id),
+                func.max(models.DatabaseConnectionSettings.updated_at),
+                func.max(models.DatabaseConnectionSettings.created_at)
+            ).one()
+            return tuple(row)
+        finally:
+            if db_session is None:
+                session.close()
+
+    def _load_settings(self, db_session: Session = None):
+        session = db_session or SessionLocal()
+        try:
+            with self._lock:
+                version = self.settings_version
+            rows = session.query(models.DatabaseConnectionSettings).filter(
+                models.DatabaseConnectionSettings.is_active == True
+            ).order_by(
+                models.DatabaseConnectionSettings.is_default.desc(),
+                models.DatabaseConnectionSettings.id
+            ).all()
+            snapshot = {}
+            for row in rows:
+                if row.db_type in snapshot:
+                    continue
+                setting = {
+                    "id": row.id,
+                    "db_type": row.db_type,
+                    "host": row.host,
+                    "port": row.port,
+                    "database": row.database,
+                    "username": row.username,
+                    "password": row.password,
+                    "token": getattr(row, 'token', ''),
+                    "org": getattr(row, 'org', 'IIPlatform'),
+                }
+                setting["fingerprint"] = hash(tuple(sorted((k, str(v)) for k, v in setting.items())))
+                snapshot[row.db_type] = setting
+            marker = self._read_settings_marker(session)
+        finally:
+            if db_session is None:
+                session.close()
+
+        with self._lock:
+            self.settings_cache = snapshot
+            self._settings_marker = marker
+            self._last_settings_check = time.monotonic()
+            self._loaded_version = version
+            self.settings_loads += 1
+            # 已停用或刪除的設定，其連線池一併關閉
+            live = {f"{s['db_type']}_{s['id']}" for s in snapshot.values()}
+            stale = [self.connections.pop(key) for key in list(self.connections) if key not in live]
+        for entry in stale:
+            entry.close()
+
+    def _create_connection(self, setting: dict):
         """建立資料庫連線"""
         try:
-            if setting.db_type == "postgresql":
+            if setting["db_type"] == "postgresql":
                 return self._create_postgresql_connection(setting)
-            elif setting.db_type == "mongodb":
+            elif setting["db_type"] == "mongodb":
                 return self._create_mongodb_connection(setting)
-            elif setting.db_type == "influxdb":
+            elif setting["db_type"] == "influxdb":
                 return self._create_influxdb_connection(setting)
             else:
-                print(f"❌ 不支援的資料庫類型: {setting.db_type}")
+                print(f"❌ 不支援的資料庫類型: {setting['db_type']}")
                 return None
         except Exception as e:
-            print(f"❌ 建立 {setting.db_type} 連線失敗: {e}")
+            print(f"❌ 建立 {setting['db_type']} 連線失敗: {e}")
             return None
-    
-    def _create_postgresql_connection(self, setting):
-        """建立 PostgreSQL 連線"""
-        from sqlalchemy import create_engine
-        
+
+    def _create_postgresql_connection(self, setting: dict):
+        """建立 PostgreSQL 連線池"""
         # 建立連線字串
-        if setting.username and setting.password:
-            connection_string = f"postgresql://{setting.username}:{setting.password}@{setting.host}:{setting.port}/{setting.database}"
+        if setting["username"] and setting["password"]:
+            connection_string = (f"postgresql://{quote_plus(setting['username'])}:{quote_plus(setting['password'])}"
+                                 f"@{setting['host']}:{setting['port']}/{setting['database']}")
         else:
-            connection_string = f"postgresql://{setting.host}:{setting.port}/{setting.database}"
-        
-        # 建立引擎
-        engine = create_engine(connection_string)
-        
+            connection_string = f"postgresql://{setting['host']}:{setting['port']}/{setting['database']}"
+
+        # 建立引擎（連線池借出時以 pre-ping 檢查連線）
+        engine = create_engine(connection_string, **build_engine_options(connection_string))
+
         # 測試連線
         with engine.connect() as conn:
             conn.execute(text("SELECT 1"))
-        
+
         return engine
-    
-    def _create_mongodb_connection(self, setting):
-        """建立 MongoDB 連線"""
+
+    def _create_mongodb_connection(self, setting: dict):
+        """建立 MongoDB 連線池"""
         if not MONGODB_AVAILABLE:
             return None
-        
+
         try:
             # 建立連線字串
-            if setting.username and setting.password:
-                connection_string = f"mongodb://{setting.username}:{setting.password}@{setting.host}:{setting.port}/{setting.database}"
+            if setting["username"] and setting["password"]:
+                connection_string = (f"mongodb://{quote_plus(setting['username'])}:{quote_plus(setting['password'])}"
+                                     f"@{setting['host']}:{setting['port']}/{setting['database']}")
             else:
-                connection_string = f"mongodb://{setting.host}:{setting.port}/{setting.database}"
-            
+                connection_string = f"mongodb://{setting['host']}:{setting['port']}/{setting['database']}"
+
             # 建立客戶端
-            client = MongoClient(connection_string)
-            
+            client = MongoClient(
+                connection_string,
+                maxPoolSize=self.max_pool_size,
+                maxIdleTimeMS=int(self.idle_ttl * 1000),
+                serverSelectionTimeoutMS=DB_POOL_TIMEOUT * 1000
+            )
+
             # 測試連線
             client.admin.command('ping')
-            
+
             return client
-            
+
         except Exception as e:
             print(f"❌ MongoDB 連線失敗: {e}")
             return None
-    
-    def _create_influxdb_connection(self, setting):
-        """建立 InfluxDB 連線"""
+
+    def _create_influxdb_connection(self, setting: dict):
+        """建立 InfluxDB 連線池"""
         if not INFLUXDB_AVAILABLE:
             return None
-        
+
         try:
-            # 從設定中獲取 token 和 org
-            token = getattr(setting, 'token', '')
-            org = getattr(setting, 'org', 'IIPlatform')
-            
             # 建立客戶端
             client = InfluxDBClient(
-                url=f"http://{setting.host}:{setting.port}",
-                token=token,
-                org=org
+                url=f"http://{setting['host']}:{setting['port']}",
+                token=setting["token"] or '',
+                org=setting["org"] or 'IIPlatform',
+                timeout=DB_POOL_TIMEOUT * 1000,
+                connection_pool_maxsize=self.max_pool_size
             )
-            
+
             # 測試連線
-            health = client.health()
-            
+            client.health()
+
             return client
-            
+
         except Exception as e:
             print(f"❌ InfluxDB 連線失敗: {e}")
             return None
-    
-    def refresh_connections(self, db_session: Session):
-        """重新整理所有連線"""
+
+    def refresh_connections(self, db_session: Session = None):
+        """重新讀取設定；設定未變的連線池保留，其餘重建"""
         try:
-            # 獲取所有活躍設定
-            active_settings = database.get_active_database_connection_settings(db_session)
-            
-            # 清除舊連線
-            self.connections.clear()
-            self.settings_cache.clear()
-            
-            # 建立新連線
-            for setting in active_settings:
-                if setting.is_active:
-                    connection = self._create_connection(setting)
-                    if connection:
-                        cache_key = f"{setting.db_type}_{setting.id}"
-                        self.connections[cache_key] = connection
-                        self.settings_cache[cache_key] = setting
-            
+            self.invalidate()
+            self._load_settings(db_session)
+            for db_type in list(self.settings_cache):
+                self.get_connection_by_type(db_type, db_session)
             print(f"✅ 已重新整理 {len(self.connections)} 個資料庫連線")
-            
         except Exception as e:
             print(f"❌ 重新整理連線失敗: {e}")
-    
-    def close_all_connections(self):
-        """關閉所有連線"""
-        for connection in self.connections.values():
+
+    def get_metrics(self) -> dict:
+        """連線註冊表與各連線池的使用狀況"""
+        with self._lock:
+            entries = dict(self.connections)
+            metrics = {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "settings_loads": self.settings_loads,
+                "settings_version": self.settings_version,
+            }
+        pools = {}
+        for key, entry in entries.items():
             try:
-                if hasattr(connection, 'close'):
-                    connection.close()
+                pools[key] = entry.utilization()
             except Exception as e:
-                print(f"⚠️ 關閉連線時發生錯誤: {e}")
-        
-        self.connections.clear()
-        self.settings_cache.clear()
+                pools[key] = {"db_type": entry.db_type, "error": str(e)}
+        metrics.update({
+            "connections": len(entries),
+            "idle_ttl": self.idle_ttl,
+            "health_check_interval": self.health_check_interval,
+            "pools": pools,
+        })
+        return metrics
+
+    def close_all_connections(self):
+        """關閉所有連線"""
+        with self._lock:
+            entries = list(self.connections.values())
+            self.connections.clear()
+            self.settings_cache.clear()
+            self._loaded_version = -1
+        for entry in entries:
+            entry.close()
 
 # 建立全域動態連線管理器實例
 dynamic_db_manager = DynamicDatabaseManager()
 
 # 修改現有的函數以使用動態連線管理器
-def get_dynamic_postgres_session(db_session: Session):
+def get_dynamic_postgres_session(db_session: Session = None):
     """動態獲取 PostgreSQL 會話"""
     engine = dynamic_db_manager.get_connection_by_type("postgresql", db_session)
     if engine:
-        return sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+        return Session(bind=engine, autoflush=False)
     return None
 
-def get_dynamic_mongo_db(db_session: Session):
+def get_dynamic_mongo_db(db_session: Session = None):
     """動態獲取 MongoDB 資料庫"""
     client = dynamic_db_manager.get_connection_by_type("mongodb", db_session)
     if client:
         return client.iot_platform
     return None
 
-def get_dynamic_influx_client(db_session: Session):
+def get_dynamic_influx_client(db_session: Session = None):
     """動態獲取 InfluxDB 客戶端"""
     return dynamic_db_manager.get_connection_by_type("influxdb", db_session) 
\ No newline at end of file
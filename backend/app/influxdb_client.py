@@ -1,12 +1,117 @@
 from influxdb_client import InfluxDBClient, Point, WritePrecision
 from influxdb_client.client.write_api import SYNCHRONOUS
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Any
 import logging
+import threading
+import time
+
+from .services.timeseries_writer import timeseries_writer, is_outage
+from .services.history_query import query_history
 
 logger = logging.getLogger(__name__)
 
+class InfluxDBHealthMonitor:
+    """InfluxDB 連線健康狀態快取與斷路器
+
+    背景執行緒每隔 ttl 秒 ping 一次，寫入與查詢只讀取快取的狀態，
+    不再於熱路徑上發出網路請求。連續失敗達 failure_threshold 次後斷路器
+    打開 (open) 並快速失敗；經過 reset_timeout 秒後進入半開 (half_open)，
+    下一次探測成功才恢復為關閉 (closed)。
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, ping_func, ttl: float = None, failure_threshold: int = None, reset_timeout: float = None):
+        self.ping_func = ping_func
+        self.ttl = ttl or float(os.getenv("INFLUX_HEALTH_TTL", "5"))
+        self.failure_threshold = failure_threshold or int(os.getenv("INFLUX_FAILURE_THRESHOLD", "3"))
+        self.reset_timeout = reset_timeout or float(os.getenv("INFLUX_RESET_TIMEOUT", "30"))
+
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.last_check: Optional[datetime] = None
+        self.last_error: Optional[str] = None
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """啟動背景健康檢查執行緒"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="influx-health-monitor", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def allow_request(self) -> bool:
+        """依快取狀態決定是否放行請求，不產生網路呼叫"""
+        self.start()
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                # 放行一次試探請求
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info("InfluxDB 連線恢復，斷路器關閉")
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self.last_error = None
+
+    def record_failure(self, error: Any = None):
+        with self._lock:
+            self.consecutive_failures += 1
+            self.last_error = str(error) if error else None
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning(f"InfluxDB 無法連線，斷路器打開: {self.last_error}")
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def check(self):
+        """立即執行一次 ping 並更新狀態"""
+        try:
+            ok = self.ping_func()
+            self.last_check = datetime.utcnow()
+            if ok:
+                self.record_success()
+            else:
+                self.record_failure("ping failed")
+        except Exception as e:
+            self.last_check = datetime.utcnow()
+            self.record_failure(e)
+
+    def get_status(self) -> Dict[str, Any]:
+        """獲取健康狀態，供 /health 顯示"""
+        with self._lock:
+            return {
+                "state": self.state,
+                "healthy": self.state == self.CLOSED,
+                "consecutive_failures": self.consecutive_failures,
+                "last_check": self.last_check.isoformat() if self.last_check else None,
+                "last_error": self.last_error,
+            }
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self._lock:
+                waiting_reset = self.state == self.OPEN and time.monotonic() - self._opened_at < self.reset_timeout
+            if not waiting_reset:
+                self.check()
+            self._stop.wait(self.ttl)
+
 class InfluxDBManager:
     def __init__(self):
         self.url = os.getenv("INFLUX_URL", "http://localhost:8086")
@@ -28,23 +133,25 @@ class InfluxDBManager:
             self.client = None
             self.write_api = None
             self.query_api = None
+        
+        self.health = InfluxDBHealthMonitor(self._ping)
+        timeseries_writer.attach_health_monitor(self.health)
+    
+    def _ping(self):
+        return self.client.ping() if self.client else False
     
     def is_connected(self):
-        """檢查連線狀態"""
-        try:
-            if self.client:
-                self.client.ping()
-                return True
-            return False
-        except:
+        """檢查連線狀態（讀取健康監控的快取狀態，不發出網路請求）"""
+        if not self.client:
             return False
+        return self.health.allow_request()
     
     def write_device_sensor_data(self, device_id: str, sensor_type: str, sensor_id: str, 
                                 value: float, unit: str = "", location: str = "", 
                                 quality: str = "good", status: str = "active", 
                                 battery_level: Optional[int] = None, timestamp: Optional[datetime] = None):
         """寫入設備感測器數據"""
-        if not self.is_connected():
+        if not self.client:
             logger.warning("InfluxDB 未連線，跳過數據寫入")
             return False
             
@@ -65,7 +172,7 @@ class InfluxDBManager:
             if timestamp:
                 point = point.time(timestamp, WritePrecision.NS)
             
-            self.write_api.write(bucket=self.bucket, record=point)
+            timeseries_writer.write(point, bucket=self.bucket, org=self.org)
             logger.info(f"寫入設備感測器數據: {device_id} - {sensor_type} = {value}")
             return True
         except Exception as e:
@@ -77,7 +184,7 @@ class InfluxDBManager:
                            memory_usage: float, disk_usage: float, temperature: float,
                            uptime_seconds: int, network_latency_ms: int, timestamp: Optional[datetime] = None):
         """寫入設備狀態數據"""
-        if not self.is_connected():
+        if not self.client:
             logger.warning("InfluxDB 未連線，跳過數據寫入")
             return False
             
@@ -98,7 +205,7 @@ class InfluxDBManager:
             if timestamp:
                 point = point.time(timestamp, WritePrecision.NS)
             
-            self.write_api.write(bucket=self.bucket, record=point)
+            timeseries_writer.write(point, bucket=self.bucket, org=self.org)
             logger.info(f"寫入設備狀態數據: {device_id} - {status}")
             return True
         except Exception as e:
@@ -110,7 +217,7 @@ class InfluxDBManager:
                             error_rate: float, active_connections: int, memory_usage_mb: int,
                             cpu_usage_percent: float, timestamp: Optional[datetime] = None):
         """寫入系統效能指標"""
-        if not self.is_connected():
+        if not self.client:
             logger.warning("InfluxDB 未連線，跳過數據寫入")
             return False
             
@@ -130,7 +237,7 @@ class InfluxDBManager:
             if timestamp:
                 point = point.time(timestamp, WritePrecision.NS)
             
-            self.write_api.write(bucket=self.bucket, record=point)
+            timeseries_writer.write(point, bucket=self.bucket, org=self.org)
             logger.info(f"寫入系統效能指標: {service} - {instance}")
             return True
         except Exception as e:
@@ -142,7 +249,7 @@ class InfluxDBManager:
                          confidence: float, status: str, severity: str, features_used: int,
                          timestamp: Optional[datetime] = None):
         """寫入 AI 分析結果"""
-        if not self.is_connected():
+        if not self.client:
             logger.warning("InfluxDB 未連線，跳過數據寫入")
             return False
             
@@ -162,7 +269,7 @@ class InfluxDBManager:
             if timestamp:
                 point = point.time(timestamp, WritePrecision.NS)
             
-            self.write_api.write(bucket=self.bucket, record=point)
+            timeseries_writer.write(point, bucket=self.bucket, org=self.org)
             logger.info(f"寫入 AI 分析結果: {device_id} - {model_id}")
             return True
         except Exception as e:
@@ -174,7 +281,7 @@ class InfluxDBManager:
                          actual_value: float, status: str, acknowledged: bool,
                          resolved: bool, timestamp: Optional[datetime] = None):
         """寫入警報事件"""
-        if not self.is_connected():
+        if not self.client:
             logger.warning("InfluxDB 未連線，跳過數據寫入")
             return False
             
@@ -194,7 +301,7 @@ class InfluxDBManager:
             if timestamp:
                 point = point.time(timestamp, WritePrecision.NS)
             
-            self.write_api.write(bucket=self.bucket, record=point)
+            timeseries_writer.write(point, bucket=self.bucket, org=self.org)
             logger.info(f"寫入警報事件: {device_id} - {alert_type}")
             return True
         except Exception as e:
@@ -224,6 +331,7 @@ class InfluxDBManager:
             query += f'|> limit(n: {limit})'
             
             result = self.query_api.query(query)
+            self.health.record_success()
             
             data = []
             for table in result:
@@ -241,9 +349,40 @@ class InfluxDBManager:
             
             return data
         except Exception as e:
+            if is_outage(e):
+                self.health.record_failure(e)
             logger.error(f"查詢設備感測器數據失敗: {e}")
             return []
     
+    def query_device_sensor_series(self, device_id: str, sensor_type: Optional[str] = None,
+                                   start_time: Optional[datetime] = None, end_time: Optional[datetime] = None,
+                                   resolution: Optional[str] = None, max_points: Optional[int] = None,
+                                   method: str = "mean") -> Dict[str, Any]:
+        """查詢設備感測器數據的降採樣序列（每個感測器一組 time / values 陣列）"""
+        end_time = end_time or datetime.utcnow()
+        start_time = start_time or end_time - timedelta(hours=1)
+        if not self.is_connected():
+            logger.warning("InfluxDB 未連線，無法查詢數據")
+            return {"start": start_time.isoformat(), "stop": end_time.isoformat(), "series": []}
+
+        try:
+            result = query_history(
+                self.query_api, self.bucket, device_id, start_time, end_time,
+                resolution=resolution, max_points=max_points, method=method,
+                measurement="device_sensors", fields=["value"],
+                group_columns=("sensor_type", "sensor_id", "unit"),
+                tags={"sensor_type": sensor_type} if sensor_type else None
+            )
+            self.health.record_success()
+        except ValueError:
+            raise
+        except Exception as e:
+            if is_outage(e):
+                self.health.record_failure(e)
+            logger.error(f"查詢設備感測器數據失敗: {e}")
+            return {"start": start_time.isoformat(), "stop": end_time.isoformat(), "series": []}
+        return result
+
     def query_device_status(self, device_id: str, start_time: Optional[datetime] = None,
                            end_time: Optional[datetime] = None, limit: int = 1000) -> List[Dict[str, Any]]:
         """查詢設備狀態數據"""
@@ -262,6 +401,7 @@ class InfluxDBManager:
             '''
             
             result = self.query_api.query(query)
+            self.health.record_success()
             
             data = []
             for table in result:
@@ -280,6 +420,8 @@ class InfluxDBManager:
             
             return data
         except Exception as e:
+            if is_outage(e):
+                self.health.record_failure(e)
             logger.error(f"查詢設備狀態數據失敗: {e}")
             return []
     
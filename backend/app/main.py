@@ -1,18 +1,37 @@
-from fastapi import FastAPI, Depends, HTTPException, status, Request, File, UploadFile, Form
+from fastapi import FastAPI, Depends, HTTPException, status, Request, File, UploadFile, Form, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse, Response
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
 from datetime import datetime, timedelta
+import asyncio
 import hashlib
+import os
 import secrets
+import json
 from sqlalchemy import text
 
 from . import models
 from . import schemas
 from . import database
+from . import migrations
 from .services.data_processing_service import data_processing_service, ProcessingResult
+from .services.ingestion_service import ingestion_bridge
+from .services.timeseries_writer import timeseries_writer
+from .services.processing_pool import processing_pool
+from .services.bulk_ingest_service import bulk_ingest_service, parse_ndjson
+from .services.heartbeat_service import heartbeat_table
+from .services.ai_model_rollup_service import ai_model_rollups
+from .services.history_query import stream_history
+from .services.connection_probe_service import connection_probe_service
+from .services.index_advisor import index_advisor
+from .remote_database_tester import remote_database_tester
+from .protocols.modbus_scheduler import modbus_poll_scheduler
+from .protocols.opcua_subscription import opcua_subscription_engine
+from .influxdb_client import influxdb_manager
+from .pagination import array_response, envelope_response, check_limit
 
 # 在文件頂部添加 Pydantic 模型
 from pydantic import BaseModel
@@ -39,10 +58,51 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+def configure_database_pool():
+    """依預設資料庫連線記錄套用連線池設定"""
+    database.configure_engine_pool()
+
+@app.on_event("startup")
+def apply_schema_migrations():
+    """套用尚未執行的資料庫遷移，並開始記錄慢查詢"""
+    try:
+        migrations.run_migrations()
+    except Exception as e:
+        print(f"❌ 資料庫遷移失敗: {e}")
+    index_advisor.install()
+
+@app.on_event("shutdown")
+def shutdown_background_services():
+    """關閉背景服務並送出尚未寫入的數據"""
+    modbus_poll_scheduler.stop()
+    opcua_subscription_engine.stop()
+    ingestion_bridge.stop()
+    # 停止處理池時會收回工作程序的窗口狀態，須在保存窗口快照之前
+    processing_pool.stop()
+    heartbeat_table.stop()
+    ai_model_rollups.stop()
+    data_processing_service.save_window_snapshot()
+    timeseries_writer.close()
+    influxdb_manager.health.stop()
+    database.dynamic_db_manager.close_all_connections()
+    connection_probe_service.shutdown()
+    database.engine.dispose()
+
+@app.on_event("shutdown")
+async def close_async_engine():
+    """關閉非同步資料庫引擎"""
+    if database.async_engine is not None:
+        await database.async_engine.dispose()
+
 # 健康檢查端點
 @app.get("/health")
 def health_check():
-    return {"status": "healthy", "timestamp": datetime.now().isoformat()}
+    return {
+        "status": "healthy",
+        "timestamp": datetime.now().isoformat(),
+        "influxdb": influxdb_manager.health.get_status()
+    }
 
 # 資料庫依賴
 def get_db():
@@ -52,6 +112,13 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    """非同步資料庫會話，供 async 端點使用"""
+    if database.AsyncSessionLocal is None:
+        raise HTTPException(status_code=503, detail="非同步資料庫驅動未安裝")
+    async with database.AsyncSessionLocal() as db:
+        yield db
+
 # 認證相關
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
@@ -74,10 +141,31 @@ def create_device(device: schemas.DeviceCreate, db: Session = Depends(get_db)):
     """創建設備"""
     return database.create_device(db, device)
 
-@app.get("/devices/", response_model=List[schemas.Device])
-def list_devices(category_id: Optional[int] = None, db: Session = Depends(get_db)):
-    """獲取設備列表"""
-    return database.get_devices(db, category_id)
+@app.get("/devices/")
+def list_devices(
+    category_id: Optional[int] = None,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    fields: Optional[str] = None
+):
+    """獲取設備列表（游標分頁，fields 以逗號分隔，下一頁游標在 X-Next-Cursor 標頭）"""
+    try:
+        stmt = database.query_devices_page(category_id, fields, cursor, check_limit(limit))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return array_response(
+        database.get_postgres_session, stmt, database.DEVICE_SORT_KEY, limit, database.overlay_device_state
+    )
+
+@app.get("/devices/last-seen")
+def get_devices_last_seen(device_ids: Optional[str] = None):
+    """從記憶體讀取設備最後上線時間與狀態（device_ids 以逗號分隔）"""
+    ids = [d for d in device_ids.split(",") if d] if device_ids else None
+    return {
+        "success": True,
+        "data": heartbeat_table.snapshot(ids),
+        "metrics": heartbeat_table.get_metrics()
+    }
 
 @app.patch("/devices/{device_id}", response_model=schemas.Device)
 def update_device(device_id: int, update: schemas.DeviceUpdate, db: Session = Depends(get_db)):
@@ -104,9 +192,14 @@ def list_device_categories(
     return database.get_device_categories(db, parent_id, include_inactive)
 
 @app.get("/device-categories/tree")
-def get_device_category_tree(db: Session = Depends(get_db)):
-    """獲取設備類別樹狀結構"""
-    return database.get_device_category_tree(db)
+def get_device_category_tree(request: Request, db: Session = Depends(get_db)):
+    """獲取設備類別樹狀結構（帶 ETag，未變更時回傳 304）"""
+    body, etag = database.get_device_category_tree_cached(db)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if if_none_match.strip() == "*" or etag in [t.strip().removeprefix("W/") for t in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 @app.get("/device-categories/{category_id}", response_model=schemas.DeviceCategoryOut)
 def get_device_category(category_id: int, db: Session = Depends(get_db)):
@@ -183,6 +276,7 @@ def update_database_connection(connection_id: int, connection: schemas.DatabaseC
     
     db.commit()
     db.refresh(db_connection)
+    database.configure_engine_pool(db)
     return db_connection
 
 @app.delete("/database-connections/{connection_id}")
@@ -238,10 +332,19 @@ def read_users_me(current_user: models.User = Depends(get_current_user)):
     return current_user
 
 # 警報管理 API
-@app.get("/alerts/", response_model=List[schemas.AlertOut])
-def get_alerts(device_id: int = None, db: Session = Depends(get_db)):
-    """獲取警報列表"""
-    return database.get_alerts(db, device_id)
+@app.get("/alerts/")
+def get_alerts(
+    device_id: int = None,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    fields: Optional[str] = None
+):
+    """獲取警報列表（游標分頁，下一頁游標在 X-Next-Cursor 標頭）"""
+    try:
+        stmt = database.query_alerts_page(device_id, fields, cursor, check_limit(limit))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return array_response(database.get_postgres_session, stmt, database.ALERT_SORT_KEY, limit)
 
 # 數據接收 API
 @app.post("/data/")
@@ -249,10 +352,86 @@ def receive_data(data: schemas.DeviceData, db: Session = Depends(get_db)):
     """接收設備數據"""
     return database.create_device_data(data.device_id, data.dict())
 
-@app.get("/history/", response_model=List[schemas.DeviceData])
-def get_history(device_id: int, db: Session = Depends(get_db)):
-    """獲取設備歷史數據"""
-    return database.get_device_history(device_id)
+@app.post("/data/bulk", status_code=status.HTTP_202_ACCEPTED)
+@app.post("/api/v1/data-processing/bulk-ingest", status_code=status.HTTP_202_ACCEPTED)
+async def receive_bulk_data(request: Request, background_tasks: BackgroundTasks, source_id: Optional[str] = None):
+    """批量接收設備數據
+
+    請求內容可為 JSON 陣列、{"readings": [...]} 或 NDJSON（application/x-ndjson）。
+    指定 source_id 時會先經過該數據源的處理管道再寫入。
+    """
+    body = await request.body()
+    try:
+        if "ndjson" in request.headers.get("content-type", ""):
+            readings = parse_ndjson(body)
+        else:
+            payload = json.loads(body or b"[]")
+            readings = payload.get("readings", []) if isinstance(payload, dict) else payload
+        if not isinstance(readings, list):
+            raise ValueError("readings 必須是陣列")
+        submitted = bulk_ingest_service.submit(readings, source_id=source_id)
+    except (ValueError, json.JSONDecodeError) as e:
+        raise HTTPException(status_code=400, detail=f"數據格式錯誤: {str(e)}")
+
+    batch = submitted["batch"]
+    if not batch["accepted"]:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail={"message": "沒有有效的讀值", "received": batch["received"], "errors": batch["errors"]},
+        )
+    background_tasks.add_task(bulk_ingest_service.run_batch, batch["batch_id"], submitted["frame"], source_id)
+    return {"success": True, **batch}
+
+@app.get("/api/v1/data-processing/bulk-ingest/{batch_id}")
+async def get_bulk_ingest_batch(batch_id: str):
+    """查詢批量接收的批次狀態"""
+    batch = bulk_ingest_service.get_batch(batch_id)
+    if not batch:
+        raise HTTPException(status_code=404, detail="批次不存在")
+    return {"success": True, "data": batch}
+
+@app.get("/history/")
+def get_history(
+    device_id: str,
+    hours: int = 24,
+    resolution: Optional[str] = None,
+    max_points: Optional[int] = None,
+    method: str = "mean",
+    fields: Optional[str] = None
+):
+    """獲取設備歷史數據
+
+    在 InfluxDB 端依視窗聚合（resolution 如 1m、1h；未指定時依 max_points
+    平均切分），method 為 mean/min/max/last 等聚合函數或 lttb。每個序列
+    （measurement、field 與標籤）回傳序列鍵及一組 time（epoch 毫秒）與 values 陣列。
+    """
+    try:
+        result = database.get_device_history(
+            device_id, hours, resolution, max_points, method,
+            [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return StreamingResponse(stream_history(result), media_type="application/json")
+
+@app.get("/api/v1/devices/{device_id}/sensor-history")
+def get_device_sensor_history(
+    device_id: str,
+    sensor_type: Optional[str] = None,
+    hours: int = 1,
+    resolution: Optional[str] = None,
+    max_points: Optional[int] = None,
+    method: str = "mean"
+):
+    """獲取設備感測器的降採樣序列（每個感測器一組 time / values 陣列）"""
+    try:
+        start_time = datetime.utcnow() - timedelta(hours=hours)
+        result = influxdb_manager.query_device_sensor_series(
+            device_id, sensor_type, start_time, None, resolution, max_points, method
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return StreamingResponse(stream_history(result), media_type="application/json")
 
 # 新增登入相關的 API 端點
 @app.post("/api/v1/auth/login")
@@ -330,45 +509,49 @@ def get_permissions_by_role(role):
     }
     return permissions.get(role, permissions['viewer'])
 
+def _ping_postgresql():
+    db = database.get_postgres_session()
+    try:
+        db.execute(text("SELECT 1"))
+    finally:
+        db.close()
+    return {'success': True, 'message': 'PostgreSQL 連線正常'}
+
+def _ping_mongodb():
+    mongo_db = database.get_mongo_db()
+    if mongo_db is None:
+        return {'success': False, 'message': 'MongoDB 客戶端未初始化'}
+    mongo_db.command('ping')
+    return {'success': True, 'message': 'MongoDB 連線正常'}
+
+def _ping_influxdb():
+    influx_client = database.get_influx_client()
+    if not influx_client:
+        return {'success': False, 'message': 'InfluxDB 客戶端未初始化'}
+    influx_client.health()
+    return {'success': True, 'message': 'InfluxDB 連線正常'}
+
+DATABASE_PINGS = {
+    'postgresql': _ping_postgresql,
+    'mongodb': _ping_mongodb,
+    'influxdb': _ping_influxdb,
+}
+
 async def test_selected_databases(selected_databases):
-    """測試選定的資料庫"""
-    results = {}
-    
-    if selected_databases.get('postgresql'):
-        try:
-            # 測試 PostgreSQL 連線
-            db = database.get_postgres_session()
-            db.execute(text("SELECT 1"))
-            db.close()
-            results['postgresql'] = {'status': 'success', 'message': 'PostgreSQL 連線正常'}
-        except Exception as e:
-            results['postgresql'] = {'status': 'error', 'message': f'PostgreSQL 連線失敗: {str(e)}'}
-    
-    if selected_databases.get('mongodb'):
-        try:
-            # 測試 MongoDB 連線
-            mongo_db = database.get_mongo_db()
-            if mongo_db:
-                mongo_db.command('ping')
-                results['mongodb'] = {'status': 'success', 'message': 'MongoDB 連線正常'}
-            else:
-                results['mongodb'] = {'status': 'error', 'message': 'MongoDB 客戶端未初始化'}
-        except Exception as e:
-            results['mongodb'] = {'status': 'error', 'message': f'MongoDB 連線失敗: {str(e)}'}
-    
-    if selected_databases.get('influxdb'):
-        try:
-            # 測試 InfluxDB 連線
-            influx_client = database.get_influx_client()
-            if influx_client:
-                health = influx_client.health()
-                results['influxdb'] = {'status': 'success', 'message': 'InfluxDB 連線正常'}
-            else:
-                results['influxdb'] = {'status': 'error', 'message': 'InfluxDB 客戶端未初始化'}
-        except Exception as e:
-            results['influxdb'] = {'status': 'error', 'message': f'InfluxDB 連線失敗: {str(e)}'}
-    
-    return results
+    """並行測試選定的資料庫"""
+    probes = {
+        db_type: (ping, (), None)
+        for db_type, ping in DATABASE_PINGS.items() if selected_databases.get(db_type)
+    }
+    results = await connection_probe_service.probe_many(probes)
+    return {
+        db_type: {
+            'status': 'success' if result.get('success') else 'error',
+            'message': result.get('message') if result.get('success') or not result.get('error')
+            else f"{result.get('message')}: {result.get('error')}"
+        }
+        for db_type, result in results.items()
+    }
 
 @app.post("/api/v1/auth/logout")
 async def logout():
@@ -459,6 +642,7 @@ async def update_database_connection(connection_id: int, connection: dict):
                     setattr(db_connection, key, value)
             
             db.commit()
+            database.configure_engine_pool(db)
             
             return {
                 "success": True,
@@ -512,14 +696,14 @@ async def delete_database_connection(connection_id: int):
 
 @app.post("/api/v1/database-connections/initialize")
 async def initialize_databases(selected_databases: dict):
-    """初始化選定的資料庫"""
+    """初始化選定的資料庫（各資料庫並行初始化）"""
     try:
-        results = {}
-        
-        for db_type, enabled in selected_databases.items():
-            if enabled:
-                result = await initialize_database_by_type(db_type)
-                results[db_type] = result
+        timeout = float(os.getenv("DB_INIT_TIMEOUT", "60"))
+        probes = {
+            db_type: (initialize_database_by_type, (db_type,), None)
+            for db_type, enabled in selected_databases.items() if enabled
+        }
+        results = await connection_probe_service.probe_many(probes, overall_timeout=timeout, timeout=timeout)
         
         return {
             "success": True,
@@ -549,10 +733,10 @@ async def process_mqtt_data(topic: str, payload: dict):
         raise HTTPException(status_code=500, detail=f"處理失敗: {str(e)}")
 
 @app.post("/api/v1/data-processing/process-modbus")
-async def process_modbus_data(device_id: str, registers: List[int]):
-    """處理 Modbus 數據"""
+async def process_modbus_data(device_id: str, registers: List[int], start_address: Optional[int] = None):
+    """處理 Modbus 數據（依 register_mappings 解碼成工程值）"""
     try:
-        result = await data_processing_service.process_modbus_data(device_id, registers)
+        result = await data_processing_service.process_modbus_data(device_id, registers, start_address)
         if result.success:
             data_processing_service.save_processing_result(result)
         return {
@@ -566,6 +750,46 @@ async def process_modbus_data(device_id: str, registers: List[int]):
         # logger.error(f"處理 Modbus 數據失敗: {str(e)}") # Original code had this line commented out
         raise HTTPException(status_code=500, detail=f"處理失敗: {str(e)}")
 
+@app.get("/api/v1/modbus/polling")
+async def get_modbus_polling_status():
+    """獲取 Modbus 輪詢狀態與請求數指標"""
+    return {"success": True, "data": modbus_poll_scheduler.get_status()}
+
+@app.post("/api/v1/modbus/polling/start")
+def start_modbus_polling():
+    """依 Modbus 設備的連線設定啟動輪詢"""
+    try:
+        modbus_poll_scheduler.start()
+        return {"success": True, "data": modbus_poll_scheduler.get_status()}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"啟動失敗: {str(e)}")
+
+@app.post("/api/v1/modbus/polling/stop")
+def stop_modbus_polling():
+    """停止 Modbus 輪詢"""
+    modbus_poll_scheduler.stop()
+    return {"success": True, "data": modbus_poll_scheduler.get_status()}
+
+@app.get("/api/v1/opcua/subscriptions")
+async def get_opcua_subscription_status():
+    """獲取 OPC UA 訂閱狀態與通知指標"""
+    return {"success": True, "data": opcua_subscription_engine.get_status()}
+
+@app.post("/api/v1/opcua/subscriptions/start")
+def start_opcua_subscriptions():
+    """依 OPC UA 設備的連線設定建立訂閱"""
+    try:
+        opcua_subscription_engine.start()
+        return {"success": True, "data": opcua_subscription_engine.get_status()}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"啟動失敗: {str(e)}")
+
+@app.post("/api/v1/opcua/subscriptions/stop")
+def stop_opcua_subscriptions():
+    """停止 OPC UA 訂閱"""
+    opcua_subscription_engine.stop()
+    return {"success": True, "data": opcua_subscription_engine.get_status()}
+
 @app.post("/api/v1/data-processing/process-database")
 async def process_database_data(source_id: str, query_result: dict):
     """處理資料庫查詢結果"""
@@ -584,6 +808,23 @@ async def process_database_data(source_id: str, query_result: dict):
         # logger.error(f"處理資料庫數據失敗: {str(e)}") # Original code had this line commented out
         raise HTTPException(status_code=500, detail=f"處理失敗: {str(e)}")
 
+@app.post("/api/v1/data-processing/process-batch")
+async def process_batch_data(source_id: str, records: List[dict]):
+    """以向量化方式批次處理多筆記錄"""
+    try:
+        result = await data_processing_service.process_batch(source_id, records)
+        return {
+            "success": result.success,
+            "records": result.to_records(),
+            "keep_mask": result.keep_mask.tolist(),
+            "dropped": int((~result.keep_mask).sum()),
+            "metadata": result.metadata,
+            "error_message": result.error_message,
+            "processing_time": result.processing_time
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"處理失敗: {str(e)}")
+
 @app.post("/api/v1/data-processing/add-data-source")
 async def add_data_source(source_config: dict):
     """添加數據源配置"""
@@ -599,15 +840,26 @@ async def add_data_source(source_config: dict):
         raise HTTPException(status_code=500, detail=f"添加失敗: {str(e)}")
 
 @app.post("/api/v1/data-processing/set-pipeline")
-async def set_processing_pipeline(pipeline: List[str]):
-    """設置處理管道"""
+async def set_processing_pipeline(pipeline: List[str], source_id: Optional[str] = None, source_type: Optional[str] = None):
+    """設置處理管道（可只綁定指定數據源或數據源類型）"""
     try:
-        data_processing_service.set_processing_pipeline(pipeline)
+        data_processing_service.set_processing_pipeline(pipeline, source_id=source_id, source_type=source_type)
         return {"success": True, "message": "處理管道設置成功", "pipeline": pipeline}
     except Exception as e:
         # logger.error(f"設置處理管道失敗: {str(e)}") # Original code had this line commented out
         raise HTTPException(status_code=500, detail=f"設置失敗: {str(e)}")
 
+@app.delete("/api/v1/data-processing/pipeline-bindings")
+async def clear_processing_pipeline(source_id: Optional[str] = None, source_type: Optional[str] = None):
+    """移除數據源或數據源類型的管道綁定"""
+    if source_id is None and source_type is None:
+        raise HTTPException(status_code=400, detail="需要 source_id 或 source_type")
+    try:
+        removed = data_processing_service.clear_processing_pipeline(source_id=source_id, source_type=source_type)
+        return {"success": removed, "message": "管道綁定已移除" if removed else "找不到管道綁定"}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"移除失敗: {str(e)}")
+
 @app.get("/api/v1/data-processing/available-processors")
 async def get_available_processors():
     """獲取可用的處理器列表"""
@@ -642,7 +894,8 @@ async def get_processing_pipeline():
     try:
         return {
             "success": True,
-            "pipeline": data_processing_service.processing_pipeline
+            "pipeline": data_processing_service.processing_pipeline,
+            "bindings": data_processing_service.get_pipeline_bindings()
         }
     except Exception as e:
         # logger.error(f"獲取處理管道失敗: {str(e)}") # Original code had this line commented out
@@ -696,6 +949,106 @@ async def get_default_pipelines():
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"獲取失敗: {str(e)}")
 
+@app.get("/api/v1/data-processing/pipeline-plans")
+async def get_pipeline_plans():
+    """獲取已編譯處理計畫的統計"""
+    try:
+        return {
+            "success": True,
+            "data": data_processing_service.get_plan_stats()
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"獲取失敗: {str(e)}")
+
+@app.get("/api/v1/data-processing/windows")
+async def get_window_stats():
+    """獲取串流窗口狀態統計"""
+    try:
+        return {
+            "success": True,
+            "data": data_processing_service.get_window_stats()
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"獲取失敗: {str(e)}")
+
+@app.get("/api/v1/data-processing/pool-metrics")
+async def get_pool_metrics():
+    """獲取多程序處理池的各工作程序指標"""
+    try:
+        return {
+            "success": True,
+            "metrics": data_processing_service.get_pool_metrics()
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"獲取失敗: {str(e)}")
+
+@app.post("/api/v1/data-processing/execution-mode")
+async def set_execution_mode(mode: str):
+    """切換批次處理執行模式（inline 或 process）"""
+    try:
+        # 停止處理池需等待工作程序結束，不在事件迴圈中執行
+        await asyncio.get_running_loop().run_in_executor(None, data_processing_service.set_execution_mode, mode)
+        return {"success": True, "execution_mode": mode}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"設置失敗: {str(e)}")
+
+@app.get("/api/v1/data-processing/ingestion-metrics")
+async def get_ingestion_metrics():
+    """獲取數據接收佇列指標"""
+    try:
+        return {
+            "success": True,
+            "metrics": ingestion_bridge.get_metrics()
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"獲取失敗: {str(e)}")
+
+@app.get("/api/v1/data-processing/writer-metrics")
+async def get_writer_metrics():
+    """獲取 InfluxDB 批次寫入指標"""
+    try:
+        return {
+            "success": True,
+            "metrics": timeseries_writer.get_metrics()
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"獲取失敗: {str(e)}")
+
+@app.get("/api/v1/database/pool-status")
+async def get_database_pool_status():
+    """獲取資料庫連線池使用狀況"""
+    try:
+        return {
+            "success": True,
+            "pool": database.get_pool_status(),
+            "registry": database.dynamic_db_manager.get_metrics(),
+            "probes": connection_probe_service.get_metrics()
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"獲取失敗: {str(e)}")
+
+@app.get("/api/v1/admin/index-advisor")
+async def get_index_advisor(limit: int = 50):
+    """獲取慢查詢指紋與缺少的索引建議"""
+    try:
+        return {
+            "success": True,
+            "stats": index_advisor.get_stats(),
+            "slow_queries": index_advisor.get_slow_queries(limit),
+            "suggestions": index_advisor.suggest(),
+            "migrations": migrations.get_migration_status()
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"獲取失敗: {str(e)}")
+
+@app.delete("/api/v1/admin/index-advisor")
+async def reset_index_advisor():
+    """清除已記錄的慢查詢"""
+    index_advisor.reset()
+    return {"success": True, "message": "已清除慢查詢記錄"}
+
 # 輔助函數
 def generate_connection_string(connection):
     """生成資料庫連線字串"""
@@ -881,7 +1234,7 @@ async def test_remote_connection(connection):
             "error": str(e)
         }
 
-async def initialize_database_by_type(db_type):
+def initialize_database_by_type(db_type):
     """根據類型初始化資料庫"""
     try:
         if db_type == "postgresql":
@@ -1011,10 +1364,10 @@ async def first_time_setup(setup_data: schemas.FirstTimeSetup, db: Session = Dep
         }
 
 @app.get("/api/v1/database-connection-settings/")
-async def get_database_connection_settings(db: Session = Depends(get_db)):
+async def get_database_connection_settings(db: AsyncSession = Depends(get_async_db)):
     """獲取所有資料庫連線設定"""
     try:
-        settings = database.get_database_connection_settings(db)
+        settings = await database.get_database_connection_settings_async(db)
         return {
             "success": True,
             "settings": [schemas.DatabaseConnectionSettingsOut.from_orm(s) for s in settings]
@@ -1125,10 +1478,10 @@ async def create_ai_model(
         }
 
 @app.get("/api/v1/ai-models/{model_id}")
-async def get_ai_model(model_id: int, db: Session = Depends(get_db)):
+async def get_ai_model(model_id: int, db: AsyncSession = Depends(get_async_db)):
     """獲取單個 AI Model"""
     try:
-        model = database.get_ai_model(db, model_id)
+        model = await database.get_ai_model_async(db, model_id)
         if model:
             return {
                 "success": True,
@@ -1258,15 +1611,18 @@ async def get_ai_model_usage(
     model_id: int,
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None
 ):
-    """獲取 AI Model 使用記錄"""
+    """獲取 AI Model 使用記錄（以 cursor 翻頁；fields 可略過 input_data/output_data 等大欄位）"""
     try:
-        usage_records = database.get_ai_model_usage(db, model_id, skip, limit)
-        return {
-            "success": True,
-            "usage_records": [schemas.AIModelUsageOut.from_orm(u) for u in usage_records]
-        }
+        stmt = database.query_ai_model_usage_page(model_id, fields, cursor, check_limit(limit))
+        if skip and not cursor:
+            # 舊的 OFFSET 翻頁，保留相容
+            stmt = stmt.offset(skip)
+        return envelope_response(
+            database.get_postgres_session, "usage_records", stmt, database.AI_MODEL_USAGE_SORT_KEY, limit
+        )
     except Exception as e:
         return {
             "success": False,
@@ -1277,15 +1633,19 @@ async def get_ai_model_usage(
 async def get_ai_model_performance(
     model_id: int,
     hours: int = 24,
+    resolution: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
-    """獲取 AI Model 性能記錄"""
+    """獲取 AI Model 性能分桶（resolution 如 1m、5m、1h、1d；未指定時依 hours 自動選擇）"""
     try:
-        performance_records = database.get_ai_model_performance(db, model_id, hours)
+        resolution, buckets = database.get_ai_model_performance(db, model_id, hours, resolution)
         return {
             "success": True,
-            "performance_records": [schemas.AIModelPerformanceOut.from_orm(p) for p in performance_records]
+            "resolution": resolution,
+            "buckets": buckets
         }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         return {
             "success": False,
@@ -1312,11 +1672,11 @@ async def get_ai_model_stats(db: Session = Depends(get_db)):
 async def get_platform_content(
     section: str = None,
     content_type: str = None,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """獲取平台內容"""
     try:
-        contents = database.get_platform_content(db, section, content_type)
+        contents = await database.get_platform_content_async(db, section, content_type)
         return {
             "success": True,
             "contents": [schemas.PlatformContentOut.from_orm(c) for c in contents]
@@ -1413,15 +1773,16 @@ async def delete_platform_content(content_id: int, db: Session = Depends(get_db)
 async def get_platform_images(
     category: str = None,
     is_active: bool = True,
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    fields: Optional[str] = None
 ):
-    """獲取平台圖片"""
+    """獲取平台圖片（游標分頁，依建立時間由新到舊）"""
     try:
-        images = database.get_platform_images(db, category, is_active)
-        return {
-            "success": True,
-            "images": [schemas.PlatformImageOut.from_orm(img) for img in images]
-        }
+        stmt = database.query_platform_images_page(category, is_active, fields, cursor, check_limit(limit))
+        return envelope_response(
+            database.get_postgres_session, "images", stmt, database.PLATFORM_IMAGE_SORT_KEY, limit
+        )
     except Exception as e:
         return {
             "success": False,
@@ -1429,10 +1790,10 @@ async def get_platform_images(
         }
 
 @app.get("/api/v1/platform-images/{image_id}")
-async def get_platform_image(image_id: int, db: Session = Depends(get_db)):
+async def get_platform_image(image_id: int, db: AsyncSession = Depends(get_async_db)):
     """獲取單個平台圖片"""
     try:
-        image = database.get_platform_image(db, image_id)
+        image = await database.get_platform_image_async(db, image_id)
         if image:
             return {
                 "success": True,
@@ -1623,14 +1984,28 @@ async def serve_image(category: str, filename: str):
     except Exception as e:
         raise HTTPException(status_code=404, detail="圖片不存在") 
 
+@app.post("/api/v1/database-connections/test-batch")
+async def test_database_connections_batch(connections: List[dict], stream: bool = True, overall_timeout: float = None):
+    """並行測試多個資料庫連線；stream 為 True 時以 NDJSON 依完成順序逐筆回傳"""
+    if stream:
+        async def generate():
+            async for result in remote_database_tester.stream_connections(connections, overall_timeout):
+                yield json.dumps(result, ensure_ascii=False, default=str) + "\n"
+        return StreamingResponse(generate(), media_type="application/x-ndjson")
+    try:
+        results = await remote_database_tester.test_connections(connections, overall_timeout)
+        return {
+            "success": all(r.get("success") for r in results.values()),
+            "data": results
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"測試連線失敗: {str(e)}")
+
 # 在現有的測試端點後添加新的端點
 @app.post("/api/v1/database-connections/{db_type}/test")
 async def test_database_connection_by_type(db_type: str, connection_data: dict):
     """根據資料庫類型測試連線"""
     try:
-        import time
-        start_time = time.time()
-        
         print(f"收到的連線數據: {connection_data}")  # 調試用
         print(f"數據類型: {type(connection_data)}")  # 調試用
         print(f"數據鍵值: {list(connection_data.keys())}")  # 調試用
@@ -1667,115 +2042,18 @@ async def test_database_connection_by_type(db_type: str, connection_data: dict):
         connection_data.setdefault("username", "")
         connection_data.setdefault("password", "")
         
-        # 生成連線字串
-        connection_string = generate_connection_string(connection_data)
-        print(f"生成的連線字串: {connection_string}")  # 調試用
-        
-        # 根據資料庫類型進行測試
-        if db_type == "postgresql":
-            try:
-                import psycopg2
-                from psycopg2 import OperationalError
-                
-                conn = psycopg2.connect(connection_string)
-                conn.close()
-                response_time = (time.time() - start_time) * 1000
-                
-                return {
-                    "success": True,
-                    "message": "PostgreSQL 連線成功",
-                    "data": {
-                        "response_time": response_time,
-                        "error": ""
-                    }
-                }
-            except OperationalError as e:
-                return {
-                    "success": False,
-                    "message": "PostgreSQL 連線失敗",
-                    "data": {
-                        "response_time": 0,
-                        "error": str(e)
-                    }
-                }
-            except Exception as e:
-                return {
-                    "success": False,
-                    "message": f"PostgreSQL 連線測試失敗: {str(e)}",
-                    "data": {
-                        "response_time": 0,
-                        "error": str(e)
-                    }
-                }
-        
-        elif db_type == "mongodb":
-            try:
-                from pymongo import MongoClient
-                from pymongo.errors import ConnectionFailure
-                
-                client = MongoClient(connection_string, serverSelectionTimeoutMS=5000)
-                client.admin.command('ping')
-                client.close()
-                
-                response_time = (time.time() - start_time) * 1000
-                return {
-                    "success": True,
-                    "message": "MongoDB 連線成功",
-                    "data": {
-                        "response_time": response_time,
-                        "error": ""
-                    }
-                }
-            except ConnectionFailure as e:
-                return {
-                    "success": False,
-                    "message": "MongoDB 連線失敗",
-                    "data": {
-                        "response_time": 0,
-                        "error": str(e)
-                    }
-                }
-        
-        elif db_type == "influxdb":
-            try:
-                from influxdb_client import InfluxDBClient
-                
-                url = f"http://{connection_data.get('host')}:{connection_data.get('port')}"
-                token = connection_data.get('token', '')
-                org = connection_data.get('org', 'IIPlatform')
-                
-                client = InfluxDBClient(url=url, token=token, org=org, timeout=5000)
-                health = client.health()
-                client.close()
-                
-                response_time = (time.time() - start_time) * 1000
-                return {
-                    "success": True,
-                    "message": "InfluxDB 連線成功",
-                    "data": {
-                        "response_time": response_time,
-                        "error": ""
-                    }
-                }
-            except Exception as e:
-                return {
-                    "success": False,
-                    "message": "InfluxDB 連線失敗",
-                    "data": {
-                        "response_time": 0,
-                        "error": str(e)
-                    }
-                }
-        
-        else:
-            return {
-                "success": False,
-                "message": f"不支援的資料庫類型: {db_type}",
-                "data": {
-                    "response_time": 0,
-                    "error": f"不支援的資料庫類型: {db_type}"
-                }
+        # 在探測執行緒池中測試，避免阻塞事件迴圈
+        result = await remote_database_tester.test_connection(connection_data)
+        return {
+            "success": result["success"],
+            "message": result.get("message", ""),
+            "data": {
+                "response_time": result.get("response_time", 0) if result["success"] else 0,
+                "error": result.get("error", ""),
+                "timed_out": result.get("timed_out", False),
+                "cached": result.get("cached", False)
             }
+        }
         
     except Exception as e:
         print(f"測試連線時發生錯誤: {str(e)}")  # 調試用
@@ -1839,55 +2117,17 @@ async def create_database_connection_by_type(db_type: str, connection_data: dict
 
 # 在現有的 database-connections 端點後添加 GET 端點
 @app.get("/api/v1/database-connections/")
-async def list_database_connections_api():
-    """獲取資料庫連線列表"""
+async def list_database_connections_api(
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    fields: Optional[str] = None
+):
+    """獲取資料庫連線列表（游標分頁）"""
     try:
-        from .database import get_postgres_session
-        
-        db = get_postgres_session()
-        try:
-            connections = db.query(models.DatabaseConnection).all()
-            
-            return {
-                "success": True,
-                "data": [
-                    {
-                        "id": conn.id,
-                        "name": conn.name,
-                        "db_type": conn.db_type,
-                        "host": conn.host,
-                        "port": conn.port,
-                        "database": conn.database,
-                        "username": conn.username,
-                        "is_active": conn.is_active,
-                        "is_default": conn.is_default,
-                        "description": conn.description,
-                        "last_test_time": conn.last_test_time,
-                        "last_test_result": conn.last_test_result,
-                        "last_test_error": conn.last_test_error,
-                        "response_time": conn.response_time,
-                        # MongoDB 特定欄位
-                        "auth_source": conn.auth_source,
-                        "auth_mechanism": conn.auth_mechanism,
-                        "replica_set": conn.replica_set,
-                        "ssl_enabled": conn.ssl_enabled,
-                        # InfluxDB 特定欄位
-                        "token": conn.token,
-                        "org": conn.org,
-                        "bucket": conn.bucket,
-                        # 連線設定
-                        "timeout": conn.timeout,
-                        "retry_attempts": conn.retry_attempts,
-                        "connection_pool_size": conn.connection_pool_size
-                    }
-                    for conn in connections
-                ]
-            }
-        except Exception as e:
-            return {"success": False, "message": f"獲取連線列表失敗: {str(e)}"}
-        finally:
-            db.close()
-            
+        stmt = database.query_database_connections_page(fields, cursor, check_limit(limit))
+        return envelope_response(
+            database.get_postgres_session, "data", stmt, database.DATABASE_CONNECTION_SORT_KEY, limit
+        )
     except Exception as e:
         return {"success": False, "message": f"獲取連線列表失敗: {str(e)}"}
 
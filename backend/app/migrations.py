@@ -0,0 +1,124 @@
+"""
+資料庫結構遷移
+
+create_all 只會建立不存在的資料表，已存在的資料表不會補上新的索引；
+這裡依序套用尚未執行的遷移，並記錄在 schema_migrations 表。
+"""
+
+from typing import Callable, List, Tuple
+
+from sqlalchemy import inspect, select, text
+
+from . import models
+
+
+def _create_indexes(*index_names: str) -> Callable:
+    """建立 models.py 中宣告的索引（資料表不存在或索引已存在時略過）"""
+    def apply(connection):
+        existing_tables = set(inspect(connection).get_table_names())
+        created = []
+        for table in models.Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            for index in table.indexes:
+                if index.name in index_names:
+                    index.create(connection, checkfirst=True)
+                    created.append(index.name)
+        return created
+    return apply
+
+
+def _build_ai_model_rollups(connection):
+    """建立 AI Model 彙總表，並由既有的原始記錄回填分桶"""
+    from sqlalchemy.orm import Session
+    from .services.ai_model_rollup_service import ai_model_rollups
+
+    existing_tables = set(inspect(connection).get_table_names())
+    if "ai_models" not in existing_tables:
+        # 新資料庫由 create_all 建立
+        return
+    models.AIModelRollup.__table__.create(connection, checkfirst=True)
+    if {"ai_model_usage", "ai_model_performance"} <= existing_tables:
+        db = Session(bind=connection)
+        ai_model_rollups.backfill(db)
+        db.flush()
+
+
+def _add_permission_tables(connection):
+    """建立用戶權限、資源權限與權限分類表，並在既有的 permissions 表補上 category_id"""
+    for model in (models.PermissionCategory, models.UserPermission, models.ResourcePermission):
+        model.__table__.create(connection, checkfirst=True)
+    inspector = inspect(connection)
+    if "permissions" in inspector.get_table_names():
+        columns = {column["name"] for column in inspector.get_columns("permissions")}
+        if "category_id" not in columns:
+            connection.execute(text(
+                "ALTER TABLE permissions ADD COLUMN category_id INTEGER REFERENCES permission_categories(id)"
+            ))
+
+
+# (遷移 ID, 說明, 套用函數)，依 ID 順序執行
+MIGRATIONS: List[Tuple[str, str, Callable]] = [
+    (
+        "0001_hot_path_indexes",
+        "熱門查詢路徑的複合索引",
+        _create_indexes(
+            "ix_alerts_device_id_id",
+            "ix_ai_model_usage_model_created",
+            "ix_ai_model_performance_model_timestamp",
+            "ix_platform_content_active_section_order",
+            "ix_device_categories_parent_active",
+            "ix_devices_category_id_id",
+        ),
+    ),
+    (
+        "0002_ai_model_rollups",
+        "AI Model 使用與性能的時間分桶彙總",
+        _build_ai_model_rollups,
+    ),
+    (
+        "0003_permission_tables",
+        "用戶特定權限、資源權限與權限分類",
+        _add_permission_tables,
+    ),
+]
+
+
+def run_migrations(engine=None) -> List[str]:
+    """套用尚未執行的遷移，回傳本次套用的遷移 ID"""
+    if engine is None:
+        from .database import engine
+    models.SchemaMigration.__table__.create(engine, checkfirst=True)
+    with engine.connect() as connection:
+        applied = set(connection.execute(select(models.SchemaMigration.id)).scalars())
+
+    newly_applied = []
+    for migration_id, description, apply in MIGRATIONS:
+        if migration_id in applied:
+            continue
+        with engine.begin() as connection:
+            apply(connection)
+            connection.execute(models.SchemaMigration.__table__.insert().values(
+                id=migration_id, description=description
+            ))
+        newly_applied.append(migration_id)
+        print(f"✅ 已套用資料庫遷移: {migration_id} {description}")
+    return newly_applied
+
+
+def get_migration_status(engine=None) -> List[dict]:
+    """各遷移的套用狀態"""
+    if engine is None:
+        from .database import engine
+    models.SchemaMigration.__table__.create(engine, checkfirst=True)
+    with engine.connect() as connection:
+        rows = {row.id: row for row in connection.execute(select(models.SchemaMigration.__table__))}
+    return [
+        {
+            "id": migration_id,
+            "description": description,
+            "applied": migration_id in rows,
+            "applied_at": rows[migration_id].applied_at.isoformat() if migration_id in rows and rows[migration_id].applied_at else None,
+        }
+        for migration_id, description, _ in MIGRATIONS
+    ]
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, Float, Boolean, ForeignKey, JSON
+from sqlalchemy import Column, Integer, String, DateTime, Text, Float, Boolean, ForeignKey, JSON, Index, UniqueConstraint
 from sqlalchemy.orm import relationship, backref
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
@@ -50,11 +50,28 @@ class Permission(Base):
     description = Column(Text, nullable=True)
     module = Column(String(50), nullable=False)
     action = Column(String(50), nullable=False)
+    category_id = Column(Integer, ForeignKey("permission_categories.id"), nullable=True)
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     
     # 關聯
     role_permissions = relationship("RolePermission", back_populates="permission")
+    category = relationship("PermissionCategory", back_populates="permissions")
+
+class PermissionCategory(Base):
+    __tablename__ = "permission_categories"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(50), unique=True, nullable=False)
+    display_name = Column(String(100), nullable=False)
+    description = Column(Text, nullable=True)
+    icon = Column(String(50), nullable=True)
+    order_index = Column(Integer, default=0)
+    is_active = Column(Boolean, default=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    # 關聯
+    permissions = relationship("Permission", back_populates="category")
 
 class RolePermission(Base):
     __tablename__ = "role_permissions"
@@ -68,6 +85,37 @@ class RolePermission(Base):
     role = relationship("Role", back_populates="permissions")
     permission = relationship("Permission", back_populates="role_permissions")
 
+class UserPermission(Base):
+    """用戶特定權限：granted 為 False 時撤銷角色給予的權限，依 id 順序套用"""
+    __tablename__ = "user_permissions"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    permission_id = Column(Integer, ForeignKey("permissions.id", ondelete="CASCADE"), nullable=False)
+    granted = Column(Boolean, default=True, nullable=False)
+    granted_by = Column(Integer, ForeignKey("users.id"), nullable=True)
+    granted_at = Column(DateTime, default=datetime.utcnow)
+    
+    # 關聯
+    permission = relationship("Permission")
+
+class ResourcePermission(Base):
+    """單一資源（例如某台設備）的權限"""
+    __tablename__ = "resource_permissions"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    resource_type = Column(String(50), nullable=False)
+    resource_id = Column(Integer, nullable=False)
+    permission = Column(String(50), nullable=False)
+    granted = Column(Boolean, default=True, nullable=False)
+    granted_by = Column(Integer, ForeignKey("users.id"), nullable=True)
+    granted_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        Index("ix_resource_permissions_user_resource", "user_id", "resource_type", "resource_id"),
+    )
+
 # 設備相關
 class DeviceCategory(Base):
     __tablename__ = "device_categories"
@@ -86,6 +134,10 @@ class DeviceCategory(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    __table_args__ = (
+        Index("ix_device_categories_parent_active", "parent_id", "is_active"),
+    )
+
 class Device(Base):
     __tablename__ = "devices"
     
@@ -102,6 +154,10 @@ class Device(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    __table_args__ = (
+        Index("ix_devices_category_id_id", "category_id", "id"),
+    )
+
 class DeviceGroup(Base):
     __tablename__ = "device_groups"
     
@@ -136,6 +192,10 @@ class Alert(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    __table_args__ = (
+        Index("ix_alerts_device_id_id", "device_id", "id"),
+    )
+
 class Notification(Base):
     __tablename__ = "notifications"
     
@@ -328,6 +388,10 @@ class AIModelUsage(Base):
     error_message = Column(Text, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        Index("ix_ai_model_usage_model_created", "model_id", "created_at", "id"),
+    )
+
     class Config:
         orm_mode = True
 
@@ -347,9 +411,31 @@ class AIModelPerformance(Base):
     avg_latency = Column(Float, nullable=True)
     throughput = Column(Float, nullable=True)  # 每秒請求數
 
+    __table_args__ = (
+        Index("ix_ai_model_performance_model_timestamp", "model_id", "timestamp"),
+    )
+
     class Config:
         orm_mode = True
 
+class AIModelRollup(Base):
+    """AI Model 使用與性能的時間分桶彙總（1m / 1h / 1d）"""
+    __tablename__ = "ai_model_rollups"
+
+    id = Column(Integer, primary_key=True, index=True)
+    model_id = Column(Integer, ForeignKey("ai_models.id", ondelete="CASCADE"), nullable=False)
+    resolution = Column(String(8), nullable=False)  # 1m, 1h, 1d
+    bucket_start = Column(DateTime, nullable=False)
+    request_count = Column(Integer, default=0)
+    error_count = Column(Integer, default=0)
+    latency_sketch = Column(JSON, nullable=True)  # 可合併的延遲摘要 (ms)
+    gauges = Column(JSON, nullable=True)  # 資源使用率：名稱 -> [總和, 取樣數]
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint("model_id", "resolution", "bucket_start", name="uq_ai_model_rollups_bucket"),
+    )
+
 class PlatformContent(Base):
     """平台內容管理"""
     __tablename__ = "platform_content"
@@ -366,6 +452,10 @@ class PlatformContent(Base):
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     created_by = Column(String, nullable=True)
 
+    __table_args__ = (
+        Index("ix_platform_content_active_section_order", "is_active", "section", "sort_order"),
+    )
+
     class Config:
         orm_mode = True
 
@@ -391,4 +481,12 @@ class PlatformImage(Base):
     created_by = Column(String, nullable=True)
 
     class Config:
-        orm_mode = True
\ No newline at end of file
+        orm_mode = True
+
+class SchemaMigration(Base):
+    """已套用的結構遷移記錄"""
+    __tablename__ = "schema_migrations"
+
+    id = Column(String(100), primary_key=True)
+    description = Column(String(200), nullable=True)
+    applied_at = Column(DateTime, default=datetime.utcnow)
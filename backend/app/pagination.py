@@ -0,0 +1,215 @@
+"""
+列表端點的游標分頁、欄位選擇與串流 JSON 輸出
+"""
+
+import base64
+import json
+import logging
+import os
+from datetime import date, datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import and_, or_, select
+
+logger = logging.getLogger(__name__)
+
+# 每次從資料庫游標取出的列數
+STREAM_BATCH_SIZE = int(os.getenv("LIST_STREAM_BATCH_SIZE", "500"))
+# 串流回應每段的大小
+STREAM_CHUNK_BYTES = int(os.getenv("LIST_STREAM_CHUNK_BYTES", "65536"))
+# 單頁上限
+MAX_PAGE_SIZE = int(os.getenv("LIST_MAX_PAGE_SIZE", "10000"))
+
+# 排序鍵：(欄位名稱, 是否遞減)
+SortKey = Sequence[Tuple[str, bool]]
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def dumps(value) -> str:
+    return json.dumps(value, ensure_ascii=False, default=_json_default, separators=(",", ":"))
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    """把排序鍵的值編成不透明的游標字串"""
+    raw = json.dumps(list(values), default=_json_default, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(model, cursor: str, key: SortKey) -> List[Any]:
+    """解析游標並依欄位型別還原排序鍵的值"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except Exception:
+        raise ValueError("無效的游標")
+    if not isinstance(values, list) or len(values) != len(key):
+        raise ValueError("無效的游標")
+
+    decoded = []
+    for (name, _), value in zip(key, values):
+        python_type = getattr(model, name).type.python_type
+        if value is not None and python_type is datetime:
+            value = datetime.fromisoformat(value)
+        decoded.append(value)
+    return decoded
+
+
+def select_fields(model, fields: Optional[str], allowed: Sequence[str], key: SortKey) -> List[str]:
+    """解析逗號分隔的欄位清單；排序鍵欄位一定會包含在內"""
+    if fields:
+        requested = [f.strip() for f in fields.split(",") if f.strip()]
+        unknown = [f for f in requested if f not in allowed]
+        if unknown:
+            raise ValueError(f"不支援的欄位: {', '.join(unknown)}")
+    else:
+        requested = list(allowed)
+    for name, _ in key:
+        if name not in requested:
+            requested.append(name)
+    return requested
+
+
+def model_fields(model, exclude: Sequence[str] = ()) -> List[str]:
+    """模型的所有欄位名稱"""
+    return [column.key for column in model.__table__.columns if column.key not in exclude]
+
+
+def keyset_query(model, field_names: Sequence[str], key: SortKey, filters: Sequence = (),
+                 cursor: Optional[str] = None, limit: Optional[int] = None):
+    """建立游標分頁查詢：只選取需要的欄位，並以排序鍵取代 OFFSET"""
+    stmt = select(*[getattr(model, name) for name in field_names]).where(*filters)
+    if cursor:
+        values = decode_cursor(model, cursor, key)
+        # (a, b) 之後的列：a 超過游標，或 a 相同且 b 超過游標
+        clauses = []
+        for i, (name, descending) in enumerate(key):
+            column = getattr(model, name)
+            equal = [getattr(model, prev) == values[j] for j, (prev, _) in enumerate(key[:i])]
+            after = column < values[i] if descending else column > values[i]
+            clauses.append(and_(*equal, after))
+        stmt = stmt.where(or_(*clauses))
+    stmt = stmt.order_by(*[
+        getattr(model, name).desc() if descending else getattr(model, name).asc() for name, descending in key
+    ])
+    if limit:
+        # 多取一列用來判斷是否還有下一頁
+        stmt = stmt.limit(limit + 1)
+    return stmt
+
+
+def iter_rows(session_factory: Callable, stmt, batch_size: int = None) -> Iterator[Dict[str, Any]]:
+    """以伺服器端游標分批讀取，記憶體只保留一批資料"""
+    db = session_factory()
+    try:
+        result = db.execute(stmt.execution_options(yield_per=batch_size or STREAM_BATCH_SIZE))
+        for partition in result.mappings().partitions():
+            for row in partition:
+                yield dict(row)
+    finally:
+        db.close()
+
+
+def paginate(rows: Iterator[Dict[str, Any]], key: SortKey, limit: Optional[int],
+             state: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """最多輸出 limit 列；還有下一頁時把游標寫入 state["next_cursor"]"""
+    state["next_cursor"] = None
+    last = None
+    try:
+        for count, row in enumerate(rows):
+            if limit and count >= limit:
+                state["next_cursor"] = encode_cursor([last[name] for name, _ in key])
+                break
+            last = row
+            yield row
+    finally:
+        # 提早結束時立即釋放資料庫連線
+        if hasattr(rows, "close"):
+            rows.close()
+
+
+def stream_array(rows: Iterator[Dict[str, Any]], transform: Callable = None) -> Iterator[bytes]:
+    """把列輸出成 JSON 陣列；累積到 STREAM_CHUNK_BYTES 才送出一段，避免每列一次傳輸"""
+    buffer = ["["]
+    size = 1
+    first = True
+    for row in rows:
+        if transform:
+            row = transform(row)
+        text = ("" if first else ",") + dumps(row)
+        first = False
+        buffer.append(text)
+        size += len(text)
+        if size >= STREAM_CHUNK_BYTES:
+            yield "".join(buffer).encode()
+            buffer, size = [], 0
+    buffer.append("]")
+    yield "".join(buffer).encode()
+
+
+def stream_envelope(items_key: str, rows: Iterator[Dict[str, Any]], state: Dict[str, Any],
+                    transform: Callable = None) -> Iterator[bytes]:
+    """輸出 {items_key: [...], "next_cursor": ..., "success": true}，陣列逐筆串流
+
+    success 放在最後：串流途中讀取失敗時陣列照常結束，並以 success false 與
+    message 收尾，回應仍是完整的 JSON。
+    """
+    yield ("{" + dumps(items_key) + ":").encode()
+    started = False
+    try:
+        for chunk in stream_array(rows, transform):
+            started = True
+            yield chunk
+        tail = {"next_cursor": state.get("next_cursor"), "success": True}
+    except Exception as e:
+        logger.error(f"串流輸出列表失敗: {e}")
+        yield b"]" if started else b"[]"
+        tail = {"next_cursor": None, "success": False, "message": f"讀取資料失敗: {str(e)}"}
+    yield ("," + dumps(tail)[1:]).encode()
+
+
+def prefetch(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    """先取出第一段再開始回應，查詢錯誤能以錯誤狀態碼回傳而不是截斷的 200"""
+    first = next(chunks)
+
+    def resume():
+        yield first
+        yield from chunks
+
+    return resume()
+
+
+def check_limit(limit: Optional[int]) -> Optional[int]:
+    if limit is not None and (limit < 1 or limit > MAX_PAGE_SIZE):
+        raise ValueError(f"limit 必須介於 1 與 {MAX_PAGE_SIZE} 之間")
+    return limit
+
+
+def array_response(session_factory: Callable, stmt, key: SortKey, limit: Optional[int],
+                   transform: Callable = None):
+    """以 JSON 陣列回應；有 limit 時下一頁游標放在 X-Next-Cursor 標頭"""
+    from fastapi.responses import StreamingResponse
+
+    state: Dict[str, Any] = {}
+    rows = paginate(iter_rows(session_factory, stmt), key, limit, state)
+    headers = {}
+    if limit:
+        # 單頁筆數有上限，先取完整頁才能在標頭放入游標
+        rows = iter(list(rows))
+        if state["next_cursor"]:
+            headers["X-Next-Cursor"] = state["next_cursor"]
+    return StreamingResponse(prefetch(stream_array(rows, transform)), media_type="application/json", headers=headers)
+
+
+def envelope_response(session_factory: Callable, items_key: str, stmt, key: SortKey,
+                      limit: Optional[int], transform: Callable = None):
+    """以 {"success", items_key, "next_cursor"} 回應，項目逐筆串流"""
+    from fastapi.responses import StreamingResponse
+
+    state: Dict[str, Any] = {}
+    rows = paginate(iter_rows(session_factory, stmt), key, limit, state)
+    return StreamingResponse(stream_envelope(items_key, rows, state, transform), media_type="application/json")
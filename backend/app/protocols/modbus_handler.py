@@ -59,7 +59,7 @@ class ModbusHandler:
                         # 處理數據
                         device_id = f"{self.host}_{self.port}"
                         result = loop.run_until_complete(
-                            data_processing_service.process_modbus_data(device_id, registers)
+                            data_processing_service.process_modbus_data(device_id, registers, address)
                         )
                         
                         if result.success:
@@ -0,0 +1,251 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymodbus.client import AsyncModbusTcpClient
+
+from ..services.latency_sketch import LatencySketch
+
+logger = logging.getLogger(__name__)
+
+
+class GatewayUnavailable(ConnectionError):
+    """閘道尚在重新連線的等待期間"""
+
+
+class GatewayConnection:
+    """一個 Modbus TCP 閘道的共用連線
+
+    同一連線上可同時有多個未完成的請求（以 transaction id 對應回應），
+    整條連線的並行數以 max_in_flight 限制，同一 unit id 的並行數以
+    max_in_flight_per_unit 限制（閘道後方的序列設備一次只能處理一個請求）。
+    連線中斷或連續逾時後以指數退避重新連線。
+    """
+
+    def __init__(self, host: str, port: int, request_timeout: float, max_in_flight: int,
+                 max_in_flight_per_unit: int, backoff_base: float, backoff_max: float,
+                 failures_before_reconnect: int):
+        self.host = host
+        self.port = port
+        self.request_timeout = request_timeout
+        self.max_in_flight_per_unit = max_in_flight_per_unit
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.failures_before_reconnect = failures_before_reconnect
+        self.client: Optional[AsyncModbusTcpClient] = None
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+        self._unit_limits: Dict[int, asyncio.Semaphore] = {}
+        self._connect_lock = asyncio.Lock()
+        self._next_attempt = 0.0
+        self._attempt = 0
+        self._consecutive_failures = 0
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.reconnects = 0
+        self.last_error: Optional[str] = None
+
+    @property
+    def connected(self) -> bool:
+        return self.client is not None and self.client.connected
+
+    async def ensure_connected(self):
+        if self.connected:
+            return
+        async with self._connect_lock:
+            if self.connected:
+                return
+            now = time.monotonic()
+            if now < self._next_attempt:
+                raise GatewayUnavailable(f"{self.host}:{self.port} 等待重新連線（{self._next_attempt - now:.1f} 秒後）")
+            self._close_client()
+            # retries=0 與 reconnect_delay=0：逾時與重新連線由這裡控制，避免驅動自行重送或重連
+            self.client = AsyncModbusTcpClient(
+                self.host, port=self.port, timeout=self.request_timeout * 2, retries=0, reconnect_delay=0
+            )
+            try:
+                connected = await asyncio.wait_for(self.client.connect(), self.request_timeout)
+            except Exception as e:
+                self._close_client()
+                self._schedule_retry(f"無法連線到 {self.host}:{self.port}: {e}")
+                raise GatewayUnavailable(self.last_error)
+            if connected and self.client.connected:
+                if self._attempt:
+                    self.reconnects += 1
+                    logger.info(f"Modbus 閘道 {self.host}:{self.port} 已重新連線")
+                self._attempt = 0
+                self._consecutive_failures = 0
+                return
+            self._close_client()
+            self._schedule_retry(f"無法連線到 {self.host}:{self.port}")
+            raise GatewayUnavailable(self.last_error)
+
+    async def read(self, function: str, address: int, count: int, unit_id: int,
+                   timeout: float = None) -> List[int]:
+        """讀取暫存器；未完成的請求共用同一條連線"""
+        await self.ensure_connected()
+        unit_limit = self._unit_limits.get(unit_id)
+        if unit_limit is None:
+            unit_limit = self._unit_limits[unit_id] = asyncio.Semaphore(self.max_in_flight_per_unit)
+
+        async with self._in_flight, unit_limit:
+            client = self.client
+            if client is None or not client.connected:
+                raise GatewayUnavailable(f"{self.host}:{self.port} 連線已中斷")
+            read = client.read_holding_registers if function == "holding" else client.read_input_registers
+            self.in_flight += 1
+            self.requests += 1
+            try:
+                response = await asyncio.wait_for(read(address, count, slave=unit_id), timeout or self.request_timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                self._record_failure(f"unit {unit_id} 讀取 {address}+{count} 逾時")
+                raise
+            except Exception as e:
+                self._record_failure(str(e))
+                raise
+            finally:
+                self.in_flight -= 1
+
+        if response.isError():
+            # 設備回應例外碼代表連線正常，不計入連線失敗
+            raise RuntimeError(f"unit {unit_id} 讀取 {function} {address}+{count} 失敗: {response}")
+        self._consecutive_failures = 0
+        return response.registers
+
+    def _record_failure(self, error: str):
+        self.failures += 1
+        self.last_error = error
+        self._consecutive_failures += 1
+        if self.client is None:
+            # 連線已由其他請求關閉並安排重新連線
+            return
+        if not self.client.connected or self._consecutive_failures >= self.failures_before_reconnect:
+            self._close_client()
+            self._schedule_retry(error)
+
+    def _schedule_retry(self, error: str):
+        """指數退避（含隨機抖動）安排下一次連線"""
+        delay = min(self.backoff_max, self.backoff_base * (2 ** self._attempt))
+        delay *= random.uniform(0.5, 1.0)
+        self._attempt += 1
+        self._next_attempt = time.monotonic() + delay
+        self.last_error = error
+        logger.warning(f"Modbus 閘道 {self.host}:{self.port} 連線失敗，{delay:.1f} 秒後重試: {error}")
+
+    def _close_client(self):
+        if self.client is not None:
+            try:
+                self.client.close()
+            except Exception:
+                pass
+            self.client = None
+
+    def close(self):
+        self._close_client()
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            "connected": self.connected,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "reconnects": self.reconnects,
+            "retry_in": max(0.0, self._next_attempt - time.monotonic()) if not self.connected else 0.0,
+            "last_error": self.last_error,
+        }
+
+
+class ModbusConnectionPool:
+    """Modbus 連線池
+
+    每個閘道（host:port）一條共用連線，設備以 unit id 區分；各設備的往返
+    延遲記錄在可合併的延遲摘要中。必須在同一個事件循環中使用。
+    """
+
+    def __init__(self, request_timeout: float = None, max_in_flight: int = None, max_in_flight_per_unit: int = None,
+                 backoff_base: float = None, backoff_max: float = None, failures_before_reconnect: int = None):
+        self.request_timeout = request_timeout or float(os.getenv("MODBUS_REQUEST_TIMEOUT", "3"))
+        self.max_in_flight = max_in_flight or int(os.getenv("MODBUS_MAX_IN_FLIGHT", "16"))
+        self.max_in_flight_per_unit = max_in_flight_per_unit or int(os.getenv("MODBUS_MAX_IN_FLIGHT_PER_UNIT", "1"))
+        self.backoff_base = backoff_base or float(os.getenv("MODBUS_RECONNECT_BACKOFF_BASE", "0.5"))
+        self.backoff_max = backoff_max or float(os.getenv("MODBUS_RECONNECT_BACKOFF_MAX", "30"))
+        self.failures_before_reconnect = failures_before_reconnect or int(os.getenv("MODBUS_FAILURES_BEFORE_RECONNECT", "3"))
+        self._gateways: Dict[Tuple[str, int], GatewayConnection] = {}
+        # 延遲指標會由 API 執行緒讀取
+        self._latency: Dict[str, LatencySketch] = {}
+        self._errors: Dict[str, int] = {}
+        self._metrics_lock = threading.Lock()
+
+    def gateway(self, host: str, port: int) -> GatewayConnection:
+        key = (host, port)
+        gateway = self._gateways.get(key)
+        if gateway is None:
+            gateway = self._gateways[key] = GatewayConnection(
+                host, port, self.request_timeout, self.max_in_flight, self.max_in_flight_per_unit,
+                self.backoff_base, self.backoff_max, self.failures_before_reconnect
+            )
+        return gateway
+
+    async def read(self, host: str, port: int, function: str, address: int, count: int, unit_id: int,
+                   device_id: str = None, timeout: float = None) -> List[int]:
+        """讀取暫存器並記錄該設備的往返延遲"""
+        key = device_id or f"{host}:{port}/{unit_id}"
+        start = time.perf_counter()
+        try:
+            registers = await self.gateway(host, port).read(function, address, count, unit_id, timeout)
+        except Exception:
+            with self._metrics_lock:
+                self._errors[key] = self._errors.get(key, 0) + 1
+            raise
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._metrics_lock:
+            sketch = self._latency.get(key)
+            if sketch is None:
+                sketch = self._latency[key] = LatencySketch()
+            sketch.add(elapsed_ms)
+        return registers
+
+    def get_latency(self, device_id: str = None) -> Dict[str, Dict[str, Any]]:
+        """各設備往返延遲的分位數（毫秒）"""
+        with self._metrics_lock:
+            keys = [device_id] if device_id else list(self._latency)
+            return {
+                key: {
+                    "count": int(self._latency[key].count),
+                    "errors": self._errors.get(key, 0),
+                    "avg": self._latency[key].mean,
+                    "p50": self._latency[key].quantile(0.5),
+                    "p95": self._latency[key].quantile(0.95),
+                    "p99": self._latency[key].quantile(0.99),
+                    "max": self._latency[key].max,
+                }
+                for key in keys if key in self._latency
+            }
+
+    def get_metrics(self) -> Dict[str, Any]:
+        return {
+            "gateways": {f"{host}:{port}": g.get_status() for (host, port), g in list(self._gateways.items())},
+            "latency_ms": self.get_latency(),
+        }
+
+    def reset_metrics(self):
+        with self._metrics_lock:
+            self._latency.clear()
+            self._errors.clear()
+
+    def open(self):
+        """在新的事件循環中重新開始（連線與 asyncio 同步物件不能跨事件循環沿用）"""
+        self.close()
+        self._gateways.clear()
+
+    def close(self):
+        """關閉所有連線；閘道統計保留供查詢"""
+        for gateway in self._gateways.values():
+            gateway.close()
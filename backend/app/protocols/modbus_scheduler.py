@@ -0,0 +1,391 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+from .modbus_pool import GatewayUnavailable, ModbusConnectionPool
+from .register_decoder import (
+    MAX_REGISTERS_PER_READ,
+    RegisterDecoder,
+    RegisterPoint,
+    get_block_decoder,
+    parse_register_mappings,
+)
+
+logger = logging.getLogger(__name__)
+
+# 合併區塊時允許夾帶的未使用暫存器數量：多讀幾個暫存器比多一次往返便宜
+MAX_REGISTER_GAP = int(os.getenv("MODBUS_MAX_REGISTER_GAP", "16"))
+DEFAULT_SOURCE_ID = "modbus_industrial_device"
+
+Publisher = Callable[[List[Dict[str, Any]]], Awaitable[None]]
+
+
+@dataclass
+class RegisterBlock:
+    """一次讀取的連續暫存器區塊，以及落在其中的量測點"""
+    function: str
+    unit_id: int
+    start: int
+    count: int
+    points: List[RegisterPoint] = field(default_factory=list)
+    decoder: Optional[RegisterDecoder] = field(default=None, repr=False, compare=False)
+
+    def compile(self) -> RegisterDecoder:
+        """編譯區塊的解碼器（設定相同的區塊共用同一個編譯結果）"""
+        self.decoder = get_block_decoder(tuple(self.points), self.start, self.count)
+        return self.decoder
+
+
+@dataclass
+class PollTarget:
+    """一台輪詢設備"""
+    device_id: str
+    host: str
+    port: int = 502
+    unit_id: int = 1
+    interval: float = 1.0
+    source_id: str = DEFAULT_SOURCE_ID
+    points: List[RegisterPoint] = field(default_factory=list)
+    blocks: List[RegisterBlock] = field(default_factory=list)
+
+    def __post_init__(self):
+        if self.points and not self.blocks:
+            self.blocks = plan_blocks(self.points)
+
+
+def plan_blocks(points: Iterable[RegisterPoint], max_count: int = MAX_REGISTERS_PER_READ,
+                max_gap: int = None) -> List[RegisterBlock]:
+    """把相鄰、重疊或間隔不超過 max_gap 的位址合併成最少的讀取區塊
+
+    依 (unit_id, 暫存器類型, 位址) 排序後由左而右貪婪延伸，區塊長度不超過
+    max_count；在長度上限下，貪婪延伸所得的區塊數即為最少。
+    """
+    max_gap = MAX_REGISTER_GAP if max_gap is None else max_gap
+    blocks: List[RegisterBlock] = []
+    current: Optional[RegisterBlock] = None
+    for point in sorted(points, key=lambda p: (p.unit_id, p.function, p.address, p.count)):
+        end = point.address + point.count
+        if (
+            current is not None
+            and current.unit_id == point.unit_id
+            and current.function == point.function
+            and point.address <= current.start + current.count + max_gap
+            and max(end, current.start + current.count) - current.start <= max_count
+        ):
+            current.count = max(end, current.start + current.count) - current.start
+            current.points.append(point)
+            continue
+        current = RegisterBlock(point.function, point.unit_id, point.address, point.count, [point])
+        blocks.append(current)
+    for block in blocks:
+        block.compile()
+    return blocks
+
+
+def decode_block(block: RegisterBlock, registers: List[int]) -> Dict[str, float]:
+    """以區塊編譯好的解碼器把讀回的暫存器換算成量測值"""
+    decoder = block.decoder or block.compile()
+    return decoder.decode(registers)
+
+
+def load_poll_targets(db=None) -> List[PollTarget]:
+    """由 Device.connection_info 建立輪詢目標
+
+    protocol 為 modbus 且 connection_info 含 host 的設備才會輪詢；未設定
+    register_mappings 時使用對應數據源（預設 modbus_industrial_device）的設定。
+    """
+    from ..config.data_processing_config import DEFAULT_DATA_SOURCES
+    from .. import models
+    from ..database import get_postgres_session
+
+    own_session = db is None
+    db = db or get_postgres_session()
+    try:
+        devices = db.query(models.Device.device_id, models.Device.connection_info).filter(
+            models.Device.protocol == "modbus"
+        ).all()
+    finally:
+        if own_session:
+            db.close()
+
+    targets = []
+    for device_id, info in devices:
+        info = info or {}
+        if not info.get("host"):
+            continue
+        source_id = info.get("source_id", DEFAULT_SOURCE_ID)
+        mappings = info.get("register_mappings") or (
+            DEFAULT_DATA_SOURCES.get(source_id, {}).get("config", {}).get("register_mappings")
+        )
+        if not mappings:
+            logger.warning(f"Modbus 設備 {device_id} 沒有暫存器對應設定，略過輪詢")
+            continue
+        unit_id = int(info.get("unit_id", 1))
+        try:
+            points = parse_register_mappings(
+                mappings, unit_id, info.get("byte_order", "big"), info.get("word_order", "big")
+            )
+        except (KeyError, ValueError) as e:
+            logger.warning(f"Modbus 設備 {device_id} 的暫存器對應設定無效: {e}")
+            continue
+        targets.append(PollTarget(
+            device_id=device_id,
+            host=info["host"],
+            port=int(info.get("port", 502)),
+            unit_id=unit_id,
+            interval=float(info.get("poll_interval", os.getenv("MODBUS_POLL_INTERVAL", "1.0"))),
+            source_id=source_id,
+            points=points,
+        ))
+    return targets
+
+
+async def publish_to_pipeline(records: List[Dict[str, Any]]):
+    """把一批量測值依數據源交給處理管道，再寫入時序資料庫並更新設備存活狀態"""
+    from ..services.data_processing_service import data_processing_service
+    from ..services.heartbeat_service import heartbeat_table
+    from ..services.timeseries_writer import timeseries_writer
+
+    groups: Dict[str, List[Dict[str, Any]]] = {}
+    for record in records:
+        groups.setdefault(record.pop("source_id", DEFAULT_SOURCE_ID), []).append(record)
+
+    points = []
+    for source_id, group in groups.items():
+        output = group
+        if data_processing_service.get_plan(source_id) is not None:
+            result = await data_processing_service.process_batch(source_id, group)
+            if not result.success:
+                logger.warning(f"Modbus 批次處理失敗: {result.error_message}")
+                continue
+            output = result.to_records()
+        for record in output:
+            fields = {
+                k: float(v) for k, v in record.items()
+                if k not in ("device_id", "timestamp") and isinstance(v, (int, float)) and not isinstance(v, bool)
+            }
+            if fields:
+                points.append({
+                    "measurement": "device_sensor_data",
+                    "tags": {"device_id": str(record["device_id"]), "source_id": source_id},
+                    "fields": fields,
+                    "time": record.get("timestamp") or datetime.utcnow(),
+                })
+
+    if points:
+        timeseries_writer.write(points)
+    heartbeat_table.touch_many((r["device_id"], r.get("timestamp"), "online") for g in groups.values() for r in g)
+
+
+class PollMetrics:
+    """輪詢排程的執行期指標"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.cycles = 0
+        self.requests = 0
+        self.naive_requests = 0
+        self.registers_read = 0
+        self.points = 0
+        self.errors = 0
+        self.failed_blocks = 0
+        self.overruns = 0
+        self.published = 0
+        self.batches = 0
+
+    def incr(self, **amounts):
+        with self._lock:
+            for name, amount in amounts.items():
+                setattr(self, name, getattr(self, name) + amount)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "cycles": self.cycles,
+                "requests": self.requests,
+                # 每個量測點各讀一次所需的請求數，用來對照合併的效果
+                "naive_requests": self.naive_requests,
+                "registers_read": self.registers_read,
+                "points": self.points,
+                "errors": self.errors,
+                "failed_blocks": self.failed_blocks,
+                "overruns": self.overruns,
+                "published": self.published,
+                "batches": self.batches,
+            }
+
+
+class ModbusPollScheduler:
+    """Modbus 輪詢排程
+
+    每台設備的量測點先合併成最少的區塊讀取，各設備依自己的輪詢週期
+    並行執行，啟動時間與每次週期加上隨機抖動，避免大量設備同時發出請求。
+    解碼後的量測值放入佇列，由發布工作成批交給處理管道。排程在專用執行
+    緒的事件循環中執行，不佔用 API 伺服器的事件循環。
+    """
+
+    def __init__(self, publish: Publisher = None, jitter: float = None, max_concurrency: int = None,
+                 pool: ModbusConnectionPool = None, publish_batch_size: int = None, publish_interval: float = None):
+        self.publish = publish or publish_to_pipeline
+        self.jitter = jitter if jitter is not None else float(os.getenv("MODBUS_POLL_JITTER", "0.1"))
+        self.max_concurrency = max_concurrency or int(os.getenv("MODBUS_POLL_CONCURRENCY", "1000"))
+        self.pool = pool or ModbusConnectionPool()
+        self.publish_batch_size = publish_batch_size or int(os.getenv("MODBUS_PUBLISH_BATCH_SIZE", "500"))
+        self.publish_interval = publish_interval or float(os.getenv("MODBUS_PUBLISH_INTERVAL", "1.0"))
+        self.targets: List[PollTarget] = []
+        self.metrics = PollMetrics()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopping: Optional[asyncio.Event] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._start_lock = threading.Lock()
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, targets: List[PollTarget] = None):
+        """啟動輪詢；未指定目標時由資料庫中的 Modbus 設備建立"""
+        with self._start_lock:
+            if self.is_running:
+                return
+            self.targets = targets if targets is not None else load_poll_targets()
+            ready = threading.Event()
+            self._thread = threading.Thread(target=self._run, args=(ready,), name="modbus-poller", daemon=True)
+            self._thread.start()
+            ready.wait(5)
+            blocks = sum(len(t.blocks) for t in self.targets)
+            points = sum(len(t.points) for t in self.targets)
+            logger.info(f"Modbus 輪詢啟動: {len(self.targets)} 台設備，{points} 個量測點合併為 {blocks} 個區塊")
+
+    def stop(self, timeout: float = 10.0):
+        """停止輪詢，送出佇列中剩餘的量測值"""
+        with self._start_lock:
+            if not self.is_running:
+                return
+            if self._loop is not None and self._stopping is not None:
+                self._loop.call_soon_threadsafe(self._stopping.set)
+            self._thread.join(timeout)
+            self._thread = None
+            logger.info("Modbus 輪詢已停止")
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            "running": self.is_running,
+            "devices": len(self.targets),
+            "points": sum(len(t.points) for t in self.targets),
+            "blocks": sum(len(t.blocks) for t in self.targets),
+            "metrics": self.metrics.snapshot(),
+            "connections": self.pool.get_metrics(),
+        }
+
+    def _run(self, ready: threading.Event):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_until_complete(self._main(ready))
+        finally:
+            self._loop.close()
+            self._loop = None
+
+    async def _main(self, ready: threading.Event):
+        self._stopping = asyncio.Event()
+        self.pool.open()
+        self._queue = asyncio.Queue()
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        publisher = asyncio.create_task(self._publish_loop())
+        pollers = [asyncio.create_task(self._poll_device(target, semaphore)) for target in self.targets]
+        ready.set()
+        try:
+            await self._stopping.wait()
+        finally:
+            for task in pollers:
+                task.cancel()
+            await asyncio.gather(*pollers, return_exceptions=True)
+            await self._queue.put(None)
+            await publisher
+            self.pool.close()
+
+    async def _poll_device(self, target: PollTarget, semaphore: asyncio.Semaphore):
+        """依設備週期輪詢；第一次輪詢隨機錯開，之後每個週期加上抖動"""
+        await asyncio.sleep(random.uniform(0, target.interval))
+        next_due = time.monotonic()
+        while True:
+            async with semaphore:
+                await self._poll_once(target)
+            next_due += target.interval
+            now = time.monotonic()
+            if next_due < now:
+                # 輪詢時間超過週期：跳過錯過的週期，不連續補讀
+                self.metrics.incr(overruns=1)
+                next_due = now
+            spread = target.interval * self.jitter
+            await asyncio.sleep(max(0.0, next_due - now + random.uniform(-spread, spread)))
+
+    async def _poll_once(self, target: PollTarget):
+        """同時送出設備所有區塊的讀取，經由閘道的共用連線管線化傳送
+
+        部分區塊失敗時仍發布其他區塊成功解碼的量測點，失敗的區塊另外計數。
+        """
+        results = await asyncio.gather(*[
+            self.pool.read(target.host, target.port, block.function, block.start, block.count,
+                           block.unit_id, device_id=target.device_id)
+            for block in target.blocks
+        ], return_exceptions=True)
+
+        values: Dict[str, float] = {}
+        registers_read = 0
+        errors = [r for r in results if isinstance(r, BaseException)]
+        for block, registers in zip(target.blocks, results):
+            if not isinstance(registers, BaseException):
+                values.update(decode_block(block, registers))
+                registers_read += block.count
+        sent = sum(1 for r in results if not isinstance(r, GatewayUnavailable))
+        self.metrics.incr(cycles=1, requests=sent, naive_requests=len(target.points),
+                          registers_read=registers_read, points=len(values), errors=1 if errors else 0,
+                          failed_blocks=len(errors))
+        if errors and sent:
+            logger.warning(f"Modbus 設備 {target.device_id} 有 {len(errors)}/{len(results)} 個區塊讀取失敗: {errors[0]!r}")
+        if not values:
+            return
+
+        await self._queue.put({
+            "device_id": target.device_id,
+            "source_id": target.source_id,
+            "timestamp": datetime.utcnow(),
+            **values,
+        })
+
+    async def _publish_loop(self):
+        """累積到 publish_batch_size 筆或經過 publish_interval 秒即送出一批"""
+        batch: List[Dict[str, Any]] = []
+        deadline = time.monotonic() + self.publish_interval
+        done = False
+        while not done:
+            try:
+                item = await asyncio.wait_for(self._queue.get(), max(0.0, deadline - time.monotonic()))
+                if item is None:
+                    done = True
+                else:
+                    batch.append(item)
+            except asyncio.TimeoutError:
+                pass
+            if batch and (done or len(batch) >= self.publish_batch_size or time.monotonic() >= deadline):
+                try:
+                    await self.publish(batch)
+                    self.metrics.incr(published=len(batch), batches=1)
+                except Exception as e:
+                    logger.error(f"Modbus 量測值發布失敗: {e}")
+                batch = []
+            if time.monotonic() >= deadline:
+                deadline = time.monotonic() + self.publish_interval
+
+
+# 全局實例
+modbus_poll_scheduler = ModbusPollScheduler()
@@ -1,111 +1,59 @@
 import paho.mqtt.client as mqtt
 import json
 import logging
-from datetime import datetime
+import os
+
+from app.services.ingestion_service import ingestion_bridge
+from app.services.heartbeat_service import heartbeat_table
+from app.protocols.mqtt_router import MQTTRouter
 
 logger = logging.getLogger(__name__)
 
 class MQTTHandler:
-    def __init__(self, broker_url="localhost", broker_port=1883):
+    def __init__(self, broker_url="localhost", broker_port=1883, ingestion=None, share_group=None, client_id=""):
         self.broker_url = broker_url
         self.broker_port = broker_port
-        self.client = mqtt.Client()
+        self.ingestion = ingestion or ingestion_bridge
+        # 多個消費程序設定相同的 MQTT_SHARE_GROUP 時，由 Broker 分攤設備訊息
+        self.router = MQTTRouter(share_group=share_group or os.getenv("MQTT_SHARE_GROUP"))
+        self.router.add_route("iot/+/data", self.handle_device_data, decoder=os.getenv("MQTT_DATA_DECODER", "json"))
+        self.router.add_route("iot/+/status", self.handle_device_status)
+        self.router.add_route("iot/+/command", self.handle_device_command)
+        self.client = mqtt.Client(client_id=client_id)
         self.client.on_connect = self.on_connect
         self.client.on_message = self.on_message
         self.client.on_disconnect = self.on_disconnect
         
     def on_connect(self, client, userdata, flags, rc):
         logger.info(f"MQTT 連線成功，返回碼: {rc}")
-        client.subscribe("iot/+/data")
-        client.subscribe("iot/+/status")
-        client.subscribe("iot/+/command")
+        subscriptions = self.router.subscriptions()
+        if subscriptions:
+            client.subscribe(subscriptions)
         
     def on_message(self, client, userdata, msg):
-        try:
-            topic = msg.topic
-            payload = json.loads(msg.payload.decode())
-            logger.info(f"收到 MQTT 訊息: {topic} - {payload}")
-            
-            # 處理設備數據
-            if "data" in topic:
-                self.handle_device_data(topic, payload)
-            elif "status" in topic:
-                self.handle_device_status(topic, payload)
-            elif "command" in topic:
-                self.handle_device_command(topic, payload)
-                
-        except Exception as e:
-            logger.error(f"處理 MQTT 訊息失敗: {str(e)}")
+        # 解碼、例外處理與計數都在路由內完成
+        self.router.dispatch(msg.topic, msg.payload)
     
     def on_disconnect(self, client, userdata, rc):
         logger.warning(f"MQTT 連線斷開，返回碼: {rc}")
     
     def handle_device_data(self, topic, payload):
-        """處理設備數據"""
-        device_id = topic.split('/')[1]
-        
-        # 使用數據處理服務處理數據
-        try:
-            import asyncio
-            from app.services.data_processing_service import data_processing_service
-            
-            # 創建事件循環來執行異步處理
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            
-            try:
-                # 處理數據
-                result = loop.run_until_complete(
-                    data_processing_service.process_mqtt_data(topic, payload)
-                )
-                
-                if result.success:
-                    # 保存處理結果
-                    data_processing_service.save_processing_result(result)
-                    logger.info(f"MQTT 數據處理成功: {topic}")
-                else:
-                    logger.warning(f"MQTT 數據處理失敗: {result.error_message}")
-                
-            finally:
-                loop.close()
-                
-        except Exception as e:
-            logger.error(f"數據處理服務調用失敗: {str(e)}")
-        
-        # 同時保存原始數據到 InfluxDB
-        from app.database import influx_client
-        from app.database import INFLUXDB_BUCKET, INFLUXDB_ORG
-        
-        point = {
-            "measurement": "device_sensor_data",
-            "tags": {
-                "device_id": device_id
-            },
-            "fields": payload,
-            "time": datetime.utcnow()
-        }
-        
-        write_api = influx_client.write_api()
-        write_api.write(bucket=INFLUXDB_BUCKET, org=INFLUXDB_ORG, record=point)
+        """處理設備數據
+
+        在 paho 網路執行緒上只做入列，實際處理由常駐的接收橋接器完成。
+        """
+        if not self.ingestion.submit_mqtt(topic, payload):
+            logger.warning(f"接收佇列已滿，丟棄 MQTT 訊息: {topic}")
+    
+    def get_stats(self):
+        """各路由的訊息、解碼失敗與處理失敗計數"""
+        return self.router.get_stats()
     
     def handle_device_status(self, topic, payload):
         """處理設備狀態"""
         device_id = topic.split('/')[1]
-        # 更新 PostgreSQL 中的設備狀態
-        from app.database import SessionLocal
-        from app.models import Device
-        
-        db = SessionLocal()
-        try:
-            device = db.query(Device).filter(Device.id == int(device_id)).first()
-            if device:
-                device.status = payload.get('status', 'unknown')
-                device.last_heartbeat = datetime.utcnow()
-                db.commit()
-        except Exception as e:
-            logger.error(f"更新設備狀態失敗: {str(e)}")
-        finally:
-            db.close()
+        # 只更新記憶體中的存活狀態，由 heartbeat_table 定期批次寫回 PostgreSQL
+        heartbeat_table.touch(device_id, status=payload.get('status', 'unknown'), heartbeat=True)
     
     def handle_device_command(self, topic, payload):
         """處理設備命令"""
@@ -116,6 +64,7 @@ class MQTTHandler:
     def connect(self):
         """連接到 MQTT Broker"""
         try:
+            self.ingestion.start()
             self.client.connect(self.broker_url, self.broker_port, 60)
             self.client.loop_start()
             logger.info("MQTT 客戶端啟動成功")
@@ -126,6 +75,7 @@ class MQTTHandler:
         """斷開 MQTT 連線"""
         self.client.loop_stop()
         self.client.disconnect()
+        self.ingestion.stop()
         logger.info("MQTT 客戶端已斷開")
     
     def publish_command(self, device_id, command):
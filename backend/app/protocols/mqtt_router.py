@@ -0,0 +1,251 @@
+import json
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+SHARE_PREFIX = "$share/"
+# 主題路由快取上限：設備主題固定時，同一主題只需走訪一次主題樹
+ROUTE_CACHE_SIZE = 10000
+
+Handler = Callable[[str, Any], None]
+
+
+def _decode_json(payload: bytes) -> Any:
+    return orjson.loads(payload) if orjson is not None else json.loads(payload)
+
+
+def _decode_msgpack(payload: bytes) -> Any:
+    return msgpack.unpackb(payload, raw=False)
+
+
+DECODERS: Dict[str, Callable[[bytes], Any]] = {
+    "json": _decode_json,
+    "msgpack": _decode_msgpack,
+    "text": lambda payload: payload.decode("utf-8"),
+    "raw": lambda payload: payload,
+}
+
+
+def split_shared(topic_filter: str) -> Tuple[Optional[str], str]:
+    """拆開共享訂閱 $share/<group>/<filter>，回傳 (group, filter)"""
+    if not topic_filter.startswith(SHARE_PREFIX):
+        return None, topic_filter
+    group, sep, rest = topic_filter[len(SHARE_PREFIX):].partition("/")
+    if not group or not sep or not rest or "+" in group or "#" in group:
+        raise ValueError(f"無效的共享訂閱: {topic_filter}")
+    return group, rest
+
+
+def compile_filter(topic_filter: str) -> Tuple[str, ...]:
+    """驗證主題過濾條件並拆成層級；+ 與 # 必須佔滿整個層級，# 只能在最後一層"""
+    if not topic_filter:
+        raise ValueError("主題過濾條件不可為空")
+    levels = tuple(topic_filter.split("/"))
+    for i, level in enumerate(levels):
+        if level == "#":
+            if i != len(levels) - 1:
+                raise ValueError(f"# 只能出現在最後一層: {topic_filter}")
+        elif level != "+" and ("+" in level or "#" in level):
+            raise ValueError(f"萬用字元必須佔滿整個層級: {topic_filter}")
+    return levels
+
+
+class Route:
+    """一條主題路由與其計數器
+
+    計數器只由 MQTT 網路執行緒更新，其他執行緒只讀取快照。
+    """
+
+    def __init__(self, topic_filter: str, handler: Handler, decoder: str = "json", qos: int = 0,
+                 shared: bool = True, name: str = None, share_group: str = None):
+        if decoder not in DECODERS:
+            raise ValueError(f"不支援的解碼器: {decoder}")
+        if decoder == "msgpack" and msgpack is None:
+            raise ValueError("使用 msgpack 解碼器需要安裝 msgpack")
+        self.topic_filter = topic_filter
+        self.levels = compile_filter(topic_filter)
+        self.handler = handler
+        self.decoder = decoder
+        self.decode = DECODERS[decoder]
+        self.qos = qos
+        # share_group 為路由自己指定的共享群組，未指定時依 shared 使用路由器的群組
+        self.shared = shared or share_group is not None
+        self.share_group = share_group
+        self.name = name or topic_filter
+        self.matched = 0
+        self.handled = 0
+        self.decode_errors = 0
+        self.handler_errors = 0
+        self.bytes = 0
+        self.last_error: Optional[str] = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "filter": self.topic_filter,
+            "decoder": self.decoder,
+            "qos": self.qos,
+            "matched": self.matched,
+            "handled": self.handled,
+            "decode_errors": self.decode_errors,
+            "handler_errors": self.handler_errors,
+            "bytes": self.bytes,
+            "last_error": self.last_error,
+        }
+
+
+class _TrieNode:
+    __slots__ = ("children", "plus", "hash_routes", "routes")
+
+    def __init__(self):
+        self.children: Dict[str, "_TrieNode"] = {}
+        self.plus: Optional["_TrieNode"] = None
+        self.hash_routes: List[Route] = []
+        self.routes: List[Route] = []
+
+
+class MQTTRouter:
+    """以主題樹分派 MQTT 訊息
+
+    訂閱的過濾條件依層級編譯成主題樹，+ 與 # 各自是獨立的分支，比對一個
+    主題只需沿層級走訪一次；比對結果依主題快取。每條路由有自己的解碼器
+    （json 使用 orjson、msgpack、text 或原始位元組），同一則訊息在多條路由
+    使用相同解碼器時只解碼一次。設定 share_group 時以 $share/<group>/ 共享
+    訂閱，讓多個消費程序由 Broker 分攤訊息。
+    """
+
+    def __init__(self, share_group: str = None, cache_size: int = ROUTE_CACHE_SIZE):
+        self.share_group = share_group or None
+        if self.share_group and ("/" in self.share_group or "+" in self.share_group or "#" in self.share_group):
+            raise ValueError(f"無效的共享訂閱群組: {self.share_group}")
+        self.cache_size = cache_size
+        self.routes: List[Route] = []
+        self.unmatched = 0
+        self._root = _TrieNode()
+        self._cache: Dict[str, List[Route]] = {}
+
+    def add_route(self, topic_filter: str, handler: Handler, decoder: str = "json", qos: int = 0,
+                  shared: bool = True, name: str = None) -> Route:
+        """新增路由；過濾條件可直接寫成 $share/<group>/<filter>"""
+        group, topic_filter = split_shared(topic_filter)
+        route = Route(topic_filter, handler, decoder, qos, shared, name, group)
+        self._insert(route)
+        self._cache = {}
+        return route
+
+    def remove_route(self, route: Route):
+        """移除路由並重建主題樹"""
+        routes = [r for r in self.routes if r is not route]
+        self.routes = []
+        self._root = _TrieNode()
+        for r in routes:
+            self._insert(r)
+        self._cache = {}
+
+    def _insert(self, route: Route):
+        node = self._root
+        for level in route.levels:
+            if level == "#":
+                node.hash_routes.append(route)
+                break
+            if level == "+":
+                node.plus = node.plus or _TrieNode()
+                node = node.plus
+            else:
+                node = node.children.setdefault(level, _TrieNode())
+        else:
+            node.routes.append(route)
+        self.routes.append(route)
+
+    def match(self, topic: str) -> List[Route]:
+        """回傳符合主題的路由（依新增順序）"""
+        routes = self._cache.get(topic)
+        if routes is not None:
+            return routes
+        levels = topic.split("/")
+        found: List[Route] = []
+        # 以 $ 開頭的主題（例如 $SYS）不符合第一層的萬用字元
+        system = topic.startswith("$")
+        nodes = [self._root]
+        for depth, level in enumerate(levels):
+            next_nodes = []
+            for node in nodes:
+                if node.hash_routes and not (system and depth == 0):
+                    found.extend(node.hash_routes)
+                child = node.children.get(level)
+                if child is not None:
+                    next_nodes.append(child)
+                if node.plus is not None and not (system and depth == 0):
+                    next_nodes.append(node.plus)
+            nodes = next_nodes
+            if not nodes:
+                break
+        for node in nodes:
+            found.extend(node.routes)
+            # "a/#" 也符合 "a" 本身
+            found.extend(node.hash_routes)
+        if len(found) > 1:
+            order = {id(route): i for i, route in enumerate(self.routes)}
+            found.sort(key=lambda route: order[id(route)])
+        if len(self._cache) >= self.cache_size:
+            self._cache = {}
+        self._cache[topic] = found
+        return found
+
+    def dispatch(self, topic: str, payload: bytes) -> int:
+        """把訊息交給所有符合的路由，回傳處理成功的路由數"""
+        routes = self.match(topic)
+        if not routes:
+            self.unmatched += 1
+            return 0
+        decoded: Dict[str, Any] = {}
+        handled = 0
+        for route in routes:
+            route.matched += 1
+            route.bytes += len(payload)
+            if route.decoder in decoded:
+                value = decoded[route.decoder]
+            else:
+                try:
+                    value = decoded[route.decoder] = route.decode(payload)
+                except Exception as e:
+                    route.decode_errors += 1
+                    route.last_error = f"{type(e).__name__}: {e}"
+                    logger.debug(f"MQTT 訊息解碼失敗 {topic}: {e}")
+                    continue
+            try:
+                route.handler(topic, value)
+                route.handled += 1
+                handled += 1
+            except Exception as e:
+                route.handler_errors += 1
+                route.last_error = f"{type(e).__name__}: {e}"
+                logger.error(f"處理 MQTT 訊息失敗 {topic}: {e}")
+        return handled
+
+    def subscriptions(self) -> List[Tuple[str, int]]:
+        """要向 Broker 訂閱的 (過濾條件, QoS)；共享路由加上 $share 前綴，重複的條件只訂閱一次"""
+        subscriptions: Dict[str, int] = {}
+        for route in self.routes:
+            group = route.share_group or (self.share_group if route.shared else None)
+            topic_filter = f"{SHARE_PREFIX}{group}/{route.topic_filter}" if group else route.topic_filter
+            subscriptions[topic_filter] = max(route.qos, subscriptions.get(topic_filter, 0))
+        return list(subscriptions.items())
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "share_group": self.share_group,
+            "unmatched": self.unmatched,
+            "cached_topics": len(self._cache),
+            "routes": {route.name: route.get_stats() for route in self.routes},
+        }
@@ -1,14 +1,19 @@
 import asyncio
-from asyncua import Client
+import os
+import time
+from asyncua import Client, ua
 import logging
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
 class OPCUAHandler:
-    def __init__(self, server_url="opc.tcp://localhost:4840"):
+    def __init__(self, server_url="opc.tcp://localhost:4840", browse_cache_ttl=None):
         self.server_url = server_url
         self.client = None
+        # 瀏覽結果快取：node_id -> (快取時間, 子節點資訊)
+        self.browse_cache_ttl = browse_cache_ttl or float(os.getenv("OPCUA_BROWSE_CACHE_TTL", "300"))
+        self._browse_cache = {}
         
     async def connect(self):
         """連接到 OPC UA 伺服器"""
@@ -25,6 +30,7 @@ class OPCUAHandler:
         """斷開 OPC UA 連線"""
         if self.client:
             await self.client.disconnect()
+            self._browse_cache.clear()
             logger.info("OPC UA 連線已斷開")
     
     async def read_node(self, node_id):
@@ -70,4 +76,115 @@ class OPCUAHandler:
                 return []
         except Exception as e:
             logger.error(f"瀏覽節點失敗: {str(e)}")
-            return [] 
\ No newline at end of file
+            return []
+
+    async def read_nodes(self, node_ids, attribute=ua.AttributeIds.Value):
+        """一次請求讀取多個節點的屬性，回傳 node_id -> 值（讀取失敗的節點為 None）"""
+        try:
+            if self.client:
+                node_ids = list(node_ids)
+                results = await self.client.read_attributes(
+                    [self.client.get_node(node_id) for node_id in node_ids], attribute
+                )
+                values = {}
+                for node_id, result in zip(node_ids, results):
+                    good = result.StatusCode is None or result.StatusCode.is_good()
+                    values[node_id] = result.Value.Value if good and result.Value is not None else None
+                logger.info(f"批次讀取節點成功: {len(node_ids)} 個節點")
+                return values
+            else:
+                logger.error("OPC UA 客戶端未連線")
+                return {}
+        except Exception as e:
+            logger.error(f"批次讀取節點失敗: {str(e)}")
+            return {}
+
+    async def write_nodes(self, values):
+        """一次請求寫入多個節點（node_id -> 值），回傳 node_id -> 是否成功
+
+        寫入前以一次批次讀取取得各節點目前的資料型別，寫入值依該型別轉換。
+        """
+        try:
+            if self.client:
+                node_ids = list(values)
+                nodes = [self.client.get_node(node_id) for node_id in node_ids]
+                types = await self.client.read_attributes(nodes, ua.AttributeIds.Value)
+                variants = [
+                    ua.Variant(values[node_id], current.Value.VariantType if current.Value else None)
+                    for node_id, current in zip(node_ids, types)
+                ]
+                codes = await self.client.write_values(nodes, variants, raise_on_partial_error=False)
+                result = {node_id: code.is_good() for node_id, code in zip(node_ids, codes)}
+                logger.info(f"批次寫入節點: {sum(result.values())}/{len(result)} 成功")
+                return result
+            else:
+                logger.error("OPC UA 客戶端未連線")
+                return {}
+        except Exception as e:
+            logger.error(f"批次寫入節點失敗: {str(e)}")
+            return {}
+
+    async def browse_many(self, node_ids, refresh=False):
+        """一次請求瀏覽多個節點的子節點（node_id、browse_name、node_class）
+
+        結果依 browse_cache_ttl 快取，只有未快取或已過期的節點才會送出瀏覽請求。
+        """
+        now = time.monotonic()
+        result = {}
+        pending = []
+        for node_id in node_ids:
+            cached = self._browse_cache.get(node_id)
+            if cached and not refresh and now - cached[0] < self.browse_cache_ttl:
+                result[node_id] = cached[1]
+            else:
+                pending.append(node_id)
+        if not pending:
+            return result
+        try:
+            if self.client:
+                browsed = await self.client.browse_nodes([self.client.get_node(node_id) for node_id in pending])
+                for node_id, (_, browse_result) in zip(pending, browsed):
+                    children = [
+                        {
+                            "node_id": ref.NodeId.to_string(),
+                            "browse_name": ref.BrowseName.to_string(),
+                            "node_class": ref.NodeClass.name,
+                        }
+                        for ref in browse_result.References or []
+                        if ref.IsForward and ref.ReferenceTypeId != ua.NodeId(ua.ObjectIds.HasTypeDefinition)
+                    ]
+                    self._browse_cache[node_id] = (now, children)
+                    result[node_id] = children
+            else:
+                logger.error("OPC UA 客戶端未連線")
+        except Exception as e:
+            logger.error(f"瀏覽節點失敗: {str(e)}")
+        return result
+
+    async def browse_children(self, node_id="i=84", refresh=False):
+        """瀏覽單一節點的子節點（使用快取）"""
+        return (await self.browse_many([node_id], refresh)).get(node_id, [])
+
+    async def browse_tree(self, node_id="i=85", max_depth=3, refresh=False):
+        """廣度優先瀏覽命名空間並回傳所有變數節點；每一層只送出一次瀏覽請求"""
+        variables = []
+        level = [node_id]
+        seen = {node_id}
+        for _ in range(max_depth):
+            if not level:
+                break
+            results = await self.browse_many(level, refresh)
+            level = []
+            for children in results.values():
+                for child in children:
+                    if child["node_id"] in seen:
+                        continue
+                    seen.add(child["node_id"])
+                    if child["node_class"] == "Variable":
+                        variables.append(child)
+                    elif child["node_class"] == "Object":
+                        level.append(child["node_id"])
+        return variables
+
+    def clear_browse_cache(self):
+        self._browse_cache.clear()
@@ -0,0 +1,404 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from asyncua import Client, ua
+
+from .modbus_scheduler import publish_to_pipeline
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOURCE_ID = "opcua_device"
+DEADBAND_TYPES = {"none": ua.DeadbandType.None_, "absolute": ua.DeadbandType.Absolute, "percent": ua.DeadbandType.Percent}
+# 單次 CreateMonitoredItems 請求的項目數上限，避免超過伺服器的訊息大小限制
+MAX_ITEMS_PER_REQUEST = int(os.getenv("OPCUA_MAX_ITEMS_PER_REQUEST", "1000"))
+
+Publisher = Callable[[List[Dict[str, Any]]], Awaitable[None]]
+
+
+@dataclass(frozen=True)
+class MonitoredPoint:
+    """一個監控項目：sampling_interval 為伺服器取樣週期（毫秒），deadband 為變化量門檻"""
+    name: str
+    node_id: str
+    sampling_interval: float = 500.0
+    deadband: float = 0.0
+    deadband_type: str = "absolute"
+    queue_size: int = 1
+
+
+@dataclass
+class SubscriptionTarget:
+    """一台訂閱設備；publishing_interval 為伺服器送出通知的週期（毫秒）"""
+    device_id: str
+    endpoint: str
+    publishing_interval: float = 1000.0
+    source_id: str = DEFAULT_SOURCE_ID
+    points: List[MonitoredPoint] = field(default_factory=list)
+
+
+def parse_node_mappings(mappings: Dict[str, Any], sampling_interval: float = None, deadband: float = 0.0,
+                        deadband_type: str = "absolute", queue_size: int = 1) -> List[MonitoredPoint]:
+    """把節點對應設定（名稱 -> node_id 或 {node_id, sampling_interval, deadband, ...}）轉成監控項目"""
+    if sampling_interval is None:
+        sampling_interval = float(os.getenv("OPCUA_SAMPLING_INTERVAL", "500"))
+    points = []
+    for name, mapping in (mappings or {}).items():
+        if isinstance(mapping, str):
+            mapping = {"node_id": mapping}
+        point_deadband_type = mapping.get("deadband_type", deadband_type)
+        if point_deadband_type not in DEADBAND_TYPES:
+            raise ValueError(f"{name}: 不支援的 deadband 類型 {point_deadband_type}")
+        point = MonitoredPoint(
+            name=name,
+            node_id=mapping["node_id"],
+            sampling_interval=float(mapping.get("sampling_interval", sampling_interval)),
+            deadband=float(mapping.get("deadband", deadband)),
+            deadband_type=point_deadband_type,
+            queue_size=int(mapping.get("queue_size", queue_size)),
+        )
+        if point.deadband < 0 or (point.deadband_type == "percent" and point.deadband > 100):
+            raise ValueError(f"{name}: deadband 超出範圍")
+        ua.NodeId.from_string(point.node_id)
+        points.append(point)
+    return points
+
+
+def load_subscription_targets(db=None) -> List[SubscriptionTarget]:
+    """由 Device.connection_info 建立訂閱目標
+
+    protocol 為 opcua 且 connection_info 含 endpoint 與 nodes 的設備才會訂閱；
+    sampling_interval、deadband 等設定可放在設備層級作為各節點的預設值。
+    """
+    from .. import models
+    from ..database import get_postgres_session
+
+    own_session = db is None
+    db = db or get_postgres_session()
+    try:
+        devices = db.query(models.Device.device_id, models.Device.connection_info).filter(
+            models.Device.protocol == "opcua"
+        ).all()
+    finally:
+        if own_session:
+            db.close()
+
+    targets = []
+    for device_id, info in devices:
+        info = info or {}
+        endpoint = info.get("endpoint") or info.get("url")
+        if not endpoint or not info.get("nodes"):
+            continue
+        try:
+            points = parse_node_mappings(
+                info["nodes"],
+                sampling_interval=info.get("sampling_interval"),
+                deadband=float(info.get("deadband", 0.0)),
+                deadband_type=info.get("deadband_type", "absolute"),
+                queue_size=int(info.get("queue_size", 1)),
+            )
+        except (KeyError, ValueError, ua.UaError) as e:
+            logger.warning(f"OPC UA 設備 {device_id} 的節點設定無效: {e}")
+            continue
+        targets.append(SubscriptionTarget(
+            device_id=device_id,
+            endpoint=endpoint,
+            publishing_interval=float(info.get("publishing_interval", os.getenv("OPCUA_PUBLISHING_INTERVAL", "1000"))),
+            source_id=info.get("source_id", DEFAULT_SOURCE_ID),
+            points=points,
+        ))
+    return targets
+
+
+def build_monitored_item_request(point: MonitoredPoint, client_handle: int) -> ua.MonitoredItemCreateRequest:
+    """建立含取樣週期與 deadband 過濾條件的 MonitoredItemCreateRequest"""
+    item = ua.ReadValueId()
+    item.NodeId = ua.NodeId.from_string(point.node_id)
+    item.AttributeId = ua.AttributeIds.Value
+
+    params = ua.MonitoringParameters()
+    params.ClientHandle = client_handle
+    params.SamplingInterval = point.sampling_interval
+    params.QueueSize = point.queue_size
+    params.DiscardOldest = True
+    if point.deadband > 0 and point.deadband_type != "none":
+        data_filter = ua.DataChangeFilter()
+        data_filter.Trigger = ua.DataChangeTrigger.StatusValue
+        data_filter.DeadbandType = DEADBAND_TYPES[point.deadband_type]
+        data_filter.DeadbandValue = point.deadband
+        params.Filter = data_filter
+
+    request = ua.MonitoredItemCreateRequest()
+    request.ItemToMonitor = item
+    request.MonitoringMode = ua.MonitoringMode.Reporting
+    request.RequestedParameters = params
+    return request
+
+
+class SubscriptionMetrics:
+    """訂閱引擎的執行期指標"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.notifications = 0
+        self.published = 0
+        self.batches = 0
+        self.failed_items = 0
+        self.reconnects = 0
+        self.errors = 0
+
+    def incr(self, **amounts):
+        with self._lock:
+            for name, amount in amounts.items():
+                setattr(self, name, getattr(self, name) + amount)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "notifications": self.notifications,
+                "published": self.published,
+                "batches": self.batches,
+                "failed_items": self.failed_items,
+                "reconnects": self.reconnects,
+                "errors": self.errors,
+            }
+
+
+class _DataChangeHandler:
+    """把 asyncua 的資料變更通知依 client handle 對應回設備與欄位"""
+
+    def __init__(self, engine: "OPCUASubscriptionEngine"):
+        self.engine = engine
+        self.handles: Dict[int, Tuple[SubscriptionTarget, MonitoredPoint]] = {}
+
+    def datachange_notification(self, node, val, data):
+        mapping = self.handles.get(data.monitored_item.ClientHandle)
+        if mapping is None:
+            return
+        target, point = mapping
+        value = data.monitored_item.Value
+        if value.StatusCode is not None and not value.StatusCode.is_good():
+            return
+        self.engine._on_change(target, point.name, val, value.SourceTimestamp)
+
+    def status_change_notification(self, status):
+        logger.warning(f"OPC UA 訂閱狀態變更: {status}")
+
+
+class OPCUASubscriptionEngine:
+    """OPC UA 訂閱式資料擷取
+
+    每個伺服器端點一條連線，設備的節點依發布週期分組建立訂閱，監控項目
+    以批次請求建立並帶有取樣週期與 deadband 過濾，由伺服器只在值變化超過
+    門檻時送出通知。通知先合併到各設備的最新狀態，每隔 batch_interval 秒
+    （或變更設備數達 batch_size）把有變更的設備整理成一批交給處理管道。
+    引擎在專用執行緒的事件循環中執行，連線中斷時以指數退避重新連線並重建訂閱。
+    """
+
+    def __init__(self, publish: Publisher = None, batch_size: int = None, batch_interval: float = None,
+                 request_timeout: float = None, watchdog_interval: float = None,
+                 backoff_base: float = None, backoff_max: float = None):
+        self.publish = publish or publish_to_pipeline
+        self.batch_size = batch_size or int(os.getenv("OPCUA_BATCH_SIZE", "500"))
+        self.batch_interval = batch_interval or float(os.getenv("OPCUA_BATCH_INTERVAL", "1.0"))
+        self.request_timeout = request_timeout or float(os.getenv("OPCUA_REQUEST_TIMEOUT", "4"))
+        self.watchdog_interval = watchdog_interval or float(os.getenv("OPCUA_WATCHDOG_INTERVAL", "5"))
+        self.backoff_base = backoff_base or float(os.getenv("OPCUA_RECONNECT_BACKOFF_BASE", "1"))
+        self.backoff_max = backoff_max or float(os.getenv("OPCUA_RECONNECT_BACKOFF_MAX", "60"))
+        self.targets: List[SubscriptionTarget] = []
+        self.metrics = SubscriptionMetrics()
+        self._sessions: Dict[str, Dict[str, Any]] = {}
+        self._latest: Dict[str, Dict[str, Any]] = {}
+        self._changed: Dict[str, Tuple[SubscriptionTarget, Optional[datetime]]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopping: Optional[asyncio.Event] = None
+        self._flush_now: Optional[asyncio.Event] = None
+        self._start_lock = threading.Lock()
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, targets: List[SubscriptionTarget] = None):
+        """啟動訂閱；未指定目標時由資料庫中的 OPC UA 設備建立"""
+        with self._start_lock:
+            if self.is_running:
+                return
+            self.targets = targets if targets is not None else load_subscription_targets()
+            ready = threading.Event()
+            self._thread = threading.Thread(target=self._run, args=(ready,), name="opcua-subscriber", daemon=True)
+            self._thread.start()
+            ready.wait(5)
+            items = sum(len(t.points) for t in self.targets)
+            endpoints = len({t.endpoint for t in self.targets})
+            logger.info(f"OPC UA 訂閱啟動: {len(self.targets)} 台設備，{items} 個監控項目，{endpoints} 個端點")
+
+    def stop(self, timeout: float = 10.0):
+        """停止訂閱，送出尚未發布的變更"""
+        with self._start_lock:
+            if not self.is_running:
+                return
+            if self._loop is not None and self._stopping is not None:
+                self._loop.call_soon_threadsafe(self._stopping.set)
+            self._thread.join(timeout)
+            self._thread = None
+            logger.info("OPC UA 訂閱已停止")
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            "running": self.is_running,
+            "devices": len(self.targets),
+            "monitored_items": sum(len(t.points) for t in self.targets),
+            "endpoints": {endpoint: dict(session) for endpoint, session in list(self._sessions.items())},
+            "metrics": self.metrics.snapshot(),
+        }
+
+    def _run(self, ready: threading.Event):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_until_complete(self._main(ready))
+        finally:
+            self._loop.close()
+            self._loop = None
+
+    async def _main(self, ready: threading.Event):
+        self._stopping = asyncio.Event()
+        self._flush_now = asyncio.Event()
+        self._latest = {}
+        self._changed = {}
+        endpoints: Dict[str, List[SubscriptionTarget]] = {}
+        for target in self.targets:
+            endpoints.setdefault(target.endpoint, []).append(target)
+        self._sessions = {
+            endpoint: {"connected": False, "subscriptions": 0, "monitored_items": 0, "failed_items": 0,
+                       "reconnects": 0, "last_error": None}
+            for endpoint in endpoints
+        }
+        publisher = asyncio.create_task(self._publish_loop())
+        sessions = [asyncio.create_task(self._run_endpoint(endpoint, group)) for endpoint, group in endpoints.items()]
+        ready.set()
+        try:
+            await self._stopping.wait()
+        finally:
+            await asyncio.gather(*sessions, return_exceptions=True)
+            self._flush_now.set()
+            await publisher
+
+    async def _run_endpoint(self, endpoint: str, targets: List[SubscriptionTarget]):
+        """維持一個端點的連線與訂閱；中斷時以指數退避（含隨機抖動）重新連線"""
+        session = self._sessions[endpoint]
+        attempt = 0
+        while not self._stopping.is_set():
+            client = Client(url=endpoint, timeout=self.request_timeout)
+            try:
+                await client.connect()
+                if attempt:
+                    session["reconnects"] += 1
+                    self.metrics.incr(reconnects=1)
+                    logger.info(f"OPC UA 端點 {endpoint} 已重新連線")
+                attempt = 0
+                await self._subscribe(client, targets, session)
+                session["connected"] = True
+                while not self._stopping.is_set():
+                    try:
+                        await asyncio.wait_for(self._stopping.wait(), self.watchdog_interval)
+                    except asyncio.TimeoutError:
+                        await asyncio.wait_for(client.check_connection(), self.request_timeout)
+            except Exception as e:
+                session["last_error"] = str(e) or type(e).__name__
+                self.metrics.incr(errors=1)
+                logger.warning(f"OPC UA 端點 {endpoint} 連線失敗: {session['last_error']}")
+            finally:
+                session["connected"] = False
+                try:
+                    await asyncio.wait_for(client.disconnect(), self.request_timeout)
+                except Exception:
+                    pass
+            if self._stopping.is_set():
+                break
+            delay = min(self.backoff_max, self.backoff_base * (2 ** attempt)) * random.uniform(0.5, 1.0)
+            attempt += 1
+            try:
+                await asyncio.wait_for(self._stopping.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _subscribe(self, client: Client, targets: List[SubscriptionTarget], session: Dict[str, Any]):
+        """依發布週期分組建立訂閱，監控項目以批次請求建立"""
+        groups: Dict[float, List[Tuple[SubscriptionTarget, MonitoredPoint]]] = {}
+        for target in targets:
+            for point in target.points:
+                groups.setdefault(target.publishing_interval, []).append((target, point))
+
+        session.update(subscriptions=0, monitored_items=0, failed_items=0)
+        for publishing_interval, items in groups.items():
+            handler = _DataChangeHandler(self)
+            subscription = await client.create_subscription(publishing_interval, handler)
+            session["subscriptions"] += 1
+            for start in range(0, len(items), MAX_ITEMS_PER_REQUEST):
+                chunk = items[start:start + MAX_ITEMS_PER_REQUEST]
+                requests = []
+                for offset, (target, point) in enumerate(chunk):
+                    client_handle = start + offset + 1
+                    handler.handles[client_handle] = (target, point)
+                    requests.append(build_monitored_item_request(point, client_handle))
+                results = await subscription.create_monitored_items(requests)
+                for (target, point), result in zip(chunk, results):
+                    if isinstance(result, ua.StatusCode):
+                        session["failed_items"] += 1
+                        self.metrics.incr(failed_items=1)
+                        logger.warning(f"OPC UA 監控項目建立失敗 {target.device_id}.{point.name} ({point.node_id}): {result}")
+                    else:
+                        session["monitored_items"] += 1
+
+    def _on_change(self, target: SubscriptionTarget, name: str, value: Any, source_timestamp: Optional[datetime]):
+        """合併資料變更通知；同一設備在一批中只輸出一筆含最新值的記錄"""
+        self.metrics.incr(notifications=1)
+        self._latest.setdefault(target.device_id, {})[name] = value
+        previous = self._changed.get(target.device_id)
+        if previous is None or (source_timestamp and (previous[1] is None or source_timestamp > previous[1])):
+            self._changed[target.device_id] = (target, source_timestamp)
+        if len(self._changed) >= self.batch_size:
+            self._flush_now.set()
+
+    def _take_batch(self) -> List[Dict[str, Any]]:
+        changed, self._changed = self._changed, {}
+        return [
+            {
+                "device_id": device_id,
+                "source_id": target.source_id,
+                "timestamp": (timestamp.replace(tzinfo=None) if timestamp else datetime.utcnow()),
+                **self._latest[device_id],
+            }
+            for device_id, (target, timestamp) in changed.items()
+        ]
+
+    async def _publish_loop(self):
+        """每 batch_interval 秒（或變更設備數達 batch_size 時）發布一批"""
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_now.wait(), self.batch_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_now.clear()
+            done = self._stopping.is_set()
+            batch = self._take_batch()
+            if batch:
+                try:
+                    await self.publish(batch)
+                    self.metrics.incr(published=len(batch), batches=1)
+                except Exception as e:
+                    logger.error(f"OPC UA 資料發布失敗: {e}")
+            if done:
+                return
+
+
+# 全局實例
+opcua_subscription_engine = OPCUASubscriptionEngine()
@@ -0,0 +1,216 @@
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Modbus 單次讀取暫存器數量上限（協定規定 125）
+MAX_REGISTERS_PER_READ = 125
+
+FUNCTIONS = ("holding", "input")
+BYTE_ORDERS = ("big", "little")
+
+# 資料型別 -> (numpy 型別代碼, 佔用暫存器數)
+DATA_TYPES: Dict[str, Tuple[str, int]] = {
+    "uint16": ("u2", 1),
+    "int16": ("i2", 1),
+    "uint32": ("u4", 2),
+    "int32": ("i4", 2),
+    "float32": ("f4", 2),
+    "uint64": ("u8", 4),
+    "int64": ("i8", 4),
+    "float64": ("f8", 4),
+}
+
+
+@dataclass(frozen=True)
+class RegisterPoint:
+    """暫存器對應的一個量測點
+
+    byte_order 為單一暫存器內兩個位元組的順序，word_order 為多暫存器型別
+    中各暫存器的順序（big 表示高位字在前）。bit/bits 用於從整數中取出
+    位元欄位（由最低位起算的起始位元與長度）。
+    """
+    name: str
+    address: int
+    count: int = 1
+    scale: float = 1.0
+    offset: float = 0.0
+    function: str = "holding"
+    unit_id: int = 1
+    data_type: str = "uint16"
+    byte_order: str = "big"
+    word_order: str = "big"
+    bit: Optional[int] = None
+    bits: int = 1
+
+
+def parse_register_mappings(mappings: Dict[str, Dict[str, Any]], unit_id: int = 1, byte_order: str = "big",
+                            word_order: str = "big") -> List[RegisterPoint]:
+    """把 register_mappings 設定（名稱 -> {address, scale, type, ...}）轉成量測點
+
+    未指定 type 時，count 為 1 視為 uint16，否則視為以高位字在前組合的
+    無號整數（與舊設定相容）；byte_order/word_order 可逐點覆寫整張對應表的預設值。
+    """
+    points = []
+    for name, mapping in (mappings or {}).items():
+        function = mapping.get("function", "holding")
+        if function not in FUNCTIONS:
+            raise ValueError(f"{name}: 不支援的暫存器類型 {function}")
+        data_type = mapping.get("type") or mapping.get("data_type")
+        if data_type is None:
+            count = int(mapping.get("count", 1))
+            data_type = {1: "uint16", 2: "uint32", 4: "uint64"}.get(count, "uint")
+        elif data_type not in DATA_TYPES:
+            raise ValueError(f"{name}: 不支援的資料型別 {data_type}")
+        else:
+            count = DATA_TYPES[data_type][1]
+        if count < 1 or count > MAX_REGISTERS_PER_READ:
+            raise ValueError(f"{name}: 暫存器數量必須介於 1 與 {MAX_REGISTERS_PER_READ} 之間")
+        point_byte_order = mapping.get("byte_order", byte_order)
+        point_word_order = mapping.get("word_order", word_order)
+        if point_byte_order not in BYTE_ORDERS or point_word_order not in BYTE_ORDERS:
+            raise ValueError(f"{name}: byte_order/word_order 只能是 big 或 little")
+        bit = mapping.get("bit")
+        bits = int(mapping.get("bits", 1))
+        if bit is not None:
+            bit = int(bit)
+            if data_type.startswith("float"):
+                raise ValueError(f"{name}: 浮點數不支援位元欄位")
+            if bit < 0 or bits < 1 or bit + bits > count * 16:
+                raise ValueError(f"{name}: 位元欄位超出 {data_type} 的範圍")
+        points.append(RegisterPoint(
+            name=name,
+            address=int(mapping["address"]),
+            count=count,
+            scale=float(mapping.get("scale", 1.0)),
+            offset=float(mapping.get("offset", 0.0)),
+            function=function,
+            unit_id=int(mapping.get("unit_id", unit_id)),
+            data_type=data_type,
+            byte_order=point_byte_order,
+            word_order=point_word_order,
+            bit=bit,
+            bits=bits,
+        ))
+    return points
+
+
+class _DecodeGroup:
+    """同型別、同位元組與字組順序（且同為或同非位元欄位）的量測點，一次向量化解碼"""
+
+    def __init__(self, code: str, count: int, byte_order: str, word_order: str, points: List[RegisterPoint],
+                 start: int, length: int):
+        self.dtype = np.dtype(">" + code)
+        self.count = count
+        self.byte_order = byte_order
+        self.word_order = word_order
+        self.names = [p.name for p in points]
+        offsets = np.array([p.address - start for p in points], dtype=np.intp)
+        # 字組順序相反時改從反轉後的區塊取值，對應位置也跟著反轉
+        self.offsets = (length - offsets - count) if word_order == "little" else offsets
+        self.scale = np.array([p.scale for p in points], dtype=np.float64)
+        self.offset = np.array([p.offset for p in points], dtype=np.float64)
+        self.has_bits = points[0].bit is not None
+        if self.has_bits:
+            self.shift = np.array([p.bit for p in points], dtype=np.uint64)
+            self.mask = np.array([(1 << p.bits) - 1 for p in points], dtype=np.uint64)
+
+    def decode(self, buffers: Dict[Tuple[str, str], np.ndarray]) -> np.ndarray:
+        data = buffers[(self.byte_order, self.word_order)]
+        # 以 2 個位元組為步距的重疊視圖：第 i 個元素即從第 i 個暫存器開始的值，不複製資料
+        view = np.ndarray(
+            shape=(len(data) // 2 - self.count + 1,), dtype=self.dtype, buffer=data, strides=(2,)
+        )
+        raw = view[self.offsets]
+        if self.has_bits:
+            raw = (raw.astype(np.uint64) >> self.shift) & self.mask
+        return raw * self.scale + self.offset
+
+
+class RegisterDecoder:
+    """一個暫存器區塊的表格式解碼器
+
+    依量測點設定編譯一次：相同型別與位元組順序的量測點分成一組，解碼時
+    把整個區塊轉成位元組緩衝區，每組以 numpy 重疊視圖一次取出所有值再
+    套用縮放與位移。同一組設定的設備可共用同一個解碼器。
+    """
+
+    def __init__(self, points: Sequence[RegisterPoint], start: int = None, length: int = None):
+        points = list(points)
+        self.start = min((p.address for p in points), default=0) if start is None else start
+        end = max((p.address + p.count for p in points), default=self.start)
+        self.length = end - self.start if length is None else length
+        if self.length < end - self.start:
+            raise ValueError(f"區塊長度 {self.length} 不足以容納所有量測點（需要 {end - self.start}）")
+
+        groups: Dict[Tuple[str, int, str, str, bool], List[RegisterPoint]] = {}
+        self._wide: List[RegisterPoint] = []
+        for point in points:
+            if point.data_type in DATA_TYPES:
+                code, count = DATA_TYPES[point.data_type]
+                byte_order = point.byte_order
+                word_order = point.word_order if count > 1 else "big"
+                key = (code, count, byte_order, word_order, point.bit is not None)
+                groups.setdefault(key, []).append(point)
+            else:
+                # 超過 64 位元的無號整數沒有對應的 numpy 型別，逐點組合
+                self._wide.append(point)
+        self._groups = [
+            _DecodeGroup(code, count, byte_order, word_order, group, self.start, self.length)
+            for (code, count, byte_order, word_order, _), group in groups.items()
+        ]
+        self._orders = {(g.byte_order, g.word_order) for g in self._groups}
+        self.names = [name for g in self._groups for name in g.names] + [p.name for p in self._wide]
+
+    def _buffers(self, registers: np.ndarray) -> Dict[Tuple[str, str], np.ndarray]:
+        """依需要的順序產生區塊的位元組緩衝區，每種順序只轉換一次"""
+        buffers = {}
+        for byte_order, word_order in self._orders:
+            words = registers[::-1] if word_order == "little" else registers
+            buffers[(byte_order, word_order)] = np.ascontiguousarray(
+                words, dtype=">u2" if byte_order == "big" else "<u2"
+            ).view(np.uint8)
+        return buffers
+
+    def decode_array(self, registers) -> np.ndarray:
+        """解碼一個區塊，回傳與 names 順序相同的量測值陣列"""
+        registers = np.asarray(registers, dtype=np.uint16)
+        if len(registers) < self.length:
+            raise ValueError(f"暫存器數量不足: 需要 {self.length}，收到 {len(registers)}")
+        registers = registers[:self.length]
+        buffers = self._buffers(registers)
+        parts = [group.decode(buffers) for group in self._groups]
+        if self._wide:
+            parts.append(np.array([self._decode_wide(point, registers) for point in self._wide], dtype=np.float64))
+        return np.concatenate(parts) if parts else np.empty(0, dtype=np.float64)
+
+    def decode(self, registers) -> Dict[str, float]:
+        """解碼一個區塊，回傳量測點名稱 -> 量測值"""
+        return dict(zip(self.names, self.decode_array(registers).tolist()))
+
+    def _decode_wide(self, point: RegisterPoint, registers: np.ndarray) -> float:
+        words = registers[point.address - self.start:point.address - self.start + point.count].tolist()
+        if point.byte_order == "little":
+            words = [((w & 0xFF) << 8) | (w >> 8) for w in words]
+        if point.word_order == "little":
+            words.reverse()
+        raw = 0
+        for word in words:
+            raw = (raw << 16) | word
+        if point.bit is not None:
+            raw = (raw >> point.bit) & ((1 << point.bits) - 1)
+        return raw * point.scale + point.offset
+
+
+def compile_register_map(mappings: Dict[str, Dict[str, Any]], start: int = None, length: int = None,
+                         **defaults) -> RegisterDecoder:
+    """由 register_mappings 設定編譯解碼器"""
+    return RegisterDecoder(parse_register_mappings(mappings, **defaults), start, length)
+
+
+
+@lru_cache(maxsize=4096)
+def get_block_decoder(points: Tuple[RegisterPoint, ...], start: int, length: int) -> RegisterDecoder:
+    """取得區塊的解碼器；設定相同的區塊（例如同型號設備）共用同一個編譯結果"""
+    return RegisterDecoder(points, start, length)
@@ -5,10 +5,12 @@
 
 import time
 import asyncio
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, List, AsyncIterator
 from urllib.parse import quote_plus
 import logging
 
+from .services.connection_probe_service import connection_probe_service, probe_cache_key
+
 # 設定日誌
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -19,24 +21,54 @@ class RemoteDatabaseTester:
     def __init__(self):
         self.test_results = {}
     
-    async def test_connection(self, connection_config: Dict[str, Any]) -> Dict[str, Any]:
-        """測試資料庫連線"""
+    async def test_connection(self, connection_config: Dict[str, Any], use_cache: bool = True) -> Dict[str, Any]:
+        """測試資料庫連線（阻塞的驅動呼叫在探測執行緒池中執行，不阻塞事件迴圈）"""
+        db_type = connection_config.get("db_type")
+        cache_key = probe_cache_key(connection_config) if use_cache else None
+        result = await connection_probe_service.probe(
+            db_type or "unknown", self._test_sync, connection_config,
+            timeout=self._driver_timeout(connection_config) + 1, cache_key=cache_key
+        )
+        self.test_results[connection_config.get("name") or db_type] = result
+        return result
+
+    async def stream_connections(self, connection_configs: List[Dict[str, Any]],
+                                 overall_timeout: float = None) -> AsyncIterator[Dict[str, Any]]:
+        """並行測試多個連線，依完成順序逐筆產生結果"""
+        probes = {}
+        for index, config in enumerate(connection_configs):
+            name = config.get("name") or f"{config.get('db_type')}_{index}"
+            probes[name] = (self._test_sync, (config,), probe_cache_key(config))
+        async for result in connection_probe_service.stream(probes, overall_timeout=overall_timeout):
+            self.test_results[result["name"]] = result
+            yield result
+
+    async def test_connections(self, connection_configs: List[Dict[str, Any]],
+                               overall_timeout: float = None) -> Dict[str, Dict[str, Any]]:
+        """並行測試多個連線，回傳 名稱 -> 結果"""
+        results = {}
+        async for result in self.stream_connections(connection_configs, overall_timeout):
+            results[result["name"]] = result
+        return results
+
+    def _test_sync(self, connection_config: Dict[str, Any]) -> Dict[str, Any]:
+        """依資料庫類型執行阻塞的連線測試"""
         db_type = connection_config.get("db_type")
         start_time = time.time()
         
         try:
             if db_type == "postgresql":
-                result = await self._test_postgresql(connection_config)
+                result = self._test_postgresql(connection_config)
             elif db_type == "mysql":
-                result = await self._test_mysql(connection_config)
+                result = self._test_mysql(connection_config)
             elif db_type == "mongodb":
-                result = await self._test_mongodb(connection_config)
+                result = self._test_mongodb(connection_config)
             elif db_type == "influxdb":
-                result = await self._test_influxdb(connection_config)
+                result = self._test_influxdb(connection_config)
             elif db_type == "oracle":
-                result = await self._test_oracle(connection_config)
+                result = self._test_oracle(connection_config)
             elif db_type == "sqlserver":
-                result = await self._test_sqlserver(connection_config)
+                result = self._test_sqlserver(connection_config)
             else:
                 result = {
                     "success": False,
@@ -59,7 +91,7 @@ class RemoteDatabaseTester:
                 "response_time": response_time
             }
     
-    async def _test_postgresql(self, config: Dict[str, Any]) -> Dict[str, Any]:
+    def _test_postgresql(self, config: Dict[str, Any]) -> Dict[str, Any]:
         """測試 PostgreSQL 連線"""
         try:
             import psycopg2
@@ -75,7 +107,7 @@ class RemoteDatabaseTester:
             connection_string = f"postgresql://{username}:{password}@{host}:{port}/{database}"
             
             # 測試連線
-            conn = psycopg2.connect(connection_string, connect_timeout=10)
+            conn = psycopg2.connect(connection_string, connect_timeout=self._driver_timeout(config))
             conn.close()
             
             return {
@@ -101,7 +133,7 @@ class RemoteDatabaseTester:
                 "error": "psycopg2 not installed"
             }
     
-    async def _test_mysql(self, config: Dict[str, Any]) -> Dict[str, Any]:
+    def _test_mysql(self, config: Dict[str, Any]) -> Dict[str, Any]:
         """測試 MySQL 連線"""
         try:
             import mysql.connector
@@ -120,7 +152,7 @@ class RemoteDatabaseTester:
                 user=username,
                 password=password,
                 database=database,
-                connection_timeout=10
+                connection_timeout=self._driver_timeout(config)
             )
             conn.close()
             
@@ -147,7 +179,7 @@ class RemoteDatabaseTester:
                 "error": "mysql-connector-python not installed"
             }
     
-    async def _test_mongodb(self, config: Dict[str, Any]) -> Dict[str, Any]:
+    def _test_mongodb(self, config: Dict[str, Any]) -> Dict[str, Any]:
         """測試 MongoDB 連線"""
         try:
             from pymongo import MongoClient
@@ -180,7 +212,7 @@ class RemoteDatabaseTester:
                 params["ssl"] = True
             
             # 測試連線
-            client = MongoClient(connection_string, serverSelectionTimeoutMS=10000, **params)
+            client = MongoClient(connection_string, serverSelectionTimeoutMS=self._driver_timeout(config) * 1000, **params)
             client.admin.command('ping')
             client.close()
             
@@ -209,7 +241,7 @@ class RemoteDatabaseTester:
                 "error": "pymongo not installed"
             }
     
-    async def _test_influxdb(self, config: Dict[str, Any]) -> Dict[str, Any]:
+    def _test_influxdb(self, config: Dict[str, Any]) -> Dict[str, Any]:
         """測試 InfluxDB 連線"""
         try:
             from influxdb_client import InfluxDBClient
@@ -223,10 +255,18 @@ class RemoteDatabaseTester:
             url = f"http://{host}:{port}"
             
             # 測試連線
-            client = InfluxDBClient(url=url, token=token, org=org, timeout=10000)
+            client = InfluxDBClient(url=url, token=token, org=org, timeout=self._driver_timeout(config) * 1000)
             health = client.health()
             client.close()
             
+            # health() 連不上時不會拋出例外，而是回傳 status="fail"
+            if health.status != "pass":
+                return {
+                    "success": False,
+                    "message": "InfluxDB 連線失敗",
+                    "error": health.message or ""
+                }
+            
             return {
                 "success": True,
                 "message": "InfluxDB 連線成功",
@@ -251,7 +291,7 @@ class RemoteDatabaseTester:
                 "error": "influxdb-client not installed"
             }
     
-    async def _test_oracle(self, config: Dict[str, Any]) -> Dict[str, Any]:
+    def _test_oracle(self, config: Dict[str, Any]) -> Dict[str, Any]:
         """測試 Oracle 連線"""
         try:
             import cx_Oracle
@@ -301,7 +341,7 @@ class RemoteDatabaseTester:
                 "error": "cx_Oracle not installed"
             }
     
-    async def _test_sqlserver(self, config: Dict[str, Any]) -> Dict[str, Any]:
+    def _test_sqlserver(self, config: Dict[str, Any]) -> Dict[str, Any]:
         """測試 SQL Server 連線"""
         try:
             import pyodbc
@@ -317,7 +357,7 @@ class RemoteDatabaseTester:
             connection_string = f"DRIVER={{{driver}}};SERVER={host},{port};DATABASE={database};UID={username};PWD={password}"
             
             # 測試連線
-            conn = pyodbc.connect(connection_string, timeout=10)
+            conn = pyodbc.connect(connection_string, timeout=self._driver_timeout(config))
             conn.close()
             
             return {
@@ -344,6 +384,11 @@ class RemoteDatabaseTester:
                 "error": "pyodbc not installed"
             }
     
+    def _driver_timeout(self, config: Dict[str, Any]) -> int:
+        """驅動層的連線逾時不超過探測期限"""
+        timeout = config.get("timeout") or connection_probe_service.probe_timeout
+        return max(1, int(min(float(timeout), connection_probe_service.probe_timeout)))
+    
     def get_connection_info(self, config: Dict[str, Any]) -> Dict[str, Any]:
         """獲取連線資訊摘要"""
         return {
@@ -393,6 +438,9 @@ class RemoteDatabaseTester:
             "errors": errors
         }
 
+# 全局實例
+remote_database_tester = RemoteDatabaseTester()
+
 # 使用範例
 async def main():
     """測試範例"""
@@ -436,18 +484,18 @@ async def main():
     # 測試連線
     configs = [postgres_config, mongo_config, influx_config]
     
+    valid_configs = []
     for config in configs:
-        print(f"\n測試 {config['name']}...")
-        
         # 驗證配置
         validation = tester.validate_connection_config(config)
         if not validation["valid"]:
-            print(f"配置驗證失敗: {validation['errors']}")
+            print(f"{config['name']} 配置驗證失敗: {validation['errors']}")
             continue
-        
-        # 測試連線
-        result = await tester.test_connection(config)
-        
+        valid_configs.append(config)
+    
+    # 並行測試連線，先完成的先顯示
+    async for result in tester.stream_connections(valid_configs):
+        print(f"\n{result['name']}:")
         if result["success"]:
             print(f"✅ {result['message']}")
             print(f"   響應時間: {result['response_time']:.2f}ms")
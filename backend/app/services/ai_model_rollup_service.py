@@ -0,0 +1,405 @@
+import logging
+import os
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+
+from .. import models
+from ..database import get_postgres_session
+from .latency_sketch import LatencySketch
+
+logger = logging.getLogger(__name__)
+
+# 維護的分桶解析度（秒）
+RESOLUTIONS = {"1m": 60, "1h": 3600, "1d": 86400}
+# 性能記錄中取平均的資源使用率欄位
+GAUGES = ("cpu_usage", "memory_usage", "gpu_usage", "gpu_memory_usage")
+
+EPOCH = datetime(1970, 1, 1)
+_RESOLUTION_PATTERN = re.compile(r"^(\d+)([mhd])$")
+_UNIT_SECONDS = {"m": 60, "h": 3600, "d": 86400}
+
+# (model_id, 解析度, 分桶起點)
+BucketKey = Tuple[int, str, datetime]
+
+
+def bucket_start(timestamp: datetime, seconds: int) -> datetime:
+    """時間所在分桶的起點（以 UTC epoch 對齊）"""
+    elapsed = int((timestamp - EPOCH).total_seconds())
+    return EPOCH + timedelta(seconds=elapsed - elapsed % seconds)
+
+
+def parse_resolution(value: str) -> int:
+    """把 "5m"、"1h"、"7d" 等解析度轉成秒數"""
+    match = _RESOLUTION_PATTERN.match(value or "")
+    if not match or int(match.group(1)) <= 0:
+        raise ValueError(f"不支援的解析度: {value}")
+    return int(match.group(1)) * _UNIT_SECONDS[match.group(2)]
+
+
+class _BucketDelta:
+    """一個分桶在兩次寫回之間累積的變動"""
+
+    __slots__ = ("request_count", "error_count", "sketch", "gauges")
+
+    def __init__(self):
+        self.request_count = 0
+        self.error_count = 0
+        self.sketch = LatencySketch()
+        self.gauges: Dict[str, List[float]] = {}
+
+    def merge(self, other: "_BucketDelta"):
+        self.request_count += other.request_count
+        self.error_count += other.error_count
+        self.sketch.merge(other.sketch)
+        for name, (total, count) in other.gauges.items():
+            current = self.gauges.setdefault(name, [0.0, 0])
+            current[0] += total
+            current[1] += count
+
+    def apply_to(self, row: "models.AIModelRollup"):
+        """併入資料庫中既有的分桶（JSON 欄位整個替換，確保會被寫回）"""
+        row.request_count = (row.request_count or 0) + self.request_count
+        row.error_count = (row.error_count or 0) + self.error_count
+        row.latency_sketch = LatencySketch.from_dict(row.latency_sketch).merge(self.sketch).to_dict()
+        gauges = {name: list(value) for name, value in (row.gauges or {}).items()}
+        for name, (total, count) in self.gauges.items():
+            current = gauges.setdefault(name, [0.0, 0])
+            current[0] += total
+            current[1] += count
+        row.gauges = gauges
+
+
+class AIModelRollupService:
+    """AI Model 使用量與性能的時間分桶彙總
+
+    每筆使用記錄與性能記錄寫入時，同時累加到 1 分鐘、1 小時、1 天三種
+    分桶的記憶體變動中；背景執行緒每隔 flush_interval 秒把變動合併寫回
+    ai_model_rollups 表。延遲以可合併的摘要保存，查詢較粗的解析度時把細
+    分桶的摘要合併即可得到 p50/p95/p99，不需要讀取原始記錄。
+    """
+
+    def __init__(self, flush_interval: float = None):
+        self.flush_interval = flush_interval or float(os.getenv("AI_MODEL_ROLLUP_FLUSH_INTERVAL", "10"))
+        # 各解析度的保留天數，0 表示不刪除
+        self.retention_days = {
+            "1m": int(os.getenv("AI_MODEL_ROLLUP_RETENTION_DAYS_1M", "7")),
+            "1h": int(os.getenv("AI_MODEL_ROLLUP_RETENTION_DAYS_1H", "90")),
+            "1d": int(os.getenv("AI_MODEL_ROLLUP_RETENTION_DAYS_1D", "0")),
+        }
+        self.prune_interval = 3600
+        self._pending: Dict[BucketKey, _BucketDelta] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._last_prune = 0.0
+        self.records = 0
+        self.flushes = 0
+        self.buckets_flushed = 0
+        self.flush_failures = 0
+        self.last_flush_at: Optional[datetime] = None
+
+    def record_usage(self, model_id: int, timestamp: datetime = None, processing_time: float = None,
+                     success: bool = True):
+        """記錄一次模型呼叫；processing_time 以秒計"""
+        latency = processing_time * 1000 if processing_time is not None else None
+        with self._lock:
+            self._accumulate(self._pending, model_id, timestamp or datetime.utcnow(), 1, 0 if success else 1, latency)
+            self.records += 1
+        self._ensure_started()
+
+    def record_performance(self, model_id: int, timestamp: datetime = None, request_count: int = 0,
+                           error_count: int = 0, avg_latency: float = None, **gauges):
+        """記錄一筆性能取樣；avg_latency 以毫秒計，依 request_count 加權"""
+        with self._lock:
+            self._accumulate(self._pending, model_id, timestamp or datetime.utcnow(),
+                             request_count or 0, error_count or 0, avg_latency, gauges)
+            self.records += 1
+        self._ensure_started()
+
+    @staticmethod
+    def _accumulate(pending: Dict[BucketKey, _BucketDelta], model_id: int, timestamp: datetime,
+                    requests: int, errors: int, latency: Optional[float], gauges: Dict[str, Any] = None):
+        for resolution, seconds in RESOLUTIONS.items():
+            key = (model_id, resolution, bucket_start(timestamp, seconds))
+            delta = pending.get(key)
+            if delta is None:
+                delta = pending[key] = _BucketDelta()
+            delta.request_count += requests
+            delta.error_count += errors
+            if latency is not None:
+                delta.sketch.add(latency, max(requests, 1))
+            for name in GAUGES:
+                value = (gauges or {}).get(name)
+                if value is not None:
+                    current = delta.gauges.setdefault(name, [0.0, 0])
+                    current[0] += value
+                    current[1] += 1
+
+    def flush(self) -> int:
+        """把累積的變動合併寫回資料庫，回傳寫回的分桶數（有寫入時順便刪除過期分桶）
+
+        每個 (model, 解析度) 各自一筆交易：某一組寫入失敗只重新排入該組，
+        不會擋住其他模型；已刪除模型的變動直接丟棄，不再重試。
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+
+            db = get_postgres_session()
+            try:
+                try:
+                    model_ids = {model_id for model_id, _, _ in pending}
+                    existing = set(db.execute(
+                        select(models.AIModel.id).where(models.AIModel.id.in_(model_ids))
+                    ).scalars())
+                except Exception as e:
+                    db.rollback()
+                    self.flush_failures += 1
+                    logger.error(f"AI Model 彙總寫回失敗: {e}")
+                    self._requeue(pending)
+                    return 0
+
+                groups: Dict[Tuple[int, str], Dict[BucketKey, _BucketDelta]] = {}
+                dropped = 0
+                for key, delta in pending.items():
+                    if key[0] in existing:
+                        groups.setdefault(key[:2], {})[key] = delta
+                    else:
+                        dropped += 1
+                if dropped:
+                    logger.warning(f"丟棄已刪除模型的 {dropped} 個彙總分桶: {sorted(model_ids - existing)}")
+
+                written = 0
+                for (model_id, resolution), group in groups.items():
+                    try:
+                        self.write(db, group)
+                        db.commit()
+                        written += len(group)
+                    except Exception as e:
+                        db.rollback()
+                        self.flush_failures += 1
+                        logger.error(f"AI Model {model_id} 的 {resolution} 彙總寫回失敗: {e}")
+                        self._requeue(group)
+
+                if written and time.monotonic() - self._last_prune >= self.prune_interval:
+                    try:
+                        self.prune(db)
+                        db.commit()
+                        self._last_prune = time.monotonic()
+                    except Exception as e:
+                        db.rollback()
+                        logger.error(f"刪除過期 AI Model 彙總失敗: {e}")
+            finally:
+                db.close()
+
+            self.flushes += 1
+            self.buckets_flushed += written
+            self.last_flush_at = datetime.utcnow()
+            return written
+
+    def write(self, db, pending: Dict[BucketKey, _BucketDelta], chunk_size: int = 500):
+        """把變動合併到既有分桶（不存在則新增），不提交交易"""
+        groups: Dict[Tuple[int, str], Dict[datetime, _BucketDelta]] = {}
+        for (model_id, resolution, start), delta in pending.items():
+            groups.setdefault((model_id, resolution), {})[start] = delta
+
+        Rollup = models.AIModelRollup
+        for (model_id, resolution), deltas in groups.items():
+            starts = list(deltas)
+            for offset in range(0, len(starts), chunk_size):
+                chunk = starts[offset:offset + chunk_size]
+                existing = {
+                    row.bucket_start: row
+                    for row in db.execute(
+                        select(Rollup).where(
+                            Rollup.model_id == model_id,
+                            Rollup.resolution == resolution,
+                            Rollup.bucket_start.in_(chunk),
+                        ).with_for_update()
+                    ).scalars()
+                }
+                for start in chunk:
+                    row = existing.get(start)
+                    if row is None:
+                        row = Rollup(model_id=model_id, resolution=resolution, bucket_start=start,
+                                     request_count=0, error_count=0)
+                        db.add(row)
+                    deltas[start].apply_to(row)
+        db.flush()
+
+    def prune(self, db) -> int:
+        """刪除超過保留期限的分桶"""
+        Rollup = models.AIModelRollup
+        deleted = 0
+        for resolution, days in self.retention_days.items():
+            if days > 0:
+                deleted += db.query(Rollup).filter(
+                    Rollup.resolution == resolution,
+                    Rollup.bucket_start < datetime.utcnow() - timedelta(days=days),
+                ).delete(synchronize_session=False)
+        return deleted
+
+    def backfill(self, db, batch_size: int = 50000) -> int:
+        """由既有的原始使用與性能記錄建立分桶（用於初次建立彙總表），不提交交易"""
+        pending: Dict[BucketKey, _BucketDelta] = {}
+        processed = 0
+
+        Usage = models.AIModelUsage
+        stmt = select(Usage.model_id, Usage.created_at, Usage.processing_time, Usage.success)
+        for row in db.execute(stmt.execution_options(yield_per=5000)):
+            if row.created_at is None:
+                continue
+            latency = row.processing_time * 1000 if row.processing_time is not None else None
+            self._accumulate(pending, row.model_id, row.created_at, 1, 0 if row.success in (True, None) else 1, latency)
+            processed += 1
+            if processed % batch_size == 0:
+                self.write(db, pending)
+                pending = {}
+
+        Performance = models.AIModelPerformance
+        stmt = select(Performance.model_id, Performance.timestamp, Performance.request_count,
+                      Performance.error_count, Performance.avg_latency,
+                      *[getattr(Performance, name) for name in GAUGES])
+        for row in db.execute(stmt.execution_options(yield_per=5000)):
+            if row.timestamp is None:
+                continue
+            self._accumulate(pending, row.model_id, row.timestamp, row.request_count or 0, row.error_count or 0,
+                             row.avg_latency, {name: getattr(row, name) for name in GAUGES})
+            processed += 1
+            if processed % batch_size == 0:
+                self.write(db, pending)
+                pending = {}
+
+        self.write(db, pending)
+        return processed
+
+    @staticmethod
+    def auto_resolution(hours: float) -> str:
+        """依時間範圍選擇解析度，讓每次查詢的分桶數維持在數百個以內"""
+        if hours <= 12:
+            return "1m"
+        if hours <= 24 * 30:
+            return "1h"
+        return "1d"
+
+    def query(self, db, model_id: int, resolution: str, start: datetime, end: datetime = None) -> List[Dict[str, Any]]:
+        """讀取指定解析度的分桶；非原生解析度（如 5m、6h）由較細的分桶合併而成"""
+        seconds = parse_resolution(resolution)
+        base = max((r for r, s in RESOLUTIONS.items() if seconds % s == 0), key=RESOLUTIONS.get, default=None)
+        if base is None:
+            raise ValueError(f"解析度必須是 1 分鐘的整數倍: {resolution}")
+        end = end or datetime.utcnow()
+
+        Rollup = models.AIModelRollup
+        rows = db.execute(
+            select(Rollup.bucket_start, Rollup.request_count, Rollup.error_count,
+                   Rollup.latency_sketch, Rollup.gauges)
+            .where(
+                Rollup.model_id == model_id,
+                Rollup.resolution == base,
+                Rollup.bucket_start >= bucket_start(start, seconds),
+                Rollup.bucket_start <= end,
+            )
+            .order_by(Rollup.bucket_start)
+        ).all()
+
+        merged: Dict[datetime, _BucketDelta] = {}
+        for row in rows:
+            delta = _BucketDelta()
+            delta.request_count = row.request_count or 0
+            delta.error_count = row.error_count or 0
+            delta.sketch = LatencySketch.from_dict(row.latency_sketch)
+            delta.gauges = {name: list(value) for name, value in (row.gauges or {}).items()}
+            target = bucket_start(row.bucket_start, seconds)
+            if target in merged:
+                merged[target].merge(delta)
+            else:
+                merged[target] = delta
+
+        now = datetime.utcnow()
+        buckets = []
+        for start_at, delta in merged.items():
+            # 進行中的分桶以已經過的時間計算吞吐量
+            span = min(seconds, max((now - start_at).total_seconds(), 1.0))
+            sketch = delta.sketch
+            bucket = {
+                "bucket_start": start_at.isoformat(),
+                "request_count": delta.request_count,
+                "error_count": delta.error_count,
+                "error_rate": delta.error_count / delta.request_count if delta.request_count else 0.0,
+                "throughput": delta.request_count / span,
+                "avg_latency": sketch.mean,
+                "p50_latency": sketch.quantile(0.5),
+                "p95_latency": sketch.quantile(0.95),
+                "p99_latency": sketch.quantile(0.99),
+                "max_latency": sketch.max,
+            }
+            for name in GAUGES:
+                total, count = delta.gauges.get(name, (0.0, 0))
+                bucket[name] = total / count if count else None
+            buckets.append(bucket)
+        return buckets
+
+    def _requeue(self, pending: Dict[BucketKey, _BucketDelta]):
+        """寫回失敗時把變動放回待寫表，與期間的新變動合併"""
+        with self._lock:
+            for key, delta in pending.items():
+                newer = self._pending.get(key)
+                if newer is None:
+                    self._pending[key] = delta
+                else:
+                    delta.merge(newer)
+                    self._pending[key] = delta
+
+    def start(self):
+        self._ensure_started()
+
+    def stop(self):
+        """停止背景執行緒並寫回剩餘變動"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(self.flush_interval + 5)
+            self._thread = None
+        self.flush()
+
+    def get_metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "pending_buckets": pending,
+            "records": self.records,
+            "flushes": self.flushes,
+            "buckets_flushed": self.buckets_flushed,
+            "flush_failures": self.flush_failures,
+            "last_flush_at": self.last_flush_at.isoformat() if self.last_flush_at else None,
+            "flush_interval": self.flush_interval,
+            "retention_days": dict(self.retention_days),
+        }
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._start_lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._stop.clear()
+                    self._thread = threading.Thread(target=self._run, name="ai-model-rollup-flusher", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"AI Model 彙總寫回失敗: {e}")
+
+
+# 全局實例
+ai_model_rollups = AIModelRollupService()
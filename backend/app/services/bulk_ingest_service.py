@@ -0,0 +1,231 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from .heartbeat_service import heartbeat_table
+from .timeseries_writer import timeseries_writer
+
+logger = logging.getLogger(__name__)
+
+# 非量測值的保留欄位
+RESERVED_FIELDS = ("device_id", "timestamp", "tags")
+
+
+def _escape_key(value: str) -> str:
+    return value.replace("\\", "\\\\").replace(",", "\\,").replace("=", "\\=").replace(" ", "\\ ")
+
+
+def parse_ndjson(body: bytes) -> List[Dict[str, Any]]:
+    """解析 NDJSON（每行一筆 JSON 物件，忽略空行）"""
+    readings = []
+    for line_no, line in enumerate(body.splitlines(), start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            readings.append(json.loads(line))
+        except json.JSONDecodeError as e:
+            raise ValueError(f"第 {line_no} 行不是有效的 JSON: {e}")
+    return readings
+
+
+class BulkIngestService:
+    """批量設備數據接收
+
+    一次請求可帶入數千筆讀值：整批以欄位方式一次完成驗證，各設備的最新
+    時間交給存活狀態表合併寫回 Device.last_seen，再把寫入點交給共用的
+    InfluxDB 批次寫入服務。接收後立即回傳批次 ID，實際寫入在背景完成。
+    """
+
+    def __init__(self, measurement: str = "device_sensor_data", max_tracked_batches: int = 1000):
+        self.measurement = measurement
+        self.bucket = os.getenv("INFLUXDB_BUCKET", "iiplatform")
+        self.max_batch_size = int(os.getenv("INGEST_BULK_MAX_READINGS", "100000"))
+        self.max_tracked_batches = max_tracked_batches
+        self._batches: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def validate(self, readings: List[Dict[str, Any]]) -> Tuple[pd.DataFrame, List[Dict[str, Any]]]:
+        """一次驗證整批讀值，回傳有效記錄的 DataFrame 與錯誤列表
+
+        有效記錄需有非空白的 device_id、可解析的 timestamp（未提供則使用接收
+        時間），以及至少一個有限的數值欄位；非數值、布林值與 NaN/inf 欄位會被忽略。
+        """
+        if len(readings) > self.max_batch_size:
+            raise ValueError(f"單次最多接收 {self.max_batch_size} 筆讀值")
+
+        is_dict = np.fromiter((isinstance(r, dict) for r in readings), dtype=bool, count=len(readings))
+        frame = pd.DataFrame.from_records([r if ok else {} for r, ok in zip(readings, is_dict)])
+        errors: List[Dict[str, Any]] = []
+        if frame.empty:
+            return frame, [{"index": int(i), "error": "讀值必須是 JSON 物件"} for i in np.flatnonzero(~is_dict)]
+
+        valid = is_dict.copy()
+        reasons = np.where(is_dict, "", "讀值必須是 JSON 物件").astype(object)
+
+        if "device_id" in frame.columns:
+            device_ids = frame["device_id"]
+            missing_device = device_ids.isna().to_numpy()
+            frame["device_id"] = device_ids.astype(str)
+            # 空白的 device_id 會產生無效的 line protocol，連帶讓同批其他寫入點被拒絕
+            blank_device = ~missing_device & (frame["device_id"].str.strip() == "").to_numpy()
+        else:
+            missing_device = np.ones(len(frame), dtype=bool)
+            blank_device = np.zeros(len(frame), dtype=bool)
+        reasons[valid & missing_device] = "缺少 device_id"
+        reasons[valid & blank_device] = "device_id 不可為空白"
+        valid &= ~(missing_device | blank_device)
+
+        now = pd.Timestamp(datetime.utcnow())
+        if "timestamp" in frame.columns:
+            raw = frame["timestamp"]
+            parsed = pd.to_datetime(raw, errors="coerce", utc=True).dt.tz_localize(None)
+            bad_time = (raw.notna() & parsed.isna()).to_numpy()
+            reasons[valid & bad_time] = "timestamp 格式錯誤"
+            valid &= ~bad_time
+            frame["timestamp"] = parsed.fillna(now)
+        else:
+            frame["timestamp"] = now
+
+        value_columns = [c for c in frame.columns if c not in RESERVED_FIELDS]
+        # 布林值不是量測值（pd.to_numeric 會把 True 轉成 1）
+        booleans = pd.DataFrame(
+            {c: frame[c].map(lambda v: isinstance(v, (bool, np.bool_))) for c in value_columns},
+            index=frame.index, dtype=bool
+        )
+        numeric = pd.DataFrame(
+            {c: pd.to_numeric(frame[c].mask(booleans[c]), errors="coerce") for c in value_columns},
+            index=frame.index, dtype=float
+        )
+        # NaN/inf 無法寫入 InfluxDB，視為無效欄位
+        non_finite = numeric.isin([np.inf, -np.inf]).any(axis=1).to_numpy()
+        numeric = numeric.where(np.isfinite(numeric))
+        no_values = numeric.notna().sum(axis=1).to_numpy() == 0 if value_columns else np.ones(len(frame), dtype=bool)
+        reason = np.where(non_finite, "數值必須是有限值",
+                          np.where(booleans.any(axis=1).to_numpy(), "數值不可為布林值", "沒有數值欄位"))
+        reasons[valid & no_values] = reason[valid & no_values]
+        valid &= ~no_values
+
+        for i in np.flatnonzero(~valid):
+            errors.append({"index": int(i), "error": reasons[i]})
+
+        result = pd.concat([frame[["device_id", "timestamp"]], numeric], axis=1)[valid]
+        if "tags" in frame.columns:
+            result["tags"] = frame["tags"][valid]
+        return result.reset_index(drop=True), errors
+
+    def submit(self, readings: List[Dict[str, Any]], source_id: Optional[str] = None) -> Dict[str, Any]:
+        """驗證並登記一個批次；回傳批次資訊，寫入工作由 run_batch 在背景執行"""
+        frame, errors = self.validate(readings)
+        batch_id = uuid.uuid4().hex
+        batch = {
+            "batch_id": batch_id,
+            "status": "accepted",
+            "received": len(readings),
+            "accepted": len(frame),
+            "rejected": len(errors),
+            "errors": errors[:100],
+            "source_id": source_id,
+            "created_at": datetime.utcnow().isoformat(),
+        }
+        if frame.empty:
+            # 整批無效時不登記批次，由呼叫端回傳錯誤
+            return {"batch": batch, "frame": frame}
+        with self._lock:
+            self._batches[batch_id] = batch
+            while len(self._batches) > self.max_tracked_batches:
+                self._batches.popitem(last=False)
+        return {"batch": dict(batch), "frame": frame}
+
+    async def run_batch(self, batch_id: str, frame: pd.DataFrame, source_id: Optional[str] = None):
+        """背景工作：處理管道（可選）、更新 last_seen、交給批次寫入服務"""
+        start = time.perf_counter()
+        try:
+            if frame.empty:
+                return
+            self.update_last_seen(frame)
+
+            records = frame
+            if source_id:
+                from .data_processing_service import data_processing_service
+                result = await data_processing_service.process_batch(
+                    source_id, frame.drop(columns=["tags"], errors="ignore").to_dict(orient="records")
+                )
+                if not result.success:
+                    raise RuntimeError(result.error_message)
+                records = pd.DataFrame(result.columns)[result.keep_mask]
+
+            lines = self.to_line_protocol(records, source_id)
+            timeseries_writer.write(lines, bucket=self.bucket)
+            self._update_batch(batch_id, status="completed", written=len(lines))
+        except Exception as e:
+            logger.error(f"批量數據處理失敗 {batch_id}: {e}")
+            self._update_batch(batch_id, status="failed", error=str(e))
+        finally:
+            self._update_batch(batch_id, processing_time=time.perf_counter() - start)
+
+    def update_last_seen(self, frame: pd.DataFrame):
+        """把每台設備在本批的最新時間交給存活狀態表，合併後批次寫回"""
+        latest = frame.groupby("device_id")["timestamp"].max()
+        heartbeat_table.touch_many(
+            (device_id, ts.to_pydatetime(), None) for device_id, ts in latest.items()
+        )
+
+    def to_line_protocol(self, frame: pd.DataFrame, source_id: Optional[str] = None) -> List[str]:
+        """把驗證後的讀值轉成 line protocol"""
+        if frame.empty:
+            return []
+        value_columns = [
+            c for c in frame.columns
+            if c not in RESERVED_FIELDS and pd.api.types.is_numeric_dtype(frame[c])
+            and not pd.api.types.is_bool_dtype(frame[c])
+        ]
+        field_keys = [_escape_key(str(c)) for c in value_columns]
+        values = frame[value_columns].to_numpy(dtype=float)
+        present = np.isfinite(values)
+        rows = values.tolist()
+        timestamps = frame["timestamp"].astype("datetime64[ns]").astype(np.int64).to_numpy()
+        base_tags = f",source_id={_escape_key(source_id)}" if source_id else ""
+        tags = frame["tags"].tolist() if "tags" in frame.columns else [None] * len(frame)
+
+        lines = []
+        for i, device_id in enumerate(frame["device_id"].tolist()):
+            fields = ",".join(
+                f"{field_keys[j]}={rows[i][j]!r}" for j in np.flatnonzero(present[i])
+            )
+            if not fields or not str(device_id).strip():
+                continue
+            extra = ""
+            if isinstance(tags[i], dict):
+                # line protocol 不允許空的標籤鍵或值
+                extra = "".join(
+                    f",{_escape_key(str(k))}={_escape_key(str(v))}" for k, v in sorted(tags[i].items())
+                    if str(k) and v is not None and str(v)
+                )
+            lines.append(
+                f"{self.measurement},device_id={_escape_key(str(device_id))}{base_tags}{extra} {fields} {timestamps[i]}"
+            )
+        return lines
+
+    def get_batch(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            batch = self._batches.get(batch_id)
+            return dict(batch) if batch else None
+
+    def _update_batch(self, batch_id: str, **changes):
+        with self._lock:
+            batch = self._batches.get(batch_id)
+            if batch is not None:
+                batch.update(changes)
+
+
+# 全局實例
+bulk_ingest_service = BulkIngestService()
@@ -0,0 +1,182 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 探測項目：名稱 -> (阻塞函數, 參數, 快取鍵)
+Probe = Tuple[Callable[..., Dict[str, Any]], tuple, Optional[str]]
+
+
+def probe_cache_key(config: Dict[str, Any]) -> str:
+    """以連線設定的內容產生快取鍵（設定相同的連線共用最近的結果）"""
+    payload = json.dumps(config, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+class ConnectionProbeService:
+    """資料庫連線探測
+
+    各資料庫驅動的連線測試都是阻塞呼叫，這裡把它們丟到有上限的執行緒池
+    並行執行，避免在事件迴圈中阻塞整個伺服器。每個探測有自己的期限，整批
+    探測另有總期限；結果依完成順序逐筆回傳，逾時的探測以失敗結果補上。
+    同一連線設定的結果會快取 cache_ttl 秒。
+    """
+
+    def __init__(self, max_workers: int = None, probe_timeout: float = None,
+                 overall_timeout: float = None, cache_ttl: float = None):
+        self.max_workers = max_workers or int(os.getenv("DB_PROBE_MAX_WORKERS", "16"))
+        self.probe_timeout = probe_timeout or float(os.getenv("DB_PROBE_TIMEOUT", "10"))
+        self.overall_timeout = overall_timeout or float(os.getenv("DB_PROBE_OVERALL_TIMEOUT", "15"))
+        self.cache_ttl = cache_ttl if cache_ttl is not None else float(os.getenv("DB_PROBE_CACHE_TTL", "5"))
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._cache: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+        self.probes = 0
+        self.timeouts = 0
+        self.failures = 0
+        self.cache_hits = 0
+
+    async def probe(self, name: str, func: Callable[..., Dict[str, Any]], *args,
+                    timeout: float = None, cache_key: str = None) -> Dict[str, Any]:
+        """在執行緒池中執行單一探測，超過期限即回傳逾時結果"""
+        if cache_key:
+            cached = self._cache_get(cache_key)
+            if cached is not None:
+                return {**cached, "name": name, "cached": True}
+
+        timeout = timeout or self.probe_timeout
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        timed_out = False
+        try:
+            result = await asyncio.wait_for(loop.run_in_executor(self._get_executor(), func, *args), timeout)
+            result = dict(result) if isinstance(result, dict) else {"success": bool(result)}
+        except asyncio.TimeoutError:
+            timed_out = True
+            result = {"success": False, "message": f"{name} 連線測試逾時", "error": f"超過 {timeout:g} 秒未回應"}
+        except Exception as e:
+            result = {"success": False, "message": f"{name} 連線測試失敗", "error": str(e)}
+
+        result.update({
+            "name": name,
+            "timed_out": timed_out,
+            "cached": False,
+            "response_time": (time.perf_counter() - start) * 1000,
+        })
+        with self._lock:
+            self.probes += 1
+            if timed_out:
+                self.timeouts += 1
+            if not result.get("success"):
+                self.failures += 1
+        if cache_key:
+            self._cache_put(cache_key, result)
+        return result
+
+    async def stream(self, probes: Dict[str, Probe], overall_timeout: float = None,
+                     timeout: float = None) -> AsyncIterator[Dict[str, Any]]:
+        """並行執行多個探測，依完成順序逐筆產生結果"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (overall_timeout or self.overall_timeout)
+        tasks = {
+            asyncio.ensure_future(self.probe(name, func, *args, timeout=timeout, cache_key=key)): name
+            for name, (func, args, key) in probes.items()
+        }
+        pending = set(tasks)
+        try:
+            while pending:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+            for task in pending:
+                task.cancel()
+                with self._lock:
+                    self.timeouts += 1
+                yield {
+                    "name": tasks[task],
+                    "success": False,
+                    "message": f"{tasks[task]} 連線測試逾時",
+                    "error": "超過整體測試期限",
+                    "timed_out": True,
+                    "cached": False,
+                }
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def probe_many(self, probes: Dict[str, Probe], overall_timeout: float = None,
+                         timeout: float = None) -> Dict[str, Dict[str, Any]]:
+        """並行執行多個探測，回傳 名稱 -> 結果"""
+        results = {}
+        async for result in self.stream(probes, overall_timeout=overall_timeout, timeout=timeout):
+            results[result["name"]] = result
+        return {name: results[name] for name in probes if name in results}
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="db-probe")
+            return self._executor
+
+    def _cache_get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._cache[key]
+                return None
+            self.cache_hits += 1
+            return dict(entry[1])
+
+    def _cache_put(self, key: str, result: Dict[str, Any]):
+        if self.cache_ttl <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._cache[key] = (now + self.cache_ttl, dict(result))
+            # 順便清掉過期的結果
+            for stale in [k for k, (expires, _) in self._cache.items() if expires < now]:
+                del self._cache[stale]
+
+    def invalidate(self, key: str = None):
+        """清除全部或指定連線的快取結果"""
+        with self._lock:
+            if key is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(key, None)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "probes": self.probes,
+                "timeouts": self.timeouts,
+                "failures": self.failures,
+                "cache_hits": self.cache_hits,
+                "cached_results": len(self._cache),
+                "max_workers": self.max_workers,
+                "probe_timeout": self.probe_timeout,
+                "overall_timeout": self.overall_timeout,
+                "cache_ttl": self.cache_ttl,
+            }
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+# 全局實例
+connection_probe_service = ConnectionProbeService()
@@ -1,6 +1,11 @@
 import logging
 import json
 import asyncio
+import os
+import threading
+import time
+import warnings
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from typing import Dict, List, Any, Optional, Callable
 from sqlalchemy.orm import Session
@@ -10,8 +15,24 @@ import numpy as np
 from dataclasses import dataclass
 from enum import Enum
 
-from ..database import get_postgres_session, get_influx_client
+from ..database import get_postgres_session
+from .timeseries_writer import timeseries_writer
+from .pipeline_plan import (
+    PipelinePlan,
+    PipelineStepError,
+    DEFAULT_STEP_COMPILERS,
+    AGGREGATION_TYPES,
+    DERIVED_FIELD_SUFFIXES,
+    compile_pipeline,
+    compile_rolling_average,
+    compile_time_series_aggregate,
+    flatten_source_config,
+    window_settings
+)
+from .window_store import window_store
+from .processing_pool import processing_pool
 from ..models import Device
+from ..protocols.register_decoder import RegisterDecoder, get_block_decoder, parse_register_mappings
 from ..config.data_processing_config import (
     DEFAULT_DATA_SOURCES, 
     DEFAULT_PROCESSING_PIPELINES,
@@ -46,12 +67,50 @@ class ProcessingResult:
     error_message: Optional[str] = None
     processing_time: Optional[float] = None
 
+@dataclass
+class BatchProcessingResult:
+    """批次處理結果：欄位式數據與每筆記錄的保留遮罩"""
+    success: bool
+    columns: Dict[str, np.ndarray]
+    keep_mask: np.ndarray
+    metadata: Dict[str, Any]
+    error_message: Optional[str] = None
+    processing_time: Optional[float] = None
+    
+    def to_records(self, kept_only: bool = True) -> List[Dict[str, Any]]:
+        """轉回逐筆記錄（NaN 轉為 None）"""
+        if not self.columns:
+            return []
+        frame = pd.DataFrame(self.columns)
+        if kept_only:
+            frame = frame[self.keep_mask]
+        frame = frame.astype(object).where(frame.notna(), None)
+        return frame.to_dict(orient="records")
+
 class DataProcessingService:
     def __init__(self):
         self.processing_rules: Dict[str, Callable] = {}
+        self.batch_processing_rules: Dict[str, Callable] = {}
         self.data_sources: Dict[str, Any] = {}
         self.processing_pipeline: List[str] = []
+        # inline：在目前程序處理；process：大批次交給多程序處理池
+        self.execution_mode = os.getenv("PROCESSING_EXECUTION_MODE", "inline")
+        self.process_pool_min_batch = int(os.getenv("PROCESSING_POOL_MIN_BATCH", "256"))
+        self._pipeline_bindings: Dict[str, tuple] = {}
+        # DATA_SOURCE_TYPE_MAPPING 中各類型的預設管道；明確設置預設管道後不再使用
+        self._type_default_pipelines: Dict[str, tuple] = {}
+        self._default_pipeline_set = False
+        self._bindings_lock = threading.Lock()
+        self.step_compilers: Dict[str, Callable] = {}
+        self._plans: Dict[str, PipelinePlan] = {}
+        self._plans_lock = threading.Lock()
+        # 以 (提供對應表的數據源, 起始位址, 長度) 為鍵，未註冊設備共用預設數據源的項目；
+        # 位址與長度來自請求，超過上限時淘汰最久未使用的項目
+        self._register_decoders: "OrderedDict[tuple, Optional[RegisterDecoder]]" = OrderedDict()
+        self.register_decoder_cache_size = int(os.getenv("REGISTER_DECODER_CACHE_SIZE", "1024"))
         self._register_default_processors()
+        self._register_default_batch_processors()
+        self.step_compilers.update(DEFAULT_STEP_COMPILERS)
         self._load_default_configurations()
     
     def _register_default_processors(self):
@@ -81,29 +140,221 @@ class DataProcessingService:
         self.register_processor("z_score_normalize", self._z_score_normalize)
         self.register_processor("decimal_scaling", self._decimal_scaling)
     
+    def _register_default_batch_processors(self):
+        """註冊預設處理器的批次（向量化）版本"""
+        self.register_batch_processor("temperature_filter", self._batch_temperature_filter)
+        self.register_batch_processor("pressure_filter", self._batch_pressure_filter)
+        self.register_batch_processor("outlier_filter", self._batch_outlier_filter)
+        
+        self.register_batch_processor("time_series_aggregate", self._batch_time_series_aggregate)
+        self.register_batch_processor("statistical_aggregate", self._batch_statistical_aggregate)
+        self.register_batch_processor("rolling_average", self._batch_rolling_average)
+        
+        self.register_batch_processor("unit_conversion", self._batch_unit_conversion)
+        self.register_batch_processor("format_conversion", self._batch_format_conversion)
+        self.register_batch_processor("data_type_conversion", self._batch_data_type_conversion)
+        
+        self.register_batch_processor("range_validation", self._batch_range_validation)
+        self.register_batch_processor("format_validation", self._batch_format_validation)
+        self.register_batch_processor("completeness_check", self._batch_completeness_check)
+        
+        self.register_batch_processor("min_max_normalize", self._batch_min_max_normalize)
+        self.register_batch_processor("z_score_normalize", self._batch_z_score_normalize)
+        self.register_batch_processor("decimal_scaling", self._batch_decimal_scaling)
+    
     def register_processor(self, name: str, processor_func: Callable):
         """註冊數據處理器"""
         self.processing_rules[name] = processor_func
+        # 自訂處理器取代同名內建處理器時，不再使用內建的編譯版本
+        if self.step_compilers.pop(name, None) is not None:
+            self.batch_processing_rules.pop(name, None)
+        self._invalidate_plans()
         logger.info(f"註冊數據處理器: {name}")
     
+    def register_batch_processor(self, name: str, processor_func: Callable):
+        """註冊批次處理器
+
+        批次處理器簽名為 (frame, keep, config) -> (frame, keep)，frame 為
+        每個欄位一欄的 DataFrame，keep 為每筆記錄是否保留的布林陣列。
+        """
+        self.batch_processing_rules[name] = processor_func
+    
     def add_data_source(self, source_id: str, source_config: Dict[str, Any]):
         """添加數據源配置"""
         self.data_sources[source_id] = source_config
+        self._register_decoders.clear()
+        self._compile_plan(source_id)
         logger.info(f"添加數據源: {source_id}")
     
-    def set_processing_pipeline(self, pipeline: List[str]):
-        """設置處理管道"""
-        self.processing_pipeline = pipeline
-        logger.info(f"設置處理管道: {pipeline}")
+    def set_processing_pipeline(self, pipeline: List[str], source_id: str = None, source_type: str = None):
+        """設置處理管道
+
+        指定 source_id 或 source_type 時只綁定該數據源或該類型；兩者皆未指定
+        時設置未綁定數據源使用的預設管道，並取代各類型的設定檔預設管道。
+        綁定表以複製後整體替換的方式更新，處理中的數據不受影響，且只重新
+        編譯受影響的數據源。
+        """
+        if source_id is None and source_type is None:
+            self.processing_pipeline = list(pipeline)
+            self._default_pipeline_set = True
+        else:
+            with self._bindings_lock:
+                bindings = dict(self._pipeline_bindings)
+                bindings[self._binding_key(source_id, source_type)] = tuple(pipeline)
+                self._pipeline_bindings = bindings
+        self._refresh_plans()
+        logger.info(f"設置處理管道: {pipeline} (source_id={source_id}, source_type={source_type})")
+    
+    def clear_processing_pipeline(self, source_id: str = None, source_type: str = None) -> bool:
+        """移除數據源或類型的管道綁定，回復使用上一層的管道"""
+        key = self._binding_key(source_id, source_type)
+        with self._bindings_lock:
+            if key not in self._pipeline_bindings:
+                return False
+            bindings = dict(self._pipeline_bindings)
+            del bindings[key]
+            self._pipeline_bindings = bindings
+        self._refresh_plans()
+        return True
+    
+    @staticmethod
+    def _binding_key(source_id: str = None, source_type: str = None) -> str:
+        return f"source:{source_id}" if source_id is not None else f"type:{source_type}"
+    
+    def _source_type(self, source_id: str) -> Optional[str]:
+        source_config = self.data_sources.get(source_id)
+        if source_config is not None:
+            return source_config.get("type")
+        if source_id.startswith("type:"):
+            return source_id[len("type:"):]
+        return None
+    
+    def resolve_pipeline(self, source_id: str) -> List[str]:
+        """解析數據源使用的管道
+
+        優先順序：數據源綁定 > 數據源配置中的 pipeline > 類型綁定 > 預設管道。
+        尚未明確設置預設管道時，預設管道為該類型在設定檔中的 default_pipeline。
+        """
+        bindings = self._pipeline_bindings
+        pipeline = bindings.get(f"source:{source_id}")
+        if pipeline is not None:
+            return list(pipeline)
+        
+        configured = self.data_sources.get(source_id, {}).get("pipeline")
+        if isinstance(configured, str):
+            configured = DEFAULT_PROCESSING_PIPELINES.get(configured)
+        if configured is not None:
+            return list(configured)
+        
+        source_type = self._source_type(source_id)
+        pipeline = bindings.get(f"type:{source_type}")
+        if pipeline is not None:
+            return list(pipeline)
+        if not self._default_pipeline_set:
+            pipeline = self._type_default_pipelines.get(source_type)
+            if pipeline is not None:
+                return list(pipeline)
+        return list(self.processing_pipeline)
+    
+    def get_pipeline_bindings(self) -> Dict[str, Any]:
+        """獲取預設管道、綁定表與各數據源實際使用的管道"""
+        bindings = self._pipeline_bindings
+        return {
+            "default": list(self.processing_pipeline),
+            "sources": {k[len("source:"):]: list(v) for k, v in bindings.items() if k.startswith("source:")},
+            "types": {k[len("type:"):]: list(v) for k, v in bindings.items() if k.startswith("type:")},
+            "type_defaults": (
+                {} if self._default_pipeline_set
+                else {k: list(v) for k, v in self._type_default_pipelines.items()}
+            ),
+            "resolved": {source_id: self.resolve_pipeline(source_id) for source_id in self.data_sources}
+        }
+    
+    def _bind_default_type_pipelines(self):
+        """載入 DATA_SOURCE_TYPE_MAPPING 中各數據源類型的預設管道
+
+        與明確的類型綁定分開保存，未指定目標的 set_processing_pipeline 才能
+        取代它們。
+        """
+        defaults = {}
+        for source_type, type_config in DATA_SOURCE_TYPE_MAPPING.items():
+            pipeline = DEFAULT_PROCESSING_PIPELINES.get(type_config.get("default_pipeline"))
+            if pipeline is not None:
+                defaults[source_type] = tuple(pipeline)
+        self._type_default_pipelines = defaults
+    
+    def _plan_target(self, source_id: str):
+        """已註冊數據源使用自身配置；未註冊但前綴為已知類型的數據源（如
+        process_mqtt_data 產生的 mqtt_<device_id>）共用該類型的計畫"""
+        source_config = self.data_sources.get(source_id)
+        if source_config is not None:
+            return source_id, source_config
+        if source_id.startswith("type:"):
+            source_type = source_id[len("type:"):]
+        else:
+            source_type = source_id.split("_", 1)[0]
+        if source_type in DATA_SOURCE_TYPE_MAPPING:
+            plan_key = f"type:{source_type}"
+            return plan_key, {"source_id": plan_key, "type": source_type}
+        return None, None
+    
+    def _compile_plan(self, source_id: str) -> Optional[PipelinePlan]:
+        """編譯並快取數據源的處理計畫"""
+        plan_key, source_config = self._plan_target(source_id)
+        if source_config is None:
+            return None
+        plan = compile_pipeline(
+            plan_key, source_config, self.resolve_pipeline(plan_key),
+            self.processing_rules, self.step_compilers
+        )
+        with self._plans_lock:
+            plans = dict(self._plans)
+            plans[plan_key] = plan
+            self._plans = plans
+        return plan
+    
+    def _refresh_plans(self):
+        """管道變更後，只重新編譯管道實際改變的計畫"""
+        with self._plans_lock:
+            current = self._plans
+        for plan_key, plan in current.items():
+            if list(plan.pipeline) != self.resolve_pipeline(plan_key):
+                self._compile_plan(plan_key)
+        for source_id in list(self.data_sources):
+            if source_id not in self._plans:
+                self._compile_plan(source_id)
+    
+    def _invalidate_plans(self):
+        with self._plans_lock:
+            self._plans = {}
+    
+    def get_plan(self, source_id: str) -> Optional[PipelinePlan]:
+        """取得數據源的編譯計畫，必要時重新編譯"""
+        plans = self._plans
+        plan = plans.get(source_id)
+        if plan is None and source_id not in self.data_sources:
+            plan = plans.get(self._plan_target(source_id)[0])
+        if plan is None:
+            plan = self._compile_plan(source_id)
+        return plan
+    
+    def get_plan_stats(self) -> Dict[str, Any]:
+        """獲取已編譯計畫的統計"""
+        plans = self._plans
+        return {
+            "pipeline": list(self.processing_pipeline),
+            "plan_count": len(plans),
+            "plans": {source_id: plan.get_stats() for source_id, plan in plans.items()}
+        }
     
     async def process_data_from_source(self, source_id: str, data: Any) -> ProcessingResult:
         """從指定數據源處理數據"""
-        start_time = datetime.now()
+        start_time = time.perf_counter()
         
         try:
-            # 獲取數據源配置
-            source_config = self.data_sources.get(source_id)
-            if not source_config:
+            # 獲取數據源的編譯計畫
+            plan = self.get_plan(source_id)
+            if plan is None:
                 return ProcessingResult(
                     success=False,
                     data=None,
@@ -111,45 +362,34 @@ class DataProcessingService:
                     error_message=f"未找到數據源配置: {source_id}"
                 )
             
-            # 執行處理管道
-            processed_data = data
             metadata = {
                 "source_id": source_id,
                 "original_data": data,
                 "processing_steps": []
             }
             
-            for step in self.processing_pipeline:
-                processor = self.processing_rules.get(step)
-                if processor:
-                    try:
-                        step_start = datetime.now()
-                        processed_data = await processor(processed_data, source_config)
-                        step_time = (datetime.now() - step_start).total_seconds()
-                        
-                        metadata["processing_steps"].append({
-                            "step": step,
-                            "processing_time": step_time,
-                            "success": True
-                        })
-                        
-                        logger.debug(f"處理步驟 {step} 完成，耗時: {step_time:.3f}秒")
-                    except Exception as e:
-                        logger.error(f"處理步驟 {step} 失敗: {str(e)}")
-                        metadata["processing_steps"].append({
-                            "step": step,
-                            "processing_time": 0,
-                            "success": False,
-                            "error": str(e)
-                        })
-                        return ProcessingResult(
-                            success=False,
-                            data=processed_data,
-                            metadata=metadata,
-                            error_message=f"處理步驟 {step} 失敗: {str(e)}"
-                        )
+            try:
+                # 程序池模式下窗口狀態在設備所屬的工作程序，含窗口步驟的逐筆處理也交給該分片
+                if plan.stateful and self._use_process_pool(plan, 1):
+                    processed_data, metadata["processing_steps"] = await processing_pool.run_record(plan, data)
+                else:
+                    processed_data, metadata["processing_steps"] = await plan.run(data)
+            except PipelineStepError as e:
+                logger.error(f"處理步驟 {e.step} 失敗: {str(e.error)}")
+                metadata["processing_steps"] = e.steps_meta + [{
+                    "step": e.step,
+                    "processing_time": 0,
+                    "success": False,
+                    "error": str(e.error)
+                }]
+                return ProcessingResult(
+                    success=False,
+                    data=e.data,
+                    metadata=metadata,
+                    error_message=f"處理步驟 {e.step} 失敗: {str(e.error)}"
+                )
             
-            processing_time = (datetime.now() - start_time).total_seconds()
+            processing_time = time.perf_counter() - start_time
             metadata["total_processing_time"] = processing_time
             
             return ProcessingResult(
@@ -160,7 +400,7 @@ class DataProcessingService:
             )
             
         except Exception as e:
-            processing_time = (datetime.now() - start_time).total_seconds()
+            processing_time = time.perf_counter() - start_time
             logger.error(f"數據處理失敗: {str(e)}")
             return ProcessingResult(
                 success=False,
@@ -185,8 +425,44 @@ class DataProcessingService:
         
         return await self.process_data_from_source(source_id, enhanced_data)
     
-    async def process_modbus_data(self, device_id: str, registers: List[int]) -> ProcessingResult:
-        """處理 Modbus 數據"""
+    def get_register_decoder(self, source_id: str, start_address: int = None,
+                             length: int = None) -> Optional[RegisterDecoder]:
+        """依數據源的 register_mappings 取得已編譯的暫存器解碼器
+
+        未註冊的 modbus_<device_id> 數據源使用預設的 Modbus 數據源設定；
+        只解碼位址落在 [start_address, start_address + length) 內的量測點。
+        """
+        mapping_source = source_id if self.data_sources.get(source_id) else "modbus_industrial_device"
+        key = (mapping_source, start_address, length)
+        if key in self._register_decoders:
+            self._register_decoders.move_to_end(key)
+            return self._register_decoders[key]
+        source_config = self.data_sources.get(mapping_source) or {}
+        config = source_config.get("config", {})
+        points = parse_register_mappings(
+            config.get("register_mappings"), byte_order=config.get("byte_order", "big"),
+            word_order=config.get("word_order", "big")
+        )
+        if start_address is None:
+            start_address = min((p.address for p in points), default=0)
+        if length is not None:
+            points = [p for p in points if start_address <= p.address and p.address + p.count <= start_address + length]
+        decoder = None
+        if points:
+            end = max(p.address + p.count for p in points)
+            decoder = get_block_decoder(tuple(points), start_address, end - start_address if length is None else length)
+        self._register_decoders[key] = decoder
+        while len(self._register_decoders) > self.register_decoder_cache_size:
+            self._register_decoders.popitem(last=False)
+        return decoder
+    
+    async def process_modbus_data(self, device_id: str, registers: List[int],
+                                  start_address: int = None) -> ProcessingResult:
+        """處理 Modbus 數據
+
+        registers 為從 start_address 起連續讀取的暫存器（未指定時為對應表
+        中最小的位址），依數據源的 register_mappings 解碼成工程值放在 data 中。
+        """
         source_id = f"modbus_{device_id}"
         
         # 添加 Modbus 特定的元數據
@@ -196,6 +472,9 @@ class DataProcessingService:
             "timestamp": datetime.now().isoformat(),
             "registers": registers
         }
+        decoder = self.get_register_decoder(source_id, start_address, len(registers))
+        if decoder is not None:
+            enhanced_data["data"] = decoder.decode(registers)
         
         return await self.process_data_from_source(source_id, enhanced_data)
     
@@ -209,6 +488,118 @@ class DataProcessingService:
         
         return await self.process_data_from_source(source_id, enhanced_data)
     
+    async def process_batch(self, source_id: str, records: List[Dict[str, Any]]) -> BatchProcessingResult:
+        """以向量化方式處理一批記錄
+
+        records 為多筆感測數據（即單筆處理時 data["data"] 的內容）。整批轉成
+        欄位式陣列後，每個處理步驟只執行一次向量化運算，並回傳每筆記錄的
+        保留遮罩與轉換後的欄位。execution_mode 為 "process" 時，大批次與含
+        窗口步驟的批次會依設備分片交給多程序處理池。
+        """
+        plan = self.get_plan(source_id)
+        if plan is None:
+            return BatchProcessingResult(
+                success=False,
+                columns={},
+                keep_mask=np.zeros(len(records), dtype=bool),
+                metadata={},
+                error_message=f"未找到數據源配置: {source_id}"
+            )
+        
+        frame = pd.DataFrame.from_records(records) if records else pd.DataFrame()
+        if self._use_process_pool(plan, len(frame)):
+            return await processing_pool.process(plan, frame)
+        return await self._process_frame(plan, frame)
+    
+    def _use_process_pool(self, plan: PipelinePlan, record_count: int) -> bool:
+        """程序池模式下，沒有只能在本程序執行的自訂處理器時才分派
+
+        含窗口步驟的計畫不論批次大小一律交給設備所屬的分片，同一設備的窗口
+        狀態才不會分散在主程序與工作程序；其他計畫只有大批次才值得分派。
+        """
+        return (
+            self.execution_mode == "process"
+            and not plan.fallback_steps
+            and (plan.stateful or record_count >= self.process_pool_min_batch)
+        )
+    
+    async def _process_frame(self, plan: PipelinePlan, frame: pd.DataFrame) -> BatchProcessingResult:
+        """在目前程序內依計畫處理一個欄位式批次"""
+        start_time = time.perf_counter()
+        source_id = plan.source_id
+        keep = np.ones(len(frame), dtype=bool)
+        metadata = {
+            "source_id": source_id,
+            "record_count": len(frame),
+            "processing_steps": []
+        }
+        
+        for step in plan.pipeline:
+            kernel = self.batch_processing_rules.get(step)
+            if kernel is None and step not in self.processing_rules:
+                continue
+            
+            step_start = time.perf_counter()
+            kept_before = int(keep.sum())
+            try:
+                if kernel is not None:
+                    frame, keep = kernel(frame, keep, plan.config)
+                else:
+                    frame, keep = await self._batch_scalar_fallback(step, frame, keep, plan.config)
+            except Exception as e:
+                logger.error(f"批次處理步驟 {step} 失敗: {str(e)}")
+                metadata["processing_steps"].append({
+                    "step": step,
+                    "processing_time": 0,
+                    "success": False,
+                    "error": str(e)
+                })
+                return BatchProcessingResult(
+                    success=False,
+                    columns={col: frame[col].to_numpy() for col in frame.columns},
+                    keep_mask=keep,
+                    metadata=metadata,
+                    error_message=f"處理步驟 {step} 失敗: {str(e)}",
+                    processing_time=time.perf_counter() - start_time
+                )
+            
+            metadata["processing_steps"].append({
+                "step": step,
+                "processing_time": time.perf_counter() - step_start,
+                "success": True,
+                "dropped": kept_before - int(keep.sum())
+            })
+        
+        processing_time = time.perf_counter() - start_time
+        metadata["total_processing_time"] = processing_time
+        metadata["kept_count"] = int(keep.sum())
+        if "formatted_output" in frame.attrs:
+            metadata["formatted_output"] = frame.attrs["formatted_output"]
+        
+        return BatchProcessingResult(
+            success=True,
+            columns={col: frame[col].to_numpy() for col in frame.columns},
+            keep_mask=keep,
+            metadata=metadata,
+            processing_time=processing_time
+        )
+    
+    async def _batch_scalar_fallback(self, step: str, frame: pd.DataFrame, keep: np.ndarray,
+                                     config: Dict[str, Any]):
+        """沒有批次版本的自訂處理器：逐筆呼叫單筆處理器"""
+        processor = self.processing_rules[step]
+        rows = frame.astype(object).where(frame.notna(), None).to_dict(orient="records")
+        keep = keep.copy()
+        for i, row in enumerate(rows):
+            if not keep[i]:
+                continue
+            result = await processor({"data": row}, config)
+            if result is None:
+                keep[i] = False
+            elif isinstance(result, dict) and isinstance(result.get("data"), dict):
+                rows[i] = result["data"]
+        return pd.DataFrame.from_records(rows), keep
+    
     # 預設處理器實現
     async def _temperature_filter(self, data: Any, config: Dict[str, Any]) -> Any:
         """溫度過濾器"""
@@ -266,15 +657,9 @@ class DataProcessingService:
         return data
     
     async def _time_series_aggregate(self, data: Any, config: Dict[str, Any]) -> Any:
-        """時間序列聚合"""
-        if isinstance(data, dict) and "data" in data:
-            window_size = config.get("window_size", 5)
-            aggregation_type = config.get("aggregation_type", "mean")
-            
-            # 這裡需要歷史數據來進行聚合，暫時返回原始數據
-            # 實際實現中需要從 InfluxDB 獲取歷史數據
-            return data
-        return data
+        """時間序列聚合（每個設備/欄位的固定筆數窗口）"""
+        step = compile_time_series_aggregate(flatten_source_config(config))
+        return step(data)
     
     async def _statistical_aggregate(self, data: Any, config: Dict[str, Any]) -> Any:
         """統計聚合"""
@@ -298,10 +683,9 @@ class DataProcessingService:
         return data
     
     async def _rolling_average(self, data: Any, config: Dict[str, Any]) -> Any:
-        """滾動平均"""
-        window_size = config.get("window_size", 3)
-        # 需要歷史數據實現滾動平均
-        return data
+        """滾動平均（每個設備/欄位最近 window_size 筆）"""
+        step = compile_rolling_average(flatten_source_config(config))
+        return step(data)
     
     async def _unit_conversion(self, data: Any, config: Dict[str, Any]) -> Any:
         """單位轉換"""
@@ -441,6 +825,294 @@ class DataProcessingService:
                         data["data"][f"{field}_scaled"] = scaled
         return data
     
+    # 批次（向量化）處理器實現
+    @staticmethod
+    def _numeric_column(frame: pd.DataFrame, field: str) -> Optional[np.ndarray]:
+        """取得數值欄位，非數值與缺值轉為 NaN"""
+        if field not in frame.columns:
+            return None
+        return pd.to_numeric(frame[field], errors="coerce").to_numpy(dtype=float)
+    
+    @staticmethod
+    def _numeric_matrix(frame: pd.DataFrame) -> np.ndarray:
+        """所有數值欄位組成的 (記錄數, 欄位數) 矩陣，統計輸出欄位除外"""
+        columns = [
+            col for col in frame.columns
+            if not str(col).startswith(("statistics.", "aggregates."))
+            and (pd.api.types.is_numeric_dtype(frame[col]) or pd.api.types.is_bool_dtype(frame[col]))
+        ]
+        if not columns:
+            return np.empty((len(frame), 0))
+        return frame[columns].to_numpy(dtype=float)
+    
+    @staticmethod
+    def _row_quantile(matrix: np.ndarray, counts: np.ndarray, q: float) -> np.ndarray:
+        """逐列忽略 NaN 的分位數（線性插值，與 np.percentile 預設相同）
+
+        np.nanpercentile 沿 axis 計算時會逐列迴圈，這裡改為排序後一次取值。
+        """
+        ordered = np.sort(matrix, axis=1)
+        position = q * (np.maximum(counts, 1) - 1)
+        lower = np.floor(position).astype(np.int64)
+        upper = np.ceil(position).astype(np.int64)
+        rows = np.arange(len(matrix))
+        low_values = ordered[rows, lower]
+        return low_values + (ordered[rows, upper] - low_values) * (position - lower)
+    
+    def _batch_bounds_filter(self, frame: pd.DataFrame, keep: np.ndarray, field: str,
+                             min_val: Any, max_val: Any) -> np.ndarray:
+        values = self._numeric_column(frame, field)
+        if values is None:
+            return keep
+        out_of_range = np.zeros(len(values), dtype=bool)
+        if min_val is not None:
+            out_of_range |= values < min_val
+        if max_val is not None:
+            out_of_range |= values > max_val
+        dropped = keep & out_of_range
+        if dropped.any():
+            logger.warning(f"{field} 有 {int(dropped.sum())} 筆超出範圍 [{min_val}, {max_val}]")
+        return keep & ~out_of_range
+    
+    def _batch_window_inputs(self, frame: pd.DataFrame, keep: np.ndarray, config: Dict[str, Any],
+                             fields: Optional[tuple]):
+        """窗口處理器的輸入：每筆記錄的設備 ID 與各欄位數值（依記錄順序）"""
+        if "device_id" in frame.columns:
+            devices = frame["device_id"].astype(str).to_numpy()
+        else:
+            devices = np.full(len(frame), str(config.get("source_id", "default")), dtype=object)
+        names = fields if fields is not None else [
+            col for col in frame.columns
+            if not str(col).startswith(("statistics.", "aggregates."))
+            and not str(col).endswith(DERIVED_FIELD_SUFFIXES)
+            and pd.api.types.is_numeric_dtype(frame[col])
+            and not pd.api.types.is_bool_dtype(frame[col])
+        ]
+        for name in names:
+            values = self._numeric_column(frame, name)
+            if values is not None:
+                rows = np.flatnonzero(keep & ~np.isnan(values))
+                yield name, devices, values, rows
+    
+    def _batch_time_series_aggregate(self, frame: pd.DataFrame, keep: np.ndarray, config: Dict[str, Any]):
+        """時間序列聚合（批次）：依記錄順序推入各設備的窗口"""
+        window_size, fields, options = window_settings(config, "time_series_aggregate", 5)
+        aggregation_type = options.get("aggregation_type", config.get("aggregation_type", "mean"))
+        if aggregation_type not in AGGREGATION_TYPES:
+            aggregation_type = "mean"
+        
+        updates = {}
+        for name, devices, values, rows in self._batch_window_inputs(frame, keep, config, fields):
+            output = np.full(len(frame), np.nan)
+            complete = np.zeros(len(frame), dtype=bool)
+            windows = {}
+            for i in rows:
+                window = windows.get(devices[i])
+                if window is None:
+                    window = windows[devices[i]] = window_store.tumbling(devices[i], name, window_size)
+                stats, complete[i] = window.push(float(values[i]))
+                output[i] = stats[aggregation_type]
+            updates[f"aggregates.{name}.{aggregation_type}"] = output
+            updates[f"aggregates.{name}.window_complete"] = complete
+        if updates:
+            frame = frame.assign(**updates)
+        return frame, keep
+    
+    def _batch_rolling_average(self, frame: pd.DataFrame, keep: np.ndarray, config: Dict[str, Any]):
+        """滾動平均（批次）"""
+        window_size, fields, _ = window_settings(config, "rolling_average", 3)
+        updates = {}
+        for name, devices, values, rows in self._batch_window_inputs(frame, keep, config, fields):
+            output = np.full(len(frame), np.nan)
+            windows = {}
+            for i in rows:
+                window = windows.get(devices[i])
+                if window is None:
+                    window = windows[devices[i]] = window_store.rolling(devices[i], name, window_size)
+                output[i] = window.push(float(values[i]))
+            updates[f"{name}_rolling_avg"] = output
+        if updates:
+            frame = frame.assign(**updates)
+        return frame, keep
+    
+    def _batch_temperature_filter(self, frame: pd.DataFrame, keep: np.ndarray, config: Dict[str, Any]):
+        """溫度過濾器（批次）"""
+        keep = self._batch_bounds_filter(
+            frame, keep, "temperature",
+            config.get("min_temperature", -50), config.get("max_temperature", 150)
+        )
+        return frame, keep
+    
+    def _batch_pressure_filter(self, frame: pd.DataFrame, keep: np.ndarray, config: Dict[str, Any]):
+        """壓力過濾器（批次）"""
+        keep = self._batch_bounds_filter(
+            frame, keep, "pressure",
+            config.get("min_pressure", 0), config.get("max_pressure", 1000)
+        )
+        return frame, keep
+    
+    def _batch_outlier_filter(self, frame: pd.DataFrame, keep: np.ndarray, config: Dict[str, Any]):
+        """異常值過濾器（批次）：每筆記錄的數值欄位以 IQR 檢測"""
+        matrix = self._numeric_matrix(frame)
+        if matrix.shape[1] < 3:
+            return frame, keep
+        
+        counts = np.sum(~np.isnan(matrix), axis=1)
+        q1 = self._row_quantile(matrix, counts, 0.25)
+        q3 = self._row_quantile(matrix, counts, 0.75)
+        iqr = q3 - q1
+        lower = (q1 - 1.5 * iqr)[:, None]
+        upper = (q3 + 1.5 * iqr)[:, None]
+        has_outlier = np.any((matrix < lower) | (matrix > upper), axis=1) & (counts >= 3)
+        
+        if (keep & has_outlier).any():
+            logger.warning(f"檢測到 {int((keep & has_outlier).sum())} 筆含異常值的記錄")
+        return frame, keep & ~has_outlier
+    
+    def _batch_statistical_aggregate(self, frame: pd.DataFrame, keep: np.ndarray, config: Dict[str, Any]):
+        """統計聚合（批次）：每筆記錄的數值欄位統計量"""
+        matrix = self._numeric_matrix(frame)
+        if matrix.shape[1] == 0:
+            return frame, keep
+        
+        counts = np.sum(~np.isnan(matrix), axis=1)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            stats = {
+                "statistics.count": counts,
+                "statistics.mean": np.nanmean(matrix, axis=1),
+                "statistics.std": np.nanstd(matrix, axis=1),
+                "statistics.min": np.nanmin(matrix, axis=1),
+                "statistics.max": np.nanmax(matrix, axis=1),
+                "statistics.median": np.nanmedian(matrix, axis=1),
+            }
+        frame = frame.assign(**stats)
+        return frame, keep
+    
+    def _batch_unit_conversion(self, frame: pd.DataFrame, keep: np.ndarray, config: Dict[str, Any]):
+        """單位轉換（批次）"""
+        conversions = config.get("unit_conversions", {})
+        updates = {}
+        for field, conversion in conversions.items():
+            values = self._numeric_column(frame, field)
+            if values is None:
+                continue
+            if conversion.get("from") == "celsius" and conversion.get("to") == "fahrenheit":
+                updates[field] = values * 9 / 5 + 32
+            elif conversion.get("from") == "fahrenheit" and conversion.get("to") == "celsius":
+                updates[field] = (values - 32) * 5 / 9
+        if updates:
+            frame = frame.assign(**updates)
+        return frame, keep
+    
+    def _batch_format_conversion(self, frame: pd.DataFrame, keep: np.ndarray, config: Dict[str, Any]):
+        """格式轉換（批次）：整批只序列化一次"""
+        if config.get("target_format", "json") == "csv":
+            frame.attrs["formatted_output"] = frame[keep].to_csv(index=False)
+        return frame, keep
+    
+    def _batch_data_type_conversion(self, frame: pd.DataFrame, keep: np.ndarray, config: Dict[str, Any]):
+        """數據類型轉換（批次）"""
+        type_mappings = config.get("type_mappings", {})
+        updates = {}
+        for field, target_type in type_mappings.items():
+            if field not in frame.columns:
+                continue
+            column = frame[field]
+            if target_type in ("int", "float"):
+                converted = pd.to_numeric(column, errors="coerce")
+                if target_type == "int":
+                    converted = np.trunc(converted).astype("Int64")
+                failed = column.notna() & converted.isna()
+                if failed.any():
+                    logger.warning(f"無法轉換 {field} 為 {target_type}（{int(failed.sum())} 筆）")
+                    converted = converted.astype(object).where(~failed, column)
+                updates[field] = converted
+            elif target_type == "str":
+                updates[field] = column.astype(str).where(column.notna(), None)
+            elif target_type == "bool":
+                updates[field] = column.astype(bool).where(column.notna(), None)
+        if updates:
+            frame = frame.assign(**updates)
+        return frame, keep
+    
+    def _batch_range_validation(self, frame: pd.DataFrame, keep: np.ndarray, config: Dict[str, Any]):
+        """範圍驗證（批次）"""
+        for field, validation in config.get("range_validations", {}).items():
+            keep = self._batch_bounds_filter(frame, keep, field, validation.get("min"), validation.get("max"))
+        return frame, keep
+    
+    def _batch_format_validation(self, frame: pd.DataFrame, keep: np.ndarray, config: Dict[str, Any]):
+        """格式驗證（批次）"""
+        for field, validation in config.get("format_validations", {}).items():
+            pattern = validation.get("pattern")
+            if not pattern or field not in frame.columns:
+                continue
+            column = frame[field]
+            matched = column.astype(str).str.match(pattern).to_numpy(dtype=bool)
+            invalid = column.notna().to_numpy() & ~matched
+            if (keep & invalid).any():
+                logger.warning(f"{field} 格式驗證失敗 {int((keep & invalid).sum())} 筆")
+            keep = keep & ~invalid
+        return frame, keep
+    
+    def _batch_completeness_check(self, frame: pd.DataFrame, keep: np.ndarray, config: Dict[str, Any]):
+        """完整性檢查（批次）"""
+        for field in config.get("required_fields", []):
+            if field not in frame.columns:
+                if keep.any():
+                    logger.warning(f"缺少必要欄位: {field}")
+                return frame, np.zeros(len(frame), dtype=bool)
+            keep = keep & frame[field].notna().to_numpy()
+        return frame, keep
+    
+    def _batch_min_max_normalize(self, frame: pd.DataFrame, keep: np.ndarray, config: Dict[str, Any]):
+        """最小-最大標準化（批次）"""
+        updates = {}
+        for field, norm_config in config.get("normalization", {}).items():
+            values = self._numeric_column(frame, field)
+            if values is None:
+                continue
+            min_val = norm_config.get("min", 0)
+            max_val = norm_config.get("max", 1)
+            feature_min = norm_config.get("feature_min", 0)
+            feature_max = norm_config.get("feature_max", 100)
+            if feature_max != feature_min:
+                updates[f"{field}_normalized"] = (
+                    (values - feature_min) / (feature_max - feature_min) * (max_val - min_val) + min_val
+                )
+        if updates:
+            frame = frame.assign(**updates)
+        return frame, keep
+    
+    def _batch_z_score_normalize(self, frame: pd.DataFrame, keep: np.ndarray, config: Dict[str, Any]):
+        """Z-score 標準化（批次）"""
+        updates = {}
+        for field, norm_config in config.get("z_score_normalization", {}).items():
+            values = self._numeric_column(frame, field)
+            if values is None:
+                continue
+            std = norm_config.get("std", 1)
+            if std != 0:
+                updates[f"{field}_z_score"] = (values - norm_config.get("mean", 0)) / std
+        if updates:
+            frame = frame.assign(**updates)
+        return frame, keep
+    
+    def _batch_decimal_scaling(self, frame: pd.DataFrame, keep: np.ndarray, config: Dict[str, Any]):
+        """小數縮放標準化（批次）"""
+        updates = {}
+        for field, scale_config in config.get("decimal_scaling", {}).items():
+            values = self._numeric_column(frame, field)
+            if values is None:
+                continue
+            max_abs = scale_config.get("max_absolute", 1000)
+            if max_abs != 0:
+                updates[f"{field}_scaled"] = values / max_abs
+        if updates:
+            frame = frame.assign(**updates)
+        return frame, keep
+    
     def save_processing_result(self, result: ProcessingResult, target_database: str = "influxdb"):
         """保存處理結果"""
         try:
@@ -459,26 +1131,35 @@ class DataProcessingService:
         """保存到 InfluxDB"""
         if result.success and result.data:
             try:
-                influx_client = get_influx_client()
-                if influx_client:
-                    point = {
-                        "measurement": "processed_data",
-                        "tags": {
-                            "source_id": result.metadata.get("source_id", "unknown"),
-                            "status": "success"
-                        },
-                        "fields": result.data,
-                        "time": datetime.utcnow()
-                    }
-                    
-                    write_api = influx_client.write_api()
-                    write_api.write(bucket="iiplatform", org="IIPlatform", record=point)
-                    logger.info("數據已保存到 InfluxDB")
-                else:
-                    logger.warning("InfluxDB 客戶端不可用")
+                fields = self.to_influx_fields(result.data)
+                if not fields:
+                    return
+                point = {
+                    "measurement": "processed_data",
+                    "tags": {
+                        "source_id": result.metadata.get("source_id", "unknown"),
+                        "status": "success"
+                    },
+                    "fields": fields,
+                    "time": datetime.utcnow()
+                }
+                
+                # 交由共用的批次寫入服務合併送出（使用寫入服務設定的 bucket/org）
+                timeseries_writer.write(point)
             except Exception as e:
                 logger.error(f"保存到 InfluxDB 失敗: {str(e)}")
     
+    def to_influx_fields(self, data: Any) -> Dict[str, Any]:
+        """將處理結果攤平成 InfluxDB 可接受的純量欄位"""
+        if not isinstance(data, dict):
+            return {}
+        
+        source = data.get("data") if isinstance(data.get("data"), dict) else data
+        return {
+            key: value for key, value in source.items()
+            if isinstance(value, (int, float, bool, str))
+        }
+    
     def _save_to_postgresql(self, result: ProcessingResult):
         """保存到 PostgreSQL"""
         db = get_postgres_session()
@@ -495,16 +1176,46 @@ class DataProcessingService:
     
     def _load_default_configurations(self):
         """載入預設配置"""
+        # 還原上次保存的窗口狀態
+        window_store.restore()
+        
+        # 設置預設處理管道與各數據源類型的管道
+        self.processing_pipeline = list(DEFAULT_PROCESSING_PIPELINES.get("temperature_processing", []))
+        self._bind_default_type_pipelines()
+        
         # 載入預設數據源
         for source_id, source_config in DEFAULT_DATA_SOURCES.items():
             self.add_data_source(source_id, source_config)
         
-        # 設置預設處理管道
-        default_pipeline = DEFAULT_PROCESSING_PIPELINES.get("temperature_processing", [])
-        self.set_processing_pipeline(default_pipeline)
-        
         logger.info("預設配置載入完成")
     
+    def set_execution_mode(self, mode: str):
+        """切換批次處理的執行模式（inline 或 process）
+
+        切換為 inline 時會停止處理池並收回工作程序的窗口狀態，呼叫端在
+        事件迴圈中應改在執行緒中呼叫。
+        """
+        if mode not in ("inline", "process"):
+            raise ValueError(f"不支援的執行模式: {mode}")
+        self.execution_mode = mode
+        if mode == "inline":
+            processing_pool.stop()
+        logger.info(f"批次處理執行模式: {mode}")
+    
+    def get_pool_metrics(self) -> Dict[str, Any]:
+        """獲取多程序處理池的各工作程序指標"""
+        metrics = processing_pool.get_metrics()
+        metrics["execution_mode"] = self.execution_mode
+        return metrics
+    
+    def get_window_stats(self) -> Dict[str, Any]:
+        """獲取串流窗口狀態統計"""
+        return window_store.get_stats()
+    
+    def save_window_snapshot(self) -> Optional[str]:
+        """將串流窗口狀態保存到磁碟"""
+        return window_store.snapshot()
+    
     def get_processor_configs(self) -> Dict[str, Any]:
         """獲取處理器配置"""
         return PROCESSOR_CONFIGS
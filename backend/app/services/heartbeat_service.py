@@ -0,0 +1,227 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import case, or_, select, text, update
+
+from .. import models
+from ..database import get_postgres_session
+
+logger = logging.getLogger(__name__)
+
+
+class HeartbeatTable:
+    """設備存活狀態的記憶體表
+
+    數據接收與 MQTT 狀態訊息只更新記憶體中的最新時間與狀態，背景執行緒
+    每隔 flush_interval 秒把這段期間有變動的設備合併成一條 UPDATE 寫回
+    devices 表（每台設備只保留最新的一筆）。讀取 last_seen 直接取記憶體，
+    不需查詢資料庫。寫回時不在 devices 表中的設備 id 會從記憶體移除，
+    避免未註冊的來源讓狀態表無限成長。
+    """
+
+    def __init__(self, flush_interval: float = None, chunk_size: int = None):
+        self.flush_interval = flush_interval or float(os.getenv("HEARTBEAT_FLUSH_INTERVAL", "5"))
+        self.chunk_size = chunk_size or int(os.getenv("HEARTBEAT_FLUSH_CHUNK", "1000"))
+        # device_id -> {"last_seen", "status", "last_heartbeat"}
+        self._state: Dict[str, Dict[str, Any]] = {}
+        # 尚未寫回資料庫的設備：device_id -> (last_seen, status)
+        self._pending: Dict[str, Tuple[datetime, Optional[str]]] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.touches = 0
+        self.flushes = 0
+        self.rows_flushed = 0
+        self.flush_failures = 0
+        self.evicted = 0
+        self.last_flush_at: Optional[datetime] = None
+        self.last_flush_time = 0.0
+
+    def touch(self, device_id: Any, timestamp: datetime = None, status: str = None, heartbeat: bool = False):
+        """記錄設備活動；heartbeat 為 True 時同時更新心跳時間"""
+        self.touch_many([(device_id, timestamp or datetime.utcnow(), status)], heartbeat=heartbeat)
+
+    def touch_many(self, items: Iterable[Tuple[Any, Optional[datetime], Optional[str]]], heartbeat: bool = False):
+        """批次記錄 (device_id, timestamp, status)，時間較舊的紀錄不會覆蓋較新的"""
+        now = datetime.utcnow()
+        count = 0
+        with self._lock:
+            for device_id, timestamp, status in items:
+                device_id = str(device_id)
+                timestamp = timestamp or now
+                state = self._state.get(device_id)
+                if state is None:
+                    state = self._state[device_id] = {"last_seen": None, "status": None, "last_heartbeat": None}
+                if state["last_seen"] is None or timestamp > state["last_seen"]:
+                    state["last_seen"] = timestamp
+                if status is not None:
+                    state["status"] = status
+                if heartbeat:
+                    state["last_heartbeat"] = timestamp
+
+                pending = self._pending.get(device_id)
+                if pending is None:
+                    self._pending[device_id] = (timestamp, status)
+                else:
+                    self._pending[device_id] = (max(pending[0], timestamp), status if status is not None else pending[1])
+                count += 1
+            self.touches += count
+        self._ensure_started()
+
+    def get(self, device_id: Any) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            state = self._state.get(str(device_id))
+            return dict(state) if state else None
+
+    def get_last_seen(self, device_id: Any) -> Optional[datetime]:
+        state = self.get(device_id)
+        return state["last_seen"] if state else None
+
+    def snapshot(self, device_ids: Iterable[Any] = None) -> Dict[str, Dict[str, Any]]:
+        """取得全部或指定設備的存活狀態"""
+        with self._lock:
+            if device_ids is None:
+                return {k: dict(v) for k, v in self._state.items()}
+            return {str(k): dict(self._state[str(k)]) for k in device_ids if str(k) in self._state}
+
+    def flush(self) -> int:
+        """把累積的變動以批次 UPDATE 寫回資料庫，回傳寫回的設備數"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+
+            start = time.monotonic()
+            device_ids = list(pending)
+            db = get_postgres_session()
+            try:
+                known = set()
+                for offset in range(0, len(device_ids), self.chunk_size):
+                    known.update(db.execute(
+                        select(models.Device.device_id)
+                        .where(models.Device.device_id.in_(device_ids[offset:offset + self.chunk_size]))
+                    ).scalars())
+                items = [(device_id, ts, status) for device_id, (ts, status) in pending.items() if device_id in known]
+                for offset in range(0, len(items), self.chunk_size):
+                    self._execute_update(db, items[offset:offset + self.chunk_size])
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                self.flush_failures += 1
+                logger.error(f"設備存活狀態寫回失敗: {e}")
+                self._requeue(pending)
+                return 0
+            finally:
+                db.close()
+
+            self._evict(pending.keys() - known)
+            self.flushes += 1
+            self.rows_flushed += len(items)
+            self.last_flush_at = datetime.utcnow()
+            self.last_flush_time = time.monotonic() - start
+            return len(items)
+
+    def _execute_update(self, db, items: List[Tuple[str, datetime, Optional[str]]]):
+        if db.bind.dialect.name == "postgresql":
+            values, params = [], {}
+            for i, (device_id, ts, status) in enumerate(items):
+                values.append(f"(:d{i}, CAST(:t{i} AS TIMESTAMP), CAST(:s{i} AS VARCHAR))")
+                params.update({f"d{i}": device_id, f"t{i}": ts, f"s{i}": status})
+            db.execute(text(
+                "UPDATE devices AS d "
+                "SET last_seen = GREATEST(COALESCE(d.last_seen, v.last_seen), v.last_seen), "
+                "status = COALESCE(v.status, d.status) "
+                f"FROM (VALUES {', '.join(values)}) AS v(device_id, last_seen, status) "
+                "WHERE d.device_id = v.device_id"
+            ), params)
+            return
+
+        # 不支援 UPDATE ... FROM (VALUES ...) 的資料庫改用 CASE 運算式
+        device_ids = [device_id for device_id, _, _ in items]
+        incoming = case({device_id: ts for device_id, ts, _ in items}, value=models.Device.device_id)
+        db.execute(
+            update(models.Device)
+            .where(models.Device.device_id.in_(device_ids))
+            .where(or_(models.Device.last_seen.is_(None), models.Device.last_seen < incoming))
+            .values(last_seen=incoming)
+            .execution_options(synchronize_session=False)
+        )
+        statuses = {device_id: status for device_id, _, status in items if status is not None}
+        if statuses:
+            db.execute(
+                update(models.Device)
+                .where(models.Device.device_id.in_(list(statuses)))
+                .values(status=case(statuses, value=models.Device.device_id))
+                .execution_options(synchronize_session=False)
+            )
+
+    def _evict(self, device_ids: Iterable[str]):
+        """移除未註冊設備的記憶體狀態（寫回期間又有新活動的設備留待下次判斷）"""
+        with self._lock:
+            for device_id in device_ids:
+                if device_id not in self._pending and self._state.pop(device_id, None) is not None:
+                    self.evicted += 1
+
+    def _requeue(self, pending: Dict[str, Tuple[datetime, Optional[str]]]):
+        """寫回失敗時把變動放回待寫表，與期間的新變動合併"""
+        with self._lock:
+            for device_id, (ts, status) in pending.items():
+                newer = self._pending.get(device_id)
+                if newer is None:
+                    self._pending[device_id] = (ts, status)
+                else:
+                    self._pending[device_id] = (max(ts, newer[0]), newer[1] if newer[1] is not None else status)
+
+    def start(self):
+        self._ensure_started()
+
+    def stop(self):
+        """停止背景執行緒並寫回剩餘變動"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(self.flush_interval + 5)
+            self._thread = None
+        self.flush()
+
+    def get_metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            devices = len(self._state)
+            pending = len(self._pending)
+        return {
+            "devices": devices,
+            "pending": pending,
+            "touches": self.touches,
+            "flushes": self.flushes,
+            "rows_flushed": self.rows_flushed,
+            "flush_failures": self.flush_failures,
+            "evicted": self.evicted,
+            "last_flush_at": self.last_flush_at.isoformat() if self.last_flush_at else None,
+            "last_flush_ms": self.last_flush_time * 1000,
+            "flush_interval": self.flush_interval,
+        }
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._start_lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._stop.clear()
+                    self._thread = threading.Thread(target=self._run, name="heartbeat-flusher", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"設備存活狀態寫回失敗: {e}")
+
+
+# 全局實例
+heartbeat_table = HeartbeatTable()
@@ -0,0 +1,194 @@
+"""
+時序歷史查詢：在 InfluxDB 端以 aggregateWindow 降採樣，回傳欄位式陣列
+"""
+
+import math
+import os
+import re
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from ..pagination import dumps
+
+# 單一序列的點數上限與預設值
+MAX_POINTS_LIMIT = int(os.getenv("HISTORY_MAX_POINTS_LIMIT", "10000"))
+DEFAULT_MAX_POINTS = int(os.getenv("HISTORY_DEFAULT_MAX_POINTS", "1000"))
+# LTTB 先在伺服器端聚合到 max_points 的幾倍，再於本地挑選形狀關鍵點
+LTTB_OVERSAMPLE = 4
+
+AGGREGATES = ("mean", "median", "min", "max", "first", "last", "sum", "count")
+METHODS = AGGREGATES + ("lttb",)
+
+# Flux 記錄中不屬於序列鍵的欄位
+_RECORD_COLUMNS = ("result", "table", "_start", "_stop", "_time", "_value")
+
+_DURATION_PATTERN = re.compile(r"^(\d+)(s|m|h|d)$")
+_UNIT_SECONDS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_duration(value: str) -> int:
+    """把 "10s"、"5m"、"1h"、"1d" 轉成秒數"""
+    match = _DURATION_PATTERN.match(value or "")
+    if not match or int(match.group(1)) <= 0:
+        raise ValueError(f"不支援的解析度: {value}")
+    return int(match.group(1)) * _UNIT_SECONDS[match.group(2)]
+
+
+def window_seconds(start: datetime, end: datetime, resolution: Optional[str] = None,
+                   max_points: Optional[int] = None, method: str = "mean") -> int:
+    """決定聚合視窗：指定 resolution 時直接使用，否則依 max_points 平均切分時間範圍
+
+    指定的 resolution 太細時放大到每個序列最多 MAX_POINTS_LIMIT 點。
+    """
+    if method not in METHODS:
+        raise ValueError(f"不支援的聚合方式: {method}")
+    if end <= start:
+        raise ValueError("結束時間必須晚於開始時間")
+    if resolution:
+        return max(parse_duration(resolution), math.ceil((end - start).total_seconds() / MAX_POINTS_LIMIT))
+    max_points = max_points or DEFAULT_MAX_POINTS
+    if max_points < 2 or max_points > MAX_POINTS_LIMIT:
+        raise ValueError(f"max_points 必須介於 2 與 {MAX_POINTS_LIMIT} 之間")
+    points = max_points * LTTB_OVERSAMPLE if method == "lttb" else max_points
+    return max(1, math.ceil((end - start).total_seconds() / points))
+
+
+def flux_string(value: Any) -> str:
+    """Flux 字串常值（跳脫引號與反斜線，避免查詢注入）"""
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _flux_time(value: datetime) -> str:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def build_history_flux(bucket: str, device_id: Any, start: datetime, end: datetime, every: int,
+                       method: str = "mean", measurement: Optional[str] = None,
+                       fields: Optional[Sequence[str]] = None,
+                       group_columns: Optional[Sequence[str]] = None,
+                       tags: Optional[Dict[str, Any]] = None) -> str:
+    """產生降採樣查詢：同一序列的點在伺服器端依視窗聚合
+
+    未指定 group_columns 時保留 InfluxDB 的序列鍵（_measurement、_field 與所有
+    標籤），不同量測或標籤的序列不會被混在同一個視窗裡聚合。
+    """
+    fn = "mean" if method == "lttb" else method
+    lines = [
+        'import "types"',
+        f"from(bucket: {flux_string(bucket)})",
+        f"  |> range(start: {_flux_time(start)}, stop: {_flux_time(end)})",
+        f'  |> filter(fn: (r) => r["device_id"] == {flux_string(device_id)})',
+    ]
+    if measurement:
+        lines.append(f'  |> filter(fn: (r) => r["_measurement"] == {flux_string(measurement)})')
+    for tag, value in (tags or {}).items():
+        lines.append(f"  |> filter(fn: (r) => r[{flux_string(tag)}] == {flux_string(value)})")
+    if fields:
+        field_set = ", ".join(flux_string(f) for f in fields)
+        lines.append(f"  |> filter(fn: (r) => contains(value: r._field, set: [{field_set}]))")
+    lines.append("  |> filter(fn: (r) => types.isNumeric(v: r._value))")
+    if group_columns:
+        columns = ", ".join(flux_string(c) for c in group_columns)
+        lines.append(f"  |> group(columns: [{columns}])")
+    lines.append(f"  |> aggregateWindow(every: {every}s, fn: {fn}, createEmpty: false)")
+    if group_columns:
+        lines.append(f'  |> keep(columns: ["_time", "_value", {columns}])')
+    else:
+        lines.append('  |> drop(columns: ["_start", "_stop"])')
+    return "\n".join(lines)
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets：挑出最能保留曲線形狀的 threshold 個點的索引"""
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    every = (n - 2) / (threshold - 2)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        next_start, next_end = end, min(int((i + 2) * every) + 1, n)
+        if next_start < next_end:
+            avg_x, avg_y = x[next_start:next_end].mean(), y[next_start:next_end].mean()
+        else:
+            avg_x, avg_y = x[-1], y[-1]
+        area = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a])
+        )
+        a = start + int(area.argmax())
+        selected[i + 1] = a
+    return selected
+
+
+def _series_key(values: Dict[str, Any], group_columns: Optional[Sequence[str]]) -> tuple:
+    if group_columns:
+        return tuple((c, values.get(c)) for c in group_columns)
+    return tuple(sorted((k, v) for k, v in values.items() if k not in _RECORD_COLUMNS))
+
+
+def collect_series(records: Iterable, group_columns: Optional[Sequence[str]] = None) -> Dict[tuple, Dict[str, list]]:
+    """把 FluxRecord 串流依分組欄位（未指定時為序列鍵）收成欄位式陣列（時間為 epoch 毫秒）"""
+    series: Dict[tuple, Dict[str, list]] = {}
+    for record in records:
+        values = record.values
+        key = _series_key(values, group_columns)
+        entry = series.get(key)
+        if entry is None:
+            entry = series[key] = {"time": [], "values": []}
+        entry["time"].append(int(values["_time"].timestamp() * 1000))
+        entry["values"].append(values["_value"])
+    return series
+
+
+def to_columnar(series: Dict[tuple, Dict[str, list]], method: str,
+                max_points: Optional[int]) -> List[Dict[str, Any]]:
+    """輸出每個序列的鍵與 time / values 陣列；lttb 時再挑出 max_points 個形狀關鍵點"""
+    output = []
+    for key, entry in series.items():
+        times, values = entry["time"], entry["values"]
+        if method == "lttb" and max_points and len(times) > max_points:
+            x = np.asarray(times, dtype=np.float64)
+            y = np.asarray(values, dtype=np.float64)
+            keep = lttb(x, y, max_points)
+            times = [times[i] for i in keep]
+            values = [values[i] for i in keep]
+        item = {c.lstrip("_"): v for c, v in key}
+        item.update({"time": times, "values": values, "points": len(times)})
+        output.append(item)
+    return output
+
+
+def query_history(query_api, bucket: str, device_id: Any, start: datetime, end: datetime,
+                  resolution: Optional[str] = None, max_points: Optional[int] = None,
+                  method: str = "mean", measurement: Optional[str] = None,
+                  fields: Optional[Sequence[str]] = None,
+                  group_columns: Optional[Sequence[str]] = None,
+                  tags: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """執行降採樣查詢，回傳 {start, stop, every, method, series: [{time: [...], values: [...]}]}"""
+    every = window_seconds(start, end, resolution, max_points, method)
+    flux = build_history_flux(bucket, device_id, start, end, every, method, measurement, fields, group_columns, tags)
+    series = collect_series(query_api.query_stream(flux), group_columns)
+    return {
+        "start": start.isoformat(),
+        "stop": end.isoformat(),
+        "every": f"{every}s",
+        "method": method,
+        "series": to_columnar(series, method, max_points or DEFAULT_MAX_POINTS),
+    }
+
+
+def stream_history(result: Dict[str, Any]) -> Iterable[bytes]:
+    """以 {"success": true, ..., "series": [...]} 輸出，每個序列一段"""
+    header = ",".join(f"{dumps(k)}:{dumps(v)}" for k, v in result.items() if k != "series")
+    yield ('{"success":true,' + (header + "," if header else "") + '"series":[').encode()
+    for i, series in enumerate(result.get("series", [])):
+        yield (("," if i else "") + dumps(series)).encode()
+    yield b"]}"
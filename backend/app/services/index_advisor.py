@@ -0,0 +1,201 @@
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import event, inspect
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PARAM_LIST = re.compile(r"\(\s*(?:\?|%\(\w+\)s|%s|:\w+)(?:\s*,\s*(?:\?|%\(\w+\)s|%s|:\w+))*\s*\)")
+_BIND_PARAM = re.compile(r"%\(\w+\)s|%s|:\w+")
+_WHITESPACE = re.compile(r"\s+")
+
+_FROM_TABLE = re.compile(r"\bFROM\s+\"?(\w+)\"?", re.IGNORECASE)
+_WHERE_CLAUSE = re.compile(r"\bWHERE\b(.*?)(?:\bGROUP BY\b|\bORDER BY\b|\bLIMIT\b|\bOFFSET\b|$)", re.IGNORECASE | re.DOTALL)
+_ORDER_CLAUSE = re.compile(r"\bORDER BY\b(.*?)(?:\bLIMIT\b|\bOFFSET\b|$)", re.IGNORECASE | re.DOTALL)
+_EQUALITY = re.compile(r"(?:\"?\w+\"?\.)?\"?(\w+)\"?\s*(?:=|\bIN\b|\bIS\b)\s*[?(]", re.IGNORECASE)
+_RANGE = re.compile(r"(?:\"?\w+\"?\.)?\"?(\w+)\"?\s*(?:<=|>=|<|>|\bBETWEEN\b)\s*\?", re.IGNORECASE)
+_COLUMN = re.compile(r"(?:\"?\w+\"?\.)?\"?(\w+)\"?")
+
+
+def fingerprint(statement: str) -> str:
+    """把 SQL 中的常值與參數換成 ?，同形查詢歸為同一類（不保留任何參數值）"""
+    normalized = _STRING_LITERAL.sub("?", statement)
+    normalized = _BIND_PARAM.sub("?", normalized)
+    normalized = _NUMBER_LITERAL.sub("?", normalized)
+    normalized = _PARAM_LIST.sub("(?)", normalized)
+    return _WHITESPACE.sub(" ", normalized).strip()
+
+
+class IndexAdvisor:
+    """慢查詢記錄與索引建議
+
+    透過 SQLAlchemy 的 cursor 事件量測每個語句的執行時間，超過門檻的語句
+    以指紋歸類後記錄次數與耗時。建議時從指紋解析出資料表、WHERE 的等值與
+    範圍欄位以及 ORDER BY 欄位，和資料表現有的索引比對，找出沒有索引可用
+    的欄位組合。
+    """
+
+    def __init__(self, slow_ms: float = None, max_fingerprints: int = 500):
+        self.slow_ms = slow_ms if slow_ms is not None else float(os.getenv("INDEX_ADVISOR_SLOW_MS", "100"))
+        self.enabled = os.getenv("INDEX_ADVISOR_ENABLED", "true").lower() == "true"
+        self.max_fingerprints = max_fingerprints
+        self._queries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._installed = False
+
+    def install(self):
+        """在所有 Engine 上掛上計時事件"""
+        if self._installed:
+            return
+        event.listen(Engine, "before_cursor_execute", self._before_execute)
+        event.listen(Engine, "after_cursor_execute", self._after_execute)
+        self._installed = True
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("index_advisor_start", []).append(time.perf_counter())
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("index_advisor_start")
+        if not starts:
+            return
+        elapsed_ms = (time.perf_counter() - starts.pop()) * 1000
+        if self.enabled and elapsed_ms >= self.slow_ms and statement.lstrip()[:6].upper() == "SELECT":
+            self.record(statement, elapsed_ms, conn.engine)
+
+    def record(self, statement: str, elapsed_ms: float, engine: Engine = None):
+        key = fingerprint(statement)
+        with self._lock:
+            entry = self._queries.get(key)
+            if entry is None:
+                entry = {"fingerprint": key, "count": 0, "total_ms": 0.0, "max_ms": 0.0, "engine": engine}
+                self._queries[key] = entry
+                while len(self._queries) > self.max_fingerprints:
+                    self._queries.popitem(last=False)
+            else:
+                self._queries.move_to_end(key)
+            entry["count"] += 1
+            entry["total_ms"] += elapsed_ms
+            entry["max_ms"] = max(entry["max_ms"], elapsed_ms)
+
+    def get_slow_queries(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """依總耗時排序的慢查詢"""
+        with self._lock:
+            entries = [dict(e) for e in self._queries.values()]
+        entries.sort(key=lambda e: e["total_ms"], reverse=True)
+        return [
+            {
+                "fingerprint": e["fingerprint"],
+                "count": e["count"],
+                "total_ms": round(e["total_ms"], 2),
+                "avg_ms": round(e["total_ms"] / e["count"], 2),
+                "max_ms": round(e["max_ms"], 2),
+            }
+            for e in entries[:limit]
+        ]
+
+    @staticmethod
+    def analyze(statement: str) -> Optional[Dict[str, Any]]:
+        """解析指紋中的資料表、等值欄位、範圍欄位與排序欄位"""
+        table_match = _FROM_TABLE.search(statement)
+        if not table_match:
+            return None
+        equality, ranges, order = [], [], []
+        where = _WHERE_CLAUSE.search(statement)
+        if where:
+            for column in _EQUALITY.findall(where.group(1)):
+                if column not in equality:
+                    equality.append(column)
+            for column in _RANGE.findall(where.group(1)):
+                if column not in equality and column not in ranges:
+                    ranges.append(column)
+        order_clause = _ORDER_CLAUSE.search(statement)
+        if order_clause:
+            for part in order_clause.group(1).split(","):
+                match = _COLUMN.match(part.strip())
+                if match and match.group(1) not in equality and match.group(1) not in order:
+                    order.append(match.group(1))
+        return {"table": table_match.group(1), "equality": equality, "range": ranges, "order": order}
+
+    @staticmethod
+    def _covered(columns: List[str], indexes: List[List[str]]) -> bool:
+        """是否已有索引以 columns 為前綴（等值欄位順序不拘）"""
+        for index_columns in indexes:
+            if len(index_columns) >= len(columns) and set(index_columns[:len(columns)]) == set(columns):
+                return True
+        return False
+
+    def suggest(self, engine: Engine = None) -> List[Dict[str, Any]]:
+        """對慢查詢提出缺少的複合索引：等值欄位在前，範圍或排序欄位在後"""
+        with self._lock:
+            entries = [dict(e) for e in self._queries.values()]
+
+        suggestions: Dict[tuple, Dict[str, Any]] = {}
+        index_cache: Dict[tuple, tuple] = {}
+        for entry in entries:
+            analysis = self.analyze(entry["fingerprint"])
+            if not analysis:
+                continue
+            columns = analysis["equality"] + (analysis["range"] or analysis["order"])[:1]
+            if not columns:
+                continue
+
+            target = engine or entry["engine"]
+            if target is None:
+                continue
+            cache_key = (id(target), analysis["table"])
+            if cache_key not in index_cache:
+                try:
+                    inspector = inspect(target)
+                    existing = [list(ix["column_names"]) for ix in inspector.get_indexes(analysis["table"])]
+                    existing.append(list(inspector.get_pk_constraint(analysis["table"]).get("constrained_columns") or []))
+                    known = {c["name"] for c in inspector.get_columns(analysis["table"])}
+                except Exception as e:
+                    logger.debug(f"無法讀取 {analysis['table']} 的索引: {e}")
+                    continue
+                index_cache[cache_key] = (existing, known)
+            existing, known = index_cache[cache_key]
+
+            columns = [c for c in columns if c in known]
+            if not columns or self._covered(columns, existing):
+                continue
+
+            key = (analysis["table"], tuple(columns))
+            suggestion = suggestions.setdefault(key, {
+                "table": analysis["table"],
+                "columns": columns,
+                "ddl": f"CREATE INDEX ix_{analysis['table']}_{'_'.join(columns)} ON {analysis['table']} ({', '.join(columns)})",
+                "queries": 0,
+                "total_ms": 0.0,
+                "examples": [],
+            })
+            suggestion["queries"] += entry["count"]
+            suggestion["total_ms"] = round(suggestion["total_ms"] + entry["total_ms"], 2)
+            if len(suggestion["examples"]) < 3:
+                suggestion["examples"].append(entry["fingerprint"])
+
+        return sorted(suggestions.values(), key=lambda s: s["total_ms"], reverse=True)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "slow_ms": self.slow_ms,
+                "fingerprints": len(self._queries),
+                "slow_queries": sum(e["count"] for e in self._queries.values()),
+            }
+
+    def reset(self):
+        with self._lock:
+            self._queries.clear()
+
+
+# 全局實例
+index_advisor = IndexAdvisor()
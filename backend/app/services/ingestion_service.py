@@ -0,0 +1,273 @@
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from .heartbeat_service import heartbeat_table
+from .timeseries_writer import timeseries_writer
+
+logger = logging.getLogger(__name__)
+
+
+class IngestionMetrics:
+    """接收佇列的執行期指標"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.enqueued = 0
+        self.processed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.unsupported = 0
+        self.batches = 0
+        self.latency_count = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.latency_last = 0.0
+
+    def incr(self, name: str, amount: int = 1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def observe_latency(self, latencies: List[float]):
+        """記錄一批訊息從入列到處理完成的延遲（秒）"""
+        if not latencies:
+            return
+        with self._lock:
+            self.latency_count += len(latencies)
+            self.latency_total += sum(latencies)
+            self.latency_max = max(self.latency_max, max(latencies))
+            self.latency_last = latencies[-1]
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            avg = self.latency_total / self.latency_count if self.latency_count else 0.0
+            return {
+                "enqueued": self.enqueued,
+                "processed": self.processed,
+                "failed": self.failed,
+                "dropped": self.dropped,
+                "unsupported": self.unsupported,
+                "batches": self.batches,
+                "latency_ms": {
+                    "avg": avg * 1000,
+                    "max": self.latency_max * 1000,
+                    "last": self.latency_last * 1000,
+                },
+            }
+
+
+class IngestionBridge:
+    """協定回呼執行緒與數據處理服務之間的常駐橋接器
+
+    MQTT 等協定的回呼在網路執行緒上執行，只負責把訊息放進有界佇列；
+    專用的背景執行緒持有一個長駐事件循環，成批取出訊息並交給
+    DataProcessingService 處理，避免每則訊息建立與關閉事件循環。
+    """
+
+    def __init__(self, max_queue_size: int = None, put_timeout: float = None, batch_size: int = None):
+        self.max_queue_size = max_queue_size or int(os.getenv("INGEST_QUEUE_SIZE", "10000"))
+        # 佇列滿時回呼執行緒最多等待的秒數，超過則丟棄訊息
+        self.put_timeout = put_timeout if put_timeout is not None else float(os.getenv("INGEST_PUT_TIMEOUT", "0.05"))
+        self.batch_size = batch_size or int(os.getenv("INGEST_BATCH_SIZE", "500"))
+
+        self._queue: "queue.Queue[Tuple[float, str, Any]]" = queue.Queue(maxsize=self.max_queue_size)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._running = threading.Event()
+        self._start_lock = threading.Lock()
+        self.metrics = IngestionMetrics()
+
+    @property
+    def is_running(self) -> bool:
+        return self._running.is_set()
+
+    def start(self):
+        """啟動背景處理執行緒"""
+        with self._start_lock:
+            if self._running.is_set():
+                return
+            self._running.set()
+            self._thread = threading.Thread(target=self._run, name="ingestion-bridge", daemon=True)
+            self._thread.start()
+            logger.info(f"數據接收橋接器啟動，佇列容量: {self.max_queue_size}")
+
+    def stop(self, timeout: float = 5.0):
+        """停止背景處理執行緒，並處理完佇列中剩餘的訊息"""
+        with self._start_lock:
+            if not self._running.is_set():
+                return
+            self._running.clear()
+            if self._thread:
+                self._thread.join(timeout)
+            self._thread = None
+            logger.info("數據接收橋接器已停止")
+
+    def submit_mqtt(self, topic: str, payload: Any) -> bool:
+        """由 MQTT 回呼執行緒呼叫，將訊息放入佇列
+
+        佇列滿時最多阻塞 put_timeout 秒以對上游施加背壓，仍無空間則丟棄。
+        """
+        if not self._running.is_set():
+            self.start()
+
+        try:
+            self._queue.put((time.monotonic(), topic, payload), timeout=self.put_timeout)
+        except queue.Full:
+            self.metrics.incr("dropped")
+            return False
+
+        self.metrics.incr("enqueued")
+        return True
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """獲取佇列深度、丟棄數與處理延遲等指標"""
+        metrics = self.metrics.snapshot()
+        metrics.update({
+            "running": self.is_running,
+            "queue_depth": self._queue.qsize(),
+            "queue_capacity": self.max_queue_size,
+        })
+        return metrics
+
+    def _run(self):
+        """背景執行緒主體：持有單一事件循環直到停止"""
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        try:
+            while self._running.is_set() or not self._queue.empty():
+                batch = self._drain()
+                if batch:
+                    self._loop.run_until_complete(self._process_batch(batch))
+        finally:
+            self._loop.close()
+            self._loop = None
+
+    def _drain(self) -> List[Tuple[float, str, Any]]:
+        """阻塞取出第一則訊息，再非阻塞地補滿一個批次"""
+        try:
+            batch = [self._queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    async def _process_batch(self, batch: List[Tuple[float, str, Any]]):
+        """處理一批 MQTT 訊息"""
+        from .data_processing_service import data_processing_service
+
+        if data_processing_service.execution_mode == "process":
+            await self._process_batch_columnar(batch)
+            return
+
+        latencies = []
+        for enqueued_at, topic, payload in batch:
+            try:
+                result = await data_processing_service.process_mqtt_data(topic, payload)
+                if result.success:
+                    data_processing_service.save_processing_result(result)
+                else:
+                    logger.warning(f"MQTT 數據處理失敗: {result.error_message}")
+                self._save_raw_mqtt_data(topic, payload)
+                self.metrics.incr("processed")
+            except Exception as e:
+                self.metrics.incr("failed")
+                logger.error(f"數據處理服務調用失敗: {str(e)}")
+            latencies.append(time.monotonic() - enqueued_at)
+
+        self.metrics.incr("batches")
+        self.metrics.observe_latency(latencies)
+
+    async def _process_batch_columnar(self, batch: List[Tuple[float, str, Any]]):
+        """程序池模式：依數據源分組後整批交給 process_batch"""
+        from .data_processing_service import data_processing_service
+
+        groups: Dict[str, List[Dict[str, Any]]] = {}
+        for _, topic, payload in batch:
+            try:
+                self._save_raw_mqtt_data(topic, payload)
+                if isinstance(payload, dict):
+                    device_id = topic.split('/')[1]
+                    plan = data_processing_service.get_plan(f"mqtt_{device_id}")
+                    if plan is not None:
+                        # 分組的記錄在批次處理成功後才計入
+                        groups.setdefault(plan.source_id, []).append({**payload, "device_id": device_id})
+                        continue
+                    logger.warning(f"未找到數據源配置: mqtt_{device_id}")
+                self.metrics.incr("processed")
+            except Exception as e:
+                self.metrics.incr("failed")
+                logger.error(f"數據處理服務調用失敗: {str(e)}")
+
+        for source_id, records in groups.items():
+            try:
+                result = await data_processing_service.process_batch(source_id, records)
+                if not result.success:
+                    logger.warning(f"MQTT 批次處理失敗: {result.error_message}")
+                for record in result.to_records():
+                    fields = data_processing_service.to_influx_fields(record)
+                    fields.pop("device_id", None)
+                    if fields:
+                        timeseries_writer.write({
+                            "measurement": "processed_data",
+                            "tags": {"source_id": source_id, "device_id": record.get("device_id"), "status": "success"},
+                            "fields": fields,
+                            "time": datetime.utcnow()
+                        })
+            except Exception as e:
+                self.metrics.incr("failed", len(records))
+                logger.error(f"MQTT 批次處理失敗: {str(e)}")
+            else:
+                self.metrics.incr("processed" if result.success else "failed", len(records))
+
+        self.metrics.incr("batches")
+        now = time.monotonic()
+        self.metrics.observe_latency([now - enqueued_at for enqueued_at, _, _ in batch])
+
+    @staticmethod
+    def _raw_fields(payload: Any) -> Optional[Dict[str, Any]]:
+        """原始訊息轉成 InfluxDB 欄位：字典原樣使用，純量（含 UTF-8 位元組）包成 value 欄位"""
+        if isinstance(payload, dict):
+            return payload
+        if isinstance(payload, (bytes, bytearray)):
+            try:
+                payload = bytes(payload).decode("utf-8")
+            except UnicodeDecodeError:
+                return None
+        if isinstance(payload, (bool, int, float, str)):
+            return {"value": payload}
+        return None
+
+    def _save_raw_mqtt_data(self, topic: str, payload: Any):
+        """保存原始 MQTT 數據到 InfluxDB"""
+        device_id = topic.split('/')[1]
+        heartbeat_table.touch(device_id)
+        fields = self._raw_fields(payload)
+        if fields is None:
+            # msgpack/raw 解碼器可能產生列表或二進位內容，無法直接寫成欄位
+            self.metrics.incr("unsupported")
+            logger.warning(f"無法保存的 MQTT 數據類型: {type(payload).__name__} ({topic})")
+            return
+        point = {
+            "measurement": "device_sensor_data",
+            "tags": {
+                "device_id": device_id
+            },
+            "fields": fields,
+            "time": datetime.utcnow()
+        }
+
+        timeseries_writer.write(point)
+
+
+# 全局實例
+ingestion_bridge = IngestionBridge()
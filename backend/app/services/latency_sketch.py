@@ -0,0 +1,98 @@
+import math
+from typing import Any, Dict, Iterable, Optional
+
+
+class LatencySketch:
+    """可合併的延遲分位數摘要（對數分桶，相對誤差 relative_accuracy）
+
+    每個值落在 ceil(log_gamma(x)) 的桶中，只記錄各桶的次數，因此兩個摘要
+    相加桶次數即可合併，1 分鐘的摘要可以直接合成 1 小時或 1 天，分位數的
+    相對誤差仍維持在 relative_accuracy 以內。
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.bins: Dict[int, float] = {}
+        self.zero_count = 0.0
+        self.count = 0.0
+        self.sum = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def add(self, value: float, weight: float = 1.0):
+        if value is None or weight <= 0 or math.isnan(value):
+            return
+        value = max(float(value), 0.0)
+        if value <= 1e-9:
+            self.zero_count += weight
+        else:
+            key = math.ceil(math.log(value) / self._log_gamma)
+            self.bins[key] = self.bins.get(key, 0.0) + weight
+        self.count += weight
+        self.sum += value * weight
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def add_many(self, values: Iterable[float]):
+        for value in values:
+            self.add(value)
+
+    def merge(self, other: "LatencySketch") -> "LatencySketch":
+        """把另一個摘要併入（兩者需使用相同的 relative_accuracy）"""
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("無法合併不同精度的延遲摘要")
+        for key, count in other.bins.items():
+            self.bins[key] = self.bins.get(key, 0.0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+        if other.max is not None:
+            self.max = other.max if self.max is None else max(self.max, other.max)
+        return self
+
+    def quantile(self, q: float) -> Optional[float]:
+        if self.count <= 0:
+            return None
+        rank = q * (self.count - 1)
+        if rank < self.zero_count:
+            return 0.0
+        seen = self.zero_count
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if seen > rank:
+                # 桶 (gamma^(k-1), gamma^k] 的代表值，相對誤差不超過 relative_accuracy
+                value = 2 * self.gamma ** key / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self.sum / self.count if self.count else None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "a": self.relative_accuracy,
+            "b": {str(k): v for k, v in self.bins.items()},
+            "z": self.zero_count,
+            "n": self.count,
+            "s": self.sum,
+            "min": self.min,
+            "max": self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> "LatencySketch":
+        if not data:
+            return cls()
+        sketch = cls(data.get("a", 0.01))
+        sketch.bins = {int(k): float(v) for k, v in (data.get("b") or {}).items()}
+        sketch.zero_count = float(data.get("z", 0))
+        sketch.count = float(data.get("n", 0))
+        sketch.sum = float(data.get("s", 0))
+        sketch.min = data.get("min")
+        sketch.max = data.get("max")
+        return sketch
@@ -1,94 +1,214 @@
-from typing import List, Dict, Optional
+import threading
+import time
+import os
+from itertools import chain
+from typing import List, Dict, Optional, FrozenSet, Tuple
+from sqlalchemy import event
 from sqlalchemy.orm import Session
-from ..models import User, Role, Permission, RolePermission, UserPermission, ResourcePermission, PermissionCategory, PageCategory, Page
+from ..models import User, Role, Permission, RolePermission, UserPermission, ResourcePermission, PermissionCategory
 import datetime
 
+
+class UserPermissionSet:
+    """單一用戶解析後的權限：每種資源類型一個動作 frozenset，另含資源特定權限"""
+
+    __slots__ = ("user_id", "is_superuser", "actions", "resources", "version", "loaded_at")
+
+    def __init__(self, user_id: int, is_superuser: bool, actions: Dict[str, FrozenSet[str]],
+                 resources: FrozenSet[Tuple[str, int, str]], version: Tuple[int, int]):
+        self.user_id = user_id
+        self.is_superuser = is_superuser
+        self.actions = actions
+        self.resources = resources
+        self.version = version
+        self.loaded_at = time.monotonic()
+
+    def allows(self, resource_type: str, action: str, resource_id: Optional[int] = None) -> bool:
+        if self.is_superuser:
+            return True
+        if resource_id and (resource_type, resource_id, action) in self.resources:
+            return True
+        wildcard = self.actions.get("*")
+        if wildcard and "*" in wildcard:
+            return True
+        granted = self.actions.get(resource_type)
+        return bool(granted) and ("*" in granted or action in granted)
+
+    def as_dict(self) -> Dict[str, List[str]]:
+        if self.is_superuser:
+            return {"*": ["*"]}
+        return {resource_type: sorted(actions) for resource_type, actions in self.actions.items()}
+
+
+class PermissionCache:
+    """以用戶為單位的權限快取
+
+    快取項目帶有 (全域版本, 用戶版本)：用戶的授權/撤銷或角色指派變更時遞增
+    該用戶的版本，角色權限或權限定義變更時遞增全域版本，版本不符的項目在
+    下次讀取時重新載入。另有 ttl 作為其他程序直接修改資料表時的保險。
+    """
+
+    def __init__(self, ttl: float = None):
+        self.ttl = ttl or float(os.getenv("PERMISSION_CACHE_TTL", "300"))
+        self._entries: Dict[int, UserPermissionSet] = {}
+        self._user_versions: Dict[int, int] = {}
+        self._global_version = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def version(self, user_id: int) -> Tuple[int, int]:
+        with self._lock:
+            return self._global_version, self._user_versions.get(user_id, 0)
+
+    def get(self, user_id: int) -> Optional[UserPermissionSet]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if (entry is not None
+                    and entry.version == (self._global_version, self._user_versions.get(user_id, 0))
+                    and time.monotonic() - entry.loaded_at < self.ttl):
+                self.hits += 1
+                return entry
+            self.misses += 1
+            return None
+
+    def put(self, entry: UserPermissionSet):
+        with self._lock:
+            # 載入期間若版本已變更，不寫入快取
+            if entry.version == (self._global_version, self._user_versions.get(entry.user_id, 0)):
+                self._entries[entry.user_id] = entry
+
+    def invalidate_user(self, user_id: int):
+        with self._lock:
+            self._user_versions[user_id] = self._user_versions.get(user_id, 0) + 1
+            self._entries.pop(user_id, None)
+
+    def invalidate_all(self):
+        with self._lock:
+            self._global_version += 1
+            self._entries.clear()
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "users": len(self._entries),
+                "global_version": self._global_version,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+# 全局實例
+permission_cache = PermissionCache()
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_permission_changes(session, flush_context):
+    """記錄本次交易中影響權限的變更，提交後再使快取失效"""
+    changes = session.info.setdefault("permission_changes", {"users": set(), "all": False})
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, (UserPermission, ResourcePermission)):
+            changes["users"].add(obj.user_id)
+        elif isinstance(obj, User):
+            changes["users"].add(obj.id)
+        elif isinstance(obj, (Role, Permission, RolePermission)):
+            changes["all"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_permission_changes(session):
+    changes = session.info.pop("permission_changes", None)
+    if not changes:
+        return
+    if changes["all"]:
+        permission_cache.invalidate_all()
+    for user_id in changes["users"]:
+        if user_id is not None:
+            permission_cache.invalidate_user(user_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_permission_changes(session):
+    session.info.pop("permission_changes", None)
+
+
 class PermissionService:
-    def __init__(self, db: Session):
+    def __init__(self, db: Session, cache: PermissionCache = None):
         self.db = db
+        self.cache = cache or permission_cache
 
-    def get_user_permissions(self, user_id: int) -> Dict[str, List[str]]:
-        """獲取用戶所有權限"""
+    def resolve_user_permissions(self, user_id: int) -> Optional[UserPermissionSet]:
+        """取得用戶的權限集合；快取有效時不查詢資料庫"""
+        cached = self.cache.get(user_id)
+        if cached is not None:
+            return cached
+
+        version = self.cache.version(user_id)
         user = self.db.query(User).filter(User.id == user_id).first()
         if not user:
-            return {}
-        
-        # 超級管理員擁有所有權限
+            return None
+
         if user.is_superuser:
-            return {"*": ["*"]}
-        
-        permissions = {}
-        
-        # 獲取角色權限
-        for user_role in user.user_roles:
-            role_permissions = self.db.query(RolePermission).filter(
-                RolePermission.role_id == user_role.role_id,
-                RolePermission.granted == True
+            entry = UserPermissionSet(user_id, True, {}, frozenset(), version)
+            self.cache.put(entry)
+            return entry
+
+        actions: Dict[str, set] = {}
+
+        # 角色權限：一次 JOIN 查詢取出角色的有效權限（資源類型即 Permission.module）
+        if user.role_id is not None:
+            role_rows = self.db.query(Permission.module, Permission.action).join(
+                RolePermission, RolePermission.permission_id == Permission.id
+            ).filter(
+                RolePermission.role_id == user.role_id,
+                Permission.is_active == True
             ).all()
-            
-            for rp in role_permissions:
-                permission = self.db.query(Permission).filter(Permission.id == rp.permission_id).first()
-                if permission and permission.is_active:
-                    if permission.resource_type not in permissions:
-                        permissions[permission.resource_type] = []
-                    permissions[permission.resource_type].append(permission.action)
-        
-        # 獲取用戶特定權限（覆蓋角色權限）
-        user_permissions = self.db.query(UserPermission).filter(
-            UserPermission.user_id == user_id
+            for resource_type, action in role_rows:
+                actions.setdefault(resource_type, set()).add(action)
+
+        # 用戶特定權限（覆蓋角色權限），依建立順序套用
+        user_rows = self.db.query(Permission.module, Permission.action, UserPermission.granted).join(
+            UserPermission, UserPermission.permission_id == Permission.id
+        ).filter(
+            UserPermission.user_id == user_id,
+            Permission.is_active == True
+        ).order_by(UserPermission.id).all()
+        for resource_type, action, granted in user_rows:
+            granted_actions = actions.setdefault(resource_type, set())
+            if granted:
+                granted_actions.add(action)
+            else:
+                granted_actions.discard(action)
+
+        # 資源特定權限
+        resource_rows = self.db.query(
+            ResourcePermission.resource_type, ResourcePermission.resource_id, ResourcePermission.permission
+        ).filter(
+            ResourcePermission.user_id == user_id,
+            ResourcePermission.granted == True
         ).all()
-        
-        for up in user_permissions:
-            permission = self.db.query(Permission).filter(Permission.id == up.permission_id).first()
-            if permission and permission.is_active:
-                if permission.resource_type not in permissions:
-                    permissions[permission.resource_type] = []
-                
-                if up.granted:
-                    if permission.action not in permissions[permission.resource_type]:
-                        permissions[permission.resource_type].append(permission.action)
-                else:
-                    if permission.action in permissions[permission.resource_type]:
-                        permissions[permission.resource_type].remove(permission.action)
-        
-        return permissions
+
+        entry = UserPermissionSet(
+            user_id,
+            False,
+            {resource_type: frozenset(values) for resource_type, values in actions.items()},
+            frozenset((resource_type, resource_id, permission) for resource_type, resource_id, permission in resource_rows),
+            version
+        )
+        self.cache.put(entry)
+        return entry
+
+    def get_user_permissions(self, user_id: int) -> Dict[str, List[str]]:
+        """獲取用戶所有權限"""
+        permissions = self.resolve_user_permissions(user_id)
+        return permissions.as_dict() if permissions else {}
 
     def check_permission(self, user_id: int, resource_type: str, action: str, resource_id: Optional[int] = None) -> bool:
         """檢查用戶是否有特定權限"""
-        user = self.db.query(User).filter(User.id == user_id).first()
-        if not user:
+        permissions = self.resolve_user_permissions(user_id)
+        if permissions is None:
             return False
-        
-        # 超級管理員擁有所有權限
-        if user.is_superuser:
-            return True
-        
-        # 檢查資源特定權限
-        if resource_id:
-            resource_permission = self.db.query(ResourcePermission).filter(
-                ResourcePermission.user_id == user_id,
-                ResourcePermission.resource_type == resource_type,
-                ResourcePermission.resource_id == resource_id,
-                ResourcePermission.permission == action,
-                ResourcePermission.granted == True
-            ).first()
-            
-            if resource_permission:
-                return True
-        
-        # 檢查一般權限
-        permissions = self.get_user_permissions(user_id)
-        
-        # 檢查通配符權限
-        if "*" in permissions and "*" in permissions["*"]:
-            return True
-        
-        # 檢查特定資源類型權限
-        if resource_type in permissions:
-            if "*" in permissions[resource_type] or action in permissions[resource_type]:
-                return True
-        
-        return False
+        return permissions.allows(resource_type, action, resource_id)
 
     def grant_permission_to_user(self, user_id: int, permission_id: int, granted_by: int) -> bool:
         """授予用戶權限"""
@@ -171,7 +291,7 @@ class PermissionService:
                 "name": perm.name,
                 "display_name": perm.display_name,
                 "description": perm.description,
-                "resource_type": perm.resource_type,
+                "resource_type": perm.module,
                 "action": perm.action
             }
             for perm in permissions
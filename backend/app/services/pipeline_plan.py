@@ -0,0 +1,522 @@
+"""
+處理管道編譯
+
+在設定數據源或處理管道時，把 (數據源配置, 處理管道) 預先編譯成執行計畫：
+處理器只解析一次、正則表達式預先編譯、驗證範圍攤平成陣列，連續的內建
+步驟融合成單一同步函數，處理每筆數據時不再查表與讀取巢狀配置。
+"""
+import logging
+import re
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .window_store import window_store
+
+logger = logging.getLogger(__name__)
+
+# 編譯後的步驟：接收處理中的數據，回傳處理結果（None 表示被過濾）
+StepFunc = Callable[[Any], Any]
+
+
+def flatten_source_config(source_config: Dict[str, Any]) -> Dict[str, Any]:
+    """合併數據源的頂層設定與巢狀的 config 區塊（巢狀設定優先）"""
+    merged = {k: v for k, v in source_config.items() if k != "config"}
+    nested = source_config.get("config")
+    if isinstance(nested, dict):
+        merged.update(nested)
+    return merged
+
+
+def _payload(data: Any) -> Optional[Dict[str, Any]]:
+    if isinstance(data, dict):
+        payload = data.get("data")
+        if isinstance(payload, dict):
+            return payload
+    return None
+
+
+def _compile_bounds_filter(field_name: str, label: str, min_val: Any, max_val: Any) -> StepFunc:
+    def step(data):
+        payload = _payload(data)
+        if payload is not None and field_name in payload:
+            value = payload[field_name]
+            if not min_val <= value <= max_val:
+                logger.warning(f"{label} {value} 超出範圍 [{min_val}, {max_val}]")
+                return None
+        return data
+    return step
+
+
+def compile_temperature_filter(config: Dict[str, Any]) -> Optional[StepFunc]:
+    return _compile_bounds_filter(
+        "temperature", "溫度值",
+        config.get("min_temperature", -50), config.get("max_temperature", 150)
+    )
+
+
+def compile_pressure_filter(config: Dict[str, Any]) -> Optional[StepFunc]:
+    return _compile_bounds_filter(
+        "pressure", "壓力值",
+        config.get("min_pressure", 0), config.get("max_pressure", 1000)
+    )
+
+
+def compile_outlier_filter(config: Dict[str, Any]) -> Optional[StepFunc]:
+    def step(data):
+        payload = _payload(data)
+        if payload is None:
+            return data
+        values = [v for v in payload.values() if isinstance(v, (int, float))]
+        if len(values) >= 3:
+            q1, q3 = np.percentile(values, [25, 75])
+            iqr = q3 - q1
+            lower_bound = q1 - 1.5 * iqr
+            upper_bound = q3 + 1.5 * iqr
+            outliers = [v for v in values if v < lower_bound or v > upper_bound]
+            if outliers:
+                logger.warning(f"檢測到異常值: {outliers}")
+                return None
+        return data
+    return step
+
+
+AGGREGATION_TYPES = ("mean", "sum", "min", "max", "std", "count")
+
+# 其他處理器產生的衍生欄位，未指定 fields 時不納入窗口
+DERIVED_FIELD_SUFFIXES = ("_rolling_avg", "_normalized", "_z_score", "_scaled")
+# 會更新 window_store 中各設備窗口狀態的步驟
+STATEFUL_STEPS = ("time_series_aggregate", "rolling_average")
+
+
+def window_settings(config: Dict[str, Any], name: str, default_size: int) -> Tuple[int, Optional[Tuple[str, ...]], Dict[str, Any]]:
+    """讀取窗口處理器的設定：可放在同名的巢狀區塊或頂層"""
+    options = config.get(name)
+    if not isinstance(options, dict):
+        options = {}
+    window_size = int(options.get("window_size", config.get("window_size", default_size)))
+    fields = options.get("fields", config.get("window_fields"))
+    return window_size, tuple(fields) if fields else None, options
+
+
+def _window_values(payload: Dict[str, Any], fields: Optional[Tuple[str, ...]]):
+    names = fields if fields is not None else tuple(
+        name for name in payload if not str(name).endswith(DERIVED_FIELD_SUFFIXES)
+    )
+    for name in names:
+        value = payload.get(name)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield name, value
+
+
+def compile_time_series_aggregate(config: Dict[str, Any]) -> Optional[StepFunc]:
+    """以每個 (設備, 欄位) 的固定筆數窗口做滾動式（tumbling）聚合"""
+    window_size, fields, options = window_settings(config, "time_series_aggregate", 5)
+    aggregation_type = options.get("aggregation_type", config.get("aggregation_type", "mean"))
+    if aggregation_type not in AGGREGATION_TYPES:
+        logger.warning(f"不支援的聚合類型: {aggregation_type}，改用 mean")
+        aggregation_type = "mean"
+    default_device = str(config.get("source_id", "default"))
+
+    def step(data):
+        payload = _payload(data)
+        if payload is None:
+            return data
+        device_id = str(data.get("device_id") or default_device)
+        aggregates = data.setdefault("aggregates", {})
+        for name, value in list(_window_values(payload, fields)):
+            stats, complete = window_store.tumbling(device_id, name, window_size).push(value)
+            aggregates[name] = {
+                "type": aggregation_type,
+                "value": stats[aggregation_type],
+                "count": stats["count"],
+                "window_size": window_size,
+                "window_complete": complete
+            }
+        return data
+    return step
+
+
+def compile_rolling_average(config: Dict[str, Any]) -> Optional[StepFunc]:
+    """每個 (設備, 欄位) 最近 window_size 筆的滑動平均，寫入 <欄位>_rolling_avg"""
+    window_size, fields, _ = window_settings(config, "rolling_average", 3)
+    default_device = str(config.get("source_id", "default"))
+
+    def step(data):
+        payload = _payload(data)
+        if payload is None:
+            return data
+        device_id = str(data.get("device_id") or default_device)
+        for name, value in list(_window_values(payload, fields)):
+            payload[f"{name}_rolling_avg"] = window_store.rolling(device_id, name, window_size).push(value)
+        return data
+    return step
+
+
+def compile_statistical_aggregate(config: Dict[str, Any]) -> Optional[StepFunc]:
+    def step(data):
+        payload = _payload(data)
+        if payload is None:
+            return data
+        values = np.fromiter(
+            (v for v in payload.values() if isinstance(v, (int, float))), dtype=float
+        )
+        if values.size:
+            data["statistics"] = {
+                "count": int(values.size),
+                "mean": float(values.mean()),
+                "std": float(values.std()),
+                "min": float(values.min()),
+                "max": float(values.max()),
+                "median": float(np.median(values))
+            }
+        return data
+    return step
+
+
+def compile_unit_conversion(config: Dict[str, Any]) -> Optional[StepFunc]:
+    converters: List[Tuple[str, Callable[[float], float]]] = []
+    for field_name, conversion in config.get("unit_conversions", {}).items():
+        if conversion.get("from") == "celsius" and conversion.get("to") == "fahrenheit":
+            converters.append((field_name, lambda v: v * 9/5 + 32))
+        elif conversion.get("from") == "fahrenheit" and conversion.get("to") == "celsius":
+            converters.append((field_name, lambda v: (v - 32) * 5/9))
+    if not converters:
+        return None
+
+    def step(data):
+        payload = _payload(data)
+        if payload is not None:
+            for field_name, convert in converters:
+                if field_name in payload:
+                    payload[field_name] = convert(payload[field_name])
+        return data
+    return step
+
+
+def compile_format_conversion(config: Dict[str, Any]) -> Optional[StepFunc]:
+    if config.get("target_format", "json") != "csv":
+        return None
+
+    def step(data):
+        if isinstance(data, dict):
+            return pd.DataFrame([data]).to_csv(index=False)
+        return data
+    return step
+
+
+def compile_data_type_conversion(config: Dict[str, Any]) -> Optional[StepFunc]:
+    casters = {"int": int, "float": float, "str": str, "bool": bool}
+    conversions = [
+        (field_name, target_type, casters[target_type])
+        for field_name, target_type in config.get("type_mappings", {}).items()
+        if target_type in casters
+    ]
+    if not conversions:
+        return None
+
+    def step(data):
+        payload = _payload(data)
+        if payload is not None:
+            for field_name, target_type, cast in conversions:
+                if field_name in payload:
+                    try:
+                        payload[field_name] = cast(payload[field_name])
+                    except (ValueError, TypeError):
+                        logger.warning(f"無法轉換 {field_name} 為 {target_type}")
+        return data
+    return step
+
+
+def compile_range_validation(config: Dict[str, Any]) -> Optional[StepFunc]:
+    validations = config.get("range_validations", {})
+    if not validations:
+        return None
+
+    fields = tuple(validations)
+    lower = np.array([
+        -np.inf if v.get("min") is None else v["min"] for v in validations.values()
+    ], dtype=float)
+    upper = np.array([
+        np.inf if v.get("max") is None else v["max"] for v in validations.values()
+    ], dtype=float)
+    bounds = tuple(zip(fields, lower.tolist(), upper.tolist()))
+
+    def step(data):
+        payload = _payload(data)
+        if payload is None:
+            return data
+        for field_name, min_val, max_val in bounds:
+            if field_name in payload:
+                value = payload[field_name]
+                if value < min_val:
+                    logger.warning(f"{field_name} 值 {value} 小於最小值 {min_val}")
+                    return None
+                if value > max_val:
+                    logger.warning(f"{field_name} 值 {value} 大於最大值 {max_val}")
+                    return None
+        return data
+
+    step.bounds = (fields, lower, upper)
+    return step
+
+
+def compile_format_validation(config: Dict[str, Any]) -> Optional[StepFunc]:
+    patterns = [
+        (field_name, re.compile(validation["pattern"]).match)
+        for field_name, validation in config.get("format_validations", {}).items()
+        if validation.get("pattern")
+    ]
+    if not patterns:
+        return None
+
+    def step(data):
+        payload = _payload(data)
+        if payload is None:
+            return data
+        for field_name, match in patterns:
+            if field_name in payload and not match(str(payload[field_name])):
+                logger.warning(f"{field_name} 格式驗證失敗: {payload[field_name]}")
+                return None
+        return data
+    return step
+
+
+def compile_completeness_check(config: Dict[str, Any]) -> Optional[StepFunc]:
+    required_fields = tuple(config.get("required_fields", []))
+    if not required_fields:
+        return None
+
+    def step(data):
+        payload = _payload(data)
+        if payload is None:
+            return data
+        missing_fields = [f for f in required_fields if payload.get(f) is None]
+        if missing_fields:
+            logger.warning(f"缺少必要欄位: {missing_fields}")
+            return None
+        return data
+    return step
+
+
+def _compile_linear(targets: List[Tuple[str, str, float, float]]) -> Optional[StepFunc]:
+    """以 value * scale + offset 寫入衍生欄位"""
+    if not targets:
+        return None
+
+    def step(data):
+        payload = _payload(data)
+        if payload is not None:
+            for field_name, output_field, scale, offset in targets:
+                if field_name in payload:
+                    payload[output_field] = payload[field_name] * scale + offset
+        return data
+    return step
+
+
+def compile_min_max_normalize(config: Dict[str, Any]) -> Optional[StepFunc]:
+    targets = []
+    for field_name, norm_config in config.get("normalization", {}).items():
+        min_val = norm_config.get("min", 0)
+        max_val = norm_config.get("max", 1)
+        feature_min = norm_config.get("feature_min", 0)
+        feature_max = norm_config.get("feature_max", 100)
+        if feature_max != feature_min:
+            scale = (max_val - min_val) / (feature_max - feature_min)
+            targets.append((field_name, f"{field_name}_normalized", scale, min_val - feature_min * scale))
+    return _compile_linear(targets)
+
+
+def compile_z_score_normalize(config: Dict[str, Any]) -> Optional[StepFunc]:
+    targets = []
+    for field_name, norm_config in config.get("z_score_normalization", {}).items():
+        std = norm_config.get("std", 1)
+        if std != 0:
+            targets.append((field_name, f"{field_name}_z_score", 1 / std, -norm_config.get("mean", 0) / std))
+    return _compile_linear(targets)
+
+
+def compile_decimal_scaling(config: Dict[str, Any]) -> Optional[StepFunc]:
+    targets = []
+    for field_name, scale_config in config.get("decimal_scaling", {}).items():
+        max_abs = scale_config.get("max_absolute", 1000)
+        if max_abs != 0:
+            targets.append((field_name, f"{field_name}_scaled", 1 / max_abs, 0.0))
+    return _compile_linear(targets)
+
+
+def fuse_steps(steps: List[Tuple[str, StepFunc]]) -> Callable[[Any], Tuple[Any, Optional[str]]]:
+    """把連續的同步步驟融合成單一函數，回傳 (結果, 過濾該筆數據的步驟名稱)"""
+    names = tuple(name for name, _ in steps)
+    funcs = tuple(func for _, func in steps)
+
+    def fused(data):
+        for name, func in zip(names, funcs):
+            data = func(data)
+            if data is None:
+                return None, name
+        return data, None
+    return fused
+
+
+@dataclass
+class PipelinePlan:
+    """單一 (數據源, 處理管道) 的編譯結果"""
+    source_id: str
+    pipeline: Tuple[str, ...]
+    config: Dict[str, Any]
+    # 每個區段為 ("fused", 步驟名稱, 融合函數) 或 ("async", 步驟名稱, 處理器)
+    segments: List[Tuple[str, Tuple[str, ...], Callable]]
+    compiled_steps: List[str]
+    fallback_steps: List[str]
+    skipped_steps: List[str]
+    compile_time: float
+    compiled_at: datetime = field(default_factory=datetime.now)
+    runs: int = 0
+    dropped: int = 0
+    failures: int = 0
+    total_run_time: float = 0.0
+
+    async def run(self, data: Any) -> Tuple[Any, List[Dict[str, Any]]]:
+        """執行計畫，回傳處理後數據與步驟紀錄；步驟失敗時拋出 PipelineStepError"""
+        start = time.perf_counter()
+        steps_meta: List[Dict[str, Any]] = []
+        self.runs += 1
+        try:
+            for kind, names, func in self.segments:
+                segment_start = time.perf_counter()
+                try:
+                    if kind == "fused":
+                        data, dropped_at = func(data)
+                    else:
+                        data = await func(data, self.config)
+                        dropped_at = names[0] if data is None else None
+                except Exception as e:
+                    self.failures += 1
+                    raise PipelineStepError(names, e, steps_meta, data) from e
+
+                segment_time = time.perf_counter() - segment_start
+                for name in names:
+                    steps_meta.append({
+                        "step": name,
+                        "processing_time": segment_time / len(names),
+                        "success": True
+                    })
+                    if name == dropped_at:
+                        break
+                if dropped_at is not None:
+                    self.dropped += 1
+                    steps_meta[-1]["dropped"] = True
+                    return None, steps_meta
+            return data, steps_meta
+        finally:
+            self.total_run_time += time.perf_counter() - start
+
+    @property
+    def stateful(self) -> bool:
+        """計畫是否包含窗口步驟（同一設備的記錄必須由同一個程序處理）"""
+        return any(step in STATEFUL_STEPS for step in self.compiled_steps + self.fallback_steps)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "source_id": self.source_id,
+            "pipeline": list(self.pipeline),
+            "compiled_steps": self.compiled_steps,
+            "fallback_steps": self.fallback_steps,
+            "skipped_steps": self.skipped_steps,
+            "stateful": self.stateful,
+            "segments": len(self.segments),
+            "compile_time_ms": self.compile_time * 1000,
+            "compiled_at": self.compiled_at.isoformat(),
+            "runs": self.runs,
+            "dropped": self.dropped,
+            "failures": self.failures,
+            "avg_run_time_ms": self.total_run_time / self.runs * 1000 if self.runs else 0.0,
+        }
+
+
+class PipelineStepError(Exception):
+    """編譯後的處理步驟執行失敗"""
+
+    def __init__(self, steps: Tuple[str, ...], error: Exception,
+                 steps_meta: List[Dict[str, Any]], data: Any):
+        super().__init__(str(error))
+        self.step = steps[0] if len(steps) == 1 else ",".join(steps)
+        self.error = error
+        self.steps_meta = steps_meta
+        self.data = data
+
+
+DEFAULT_STEP_COMPILERS: Dict[str, Callable[[Dict[str, Any]], Optional[StepFunc]]] = {
+    "temperature_filter": compile_temperature_filter,
+    "pressure_filter": compile_pressure_filter,
+    "outlier_filter": compile_outlier_filter,
+    "time_series_aggregate": compile_time_series_aggregate,
+    "statistical_aggregate": compile_statistical_aggregate,
+    "rolling_average": compile_rolling_average,
+    "unit_conversion": compile_unit_conversion,
+    "format_conversion": compile_format_conversion,
+    "data_type_conversion": compile_data_type_conversion,
+    "range_validation": compile_range_validation,
+    "format_validation": compile_format_validation,
+    "completeness_check": compile_completeness_check,
+    "min_max_normalize": compile_min_max_normalize,
+    "z_score_normalize": compile_z_score_normalize,
+    "decimal_scaling": compile_decimal_scaling,
+}
+
+
+def compile_pipeline(source_id: str, source_config: Dict[str, Any], pipeline: List[str],
+                     processing_rules: Dict[str, Callable],
+                     step_compilers: Dict[str, Callable]) -> PipelinePlan:
+    """編譯處理管道
+
+    有編譯器的步驟在此解析配置並產生同步函數（配置為空時整步省略）；
+    沒有編譯器的自訂處理器保留原本的 async 呼叫方式。
+    """
+    start = time.perf_counter()
+    config = flatten_source_config(source_config)
+
+    segments: List[Tuple[str, Tuple[str, ...], Callable]] = []
+    pending: List[Tuple[str, StepFunc]] = []
+    compiled_steps, fallback_steps, skipped_steps = [], [], []
+
+    def flush_pending():
+        if pending:
+            segments.append(("fused", tuple(name for name, _ in pending), fuse_steps(list(pending))))
+            pending.clear()
+
+    for step in pipeline:
+        compiler = step_compilers.get(step)
+        if compiler is not None:
+            func = compiler(config)
+            if func is None:
+                skipped_steps.append(step)
+            else:
+                pending.append((step, func))
+                compiled_steps.append(step)
+            continue
+
+        processor = processing_rules.get(step)
+        if processor is None:
+            skipped_steps.append(step)
+            continue
+        flush_pending()
+        segments.append(("async", (step,), processor))
+        fallback_steps.append(step)
+    flush_pending()
+
+    return PipelinePlan(
+        source_id=source_id,
+        pipeline=tuple(pipeline),
+        config=config,
+        segments=segments,
+        compiled_steps=compiled_steps,
+        fallback_steps=fallback_steps,
+        skipped_steps=skipped_steps,
+        compile_time=time.perf_counter() - start
+    )
@@ -0,0 +1,345 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context, shared_memory
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .window_store import window_store
+
+logger = logging.getLogger(__name__)
+
+# 欄位配置：(欄位名稱, dtype 字串, 位移, 長度)
+ColumnLayout = List[Tuple[str, str, int, int]]
+
+
+def pack_columns(frame: pd.DataFrame) -> Tuple[Optional[shared_memory.SharedMemory], ColumnLayout, Dict[str, list]]:
+    """把數值欄位複製到一塊共享記憶體；其他欄位以 list 傳遞"""
+    layout: ColumnLayout = []
+    objects: Dict[str, list] = {}
+    arrays = []
+    offset = 0
+    for name in frame.columns:
+        column = frame[name]
+        if pd.api.types.is_numeric_dtype(column) or pd.api.types.is_bool_dtype(column):
+            try:
+                array = np.ascontiguousarray(column.to_numpy())
+            except (TypeError, ValueError):
+                array = None
+            if array is not None and array.dtype != object:
+                layout.append((name, array.dtype.str, offset, len(array)))
+                arrays.append((offset, array))
+                # 每個欄位以 8 位元組對齊
+                offset += (array.nbytes + 7) // 8 * 8
+                continue
+        objects[name] = column.tolist()
+
+    if not arrays:
+        return None, layout, objects
+
+    shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+    for start, array in arrays:
+        np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf, offset=start)[:] = array
+    return shm, layout, objects
+
+
+def unpack_columns(shm_name: Optional[str], layout: ColumnLayout, objects: Dict[str, list],
+                   columns: List[str]) -> pd.DataFrame:
+    """從共享記憶體重建 DataFrame（複製後立即釋放對映）"""
+    data: Dict[str, Any] = {}
+    if shm_name:
+        shm = shared_memory.SharedMemory(name=shm_name)
+        try:
+            for name, dtype, start, length in layout:
+                data[name] = np.ndarray((length,), dtype=np.dtype(dtype), buffer=shm.buf, offset=start).copy()
+        finally:
+            shm.close()
+    data.update(objects)
+    return pd.DataFrame({name: data[name] for name in columns})
+
+
+# 工作程序內的狀態
+_worker_loop: Optional[asyncio.AbstractEventLoop] = None
+_worker_plan_tokens: Dict[str, str] = {}
+
+
+def _init_worker(windows: list):
+    """建立工作程序的事件迴圈，並以主程序移交的窗口取代磁碟快照還原的狀態"""
+    global _worker_loop
+    from . import data_processing_service  # noqa: F401  匯入時會還原窗口快照
+
+    _worker_loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(_worker_loop)
+    window_store.clear()
+    window_store.load(windows)
+
+
+def _export_windows() -> list:
+    """回傳工作程序內的窗口狀態（停止處理池前由主程序收回）"""
+    return window_store.export()
+
+
+def _worker_plan(source_id: str, plan_token: str, config: Dict[str, Any], pipeline: List[str]):
+    """取得工作程序內的編譯計畫；主程序的計畫更新後重新設定"""
+    from .data_processing_service import data_processing_service as service
+
+    if _worker_plan_tokens.get(source_id) != plan_token:
+        service.set_processing_pipeline(pipeline, source_id=source_id)
+        service.add_data_source(source_id, config)
+        _worker_plan_tokens[source_id] = plan_token
+    return service, service.get_plan(source_id)
+
+
+def _run_shard(source_id: str, plan_token: str, config: Dict[str, Any], pipeline: List[str],
+               shm_name: Optional[str], layout: ColumnLayout, objects: Dict[str, list],
+               columns: List[str]) -> Dict[str, Any]:
+    """在工作程序中執行一個分片的批次處理"""
+    start = time.perf_counter()
+    service, plan = _worker_plan(source_id, plan_token, config, pipeline)
+    frame = unpack_columns(shm_name, layout, objects, columns)
+    result = _worker_loop.run_until_complete(service._process_frame(plan, frame))
+    return {
+        "pid": os.getpid(),
+        "success": result.success,
+        "error_message": result.error_message,
+        "columns": result.columns,
+        "keep_mask": result.keep_mask,
+        "metadata": result.metadata,
+        "busy_time": time.perf_counter() - start,
+    }
+
+
+def _run_record(source_id: str, plan_token: str, config: Dict[str, Any], pipeline: List[str],
+                data: Any) -> Dict[str, Any]:
+    """在工作程序中以逐筆計畫處理單筆數據"""
+    from .pipeline_plan import PipelineStepError
+
+    start = time.perf_counter()
+    _, plan = _worker_plan(source_id, plan_token, config, pipeline)
+    try:
+        processed, steps = _worker_loop.run_until_complete(plan.run(data))
+        outcome = {"success": True, "data": processed, "steps": steps}
+    except PipelineStepError as e:
+        outcome = {"success": False, "data": e.data, "steps": e.steps_meta, "step": e.step, "error": str(e.error)}
+    outcome.update(pid=os.getpid(), busy_time=time.perf_counter() - start)
+    return outcome
+
+
+class WorkerMetrics:
+    """單一工作程序的吞吐量指標"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.pid = None
+        self.batches = 0
+        self.records = 0
+        self.failures = 0
+        self.busy_time = 0.0
+        self.last_batch_at = None
+
+    def observe(self, pid: int, records: int, busy_time: float, success: bool):
+        with self._lock:
+            self.pid = pid
+            self.batches += 1
+            self.records += records
+            self.busy_time += busy_time
+            self.last_batch_at = time.time()
+            if not success:
+                self.failures += 1
+
+    def incr_failures(self):
+        with self._lock:
+            self.failures += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "pid": self.pid,
+                "batches": self.batches,
+                "records": self.records,
+                "failures": self.failures,
+                "busy_time": self.busy_time,
+                "records_per_second": self.records / self.busy_time if self.busy_time else 0.0,
+                "last_batch_at": self.last_batch_at,
+            }
+
+
+class ProcessingPool:
+    """以設備分片的多程序批次處理池
+
+    每個分片是一個只有單一工作程序的執行器：同一設備的記錄永遠送到同一個
+    程序並依提交順序處理，因此單一設備的處理順序與串流窗口狀態都能保持
+    一致；不同設備則分散到各 CPU 核心平行處理。數值欄位透過共享記憶體
+    傳給工作程序，避免序列化整個批次。
+    """
+
+    def __init__(self, workers: int = None, start_method: str = None):
+        self.workers = workers or int(os.getenv("PROCESSING_WORKERS", str(os.cpu_count() or 1)))
+        self.start_method = start_method or os.getenv("PROCESSING_START_METHOD", "spawn")
+        self._executors: List[ProcessPoolExecutor] = []
+        self._lock = threading.Lock()
+        self.metrics = [WorkerMetrics() for _ in range(self.workers)]
+
+    @property
+    def is_running(self) -> bool:
+        return bool(self._executors)
+
+    def start(self):
+        with self._lock:
+            if self._executors:
+                return
+            # 窗口狀態移交給設備所屬的分片，處理池執行期間主程序不保留副本
+            seeds = [[] for _ in range(self.workers)]
+            for key, window in window_store.export():
+                seeds[self.shard_of(key[1])].append((key, window))
+            context = get_context(self.start_method)
+            self._executors = [
+                ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=_init_worker,
+                                    initargs=(seeds[shard],))
+                for shard in range(self.workers)
+            ]
+            window_store.clear()
+            logger.info(f"數據處理程序池啟動，工作程序數: {self.workers}")
+
+    def stop(self, collect_timeout: float = 30.0):
+        """停止處理池；先收回各工作程序的窗口狀態到主程序，之後的快照與逐筆處理才會延續"""
+        with self._lock:
+            executors, self._executors = self._executors, []
+        # 收回的請求排在已提交的分片之後，取得的是處理完所有批次後的狀態
+        futures = [executor.submit(_export_windows) for executor in executors]
+        for shard, future in enumerate(futures):
+            try:
+                window_store.load(future.result(timeout=collect_timeout))
+            except Exception as e:
+                logger.error(f"收回分片 {shard} 的窗口狀態失敗: {e}")
+        for executor in executors:
+            executor.shutdown(wait=True)
+        if executors:
+            logger.info("數據處理程序池已停止")
+
+    def shard_of(self, device_id: Any) -> int:
+        """以穩定雜湊決定設備所屬分片（跨程序與重啟保持一致）"""
+        return zlib.crc32(str(device_id).encode()) % self.workers
+
+    def _shard_rows(self, frame: pd.DataFrame, default_key: str) -> Dict[int, np.ndarray]:
+        if "device_id" not in frame.columns:
+            return {self.shard_of(default_key): np.arange(len(frame))}
+        codes, devices = pd.factorize(frame["device_id"].astype(str))
+        device_shards = np.array([self.shard_of(device) for device in devices], dtype=np.int64)
+        row_shards = device_shards[codes]
+        return {int(shard): np.flatnonzero(row_shards == shard) for shard in np.unique(row_shards)}
+
+    async def run_record(self, plan, data: Any) -> Tuple[Any, List[Dict[str, Any]]]:
+        """在設備所屬的分片執行逐筆計畫，步驟失敗時拋出 PipelineStepError"""
+        from .pipeline_plan import PipelineStepError
+
+        self.start()
+        device_id = data.get("device_id") if isinstance(data, dict) else None
+        shard = self.shard_of(device_id or plan.source_id)
+        plan_token = f"{id(plan)}:{plan.compiled_at.isoformat()}"
+        future = self._executors[shard].submit(
+            _run_record, plan.source_id, plan_token, plan.config, list(plan.pipeline), data
+        )
+        try:
+            outcome = await asyncio.wrap_future(future)
+        except Exception:
+            self.metrics[shard].incr_failures()
+            raise
+        self.metrics[shard].observe(outcome["pid"], 1, outcome["busy_time"], outcome["success"])
+        if not outcome["success"]:
+            raise PipelineStepError((outcome["step"],), RuntimeError(outcome["error"]),
+                                    outcome["steps"], outcome["data"])
+        return outcome["data"], outcome["steps"]
+
+    async def process(self, plan, frame: pd.DataFrame):
+        """將批次依設備分片後平行處理，再依原始順序合併結果"""
+        from .data_processing_service import BatchProcessingResult
+
+        self.start()
+        start_time = time.perf_counter()
+        plan_token = f"{id(plan)}:{plan.compiled_at.isoformat()}"
+        loop = asyncio.get_running_loop()
+
+        shards = self._shard_rows(frame, plan.source_id)
+        tasks, buffers, order = [], [], []
+        try:
+            for shard, rows in shards.items():
+                part = frame.iloc[rows].reset_index(drop=True)
+                shm, layout, objects = pack_columns(part)
+                if shm is not None:
+                    buffers.append(shm)
+                future = self._executors[shard].submit(
+                    _run_shard, plan.source_id, plan_token, plan.config, list(plan.pipeline),
+                    shm.name if shm is not None else None, layout, objects, list(part.columns)
+                )
+                tasks.append(asyncio.wrap_future(future, loop=loop))
+                order.append((shard, rows))
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            for shm in buffers:
+                shm.close()
+                shm.unlink()
+
+        parts, keep = [], np.zeros(len(frame), dtype=bool)
+        steps: Dict[str, Dict[str, Any]] = {}
+        errors = []
+        for (shard, rows), result in zip(order, results):
+            if isinstance(result, BaseException):
+                self.metrics[shard].incr_failures()
+                errors.append(f"分片 {shard}: {result}")
+                continue
+            self.metrics[shard].observe(result["pid"], len(rows), result["busy_time"], result["success"])
+            if not result["success"]:
+                errors.append(f"分片 {shard}: {result['error_message']}")
+            parts.append(pd.DataFrame(result["columns"], index=rows))
+            keep[rows] = result["keep_mask"]
+            for step in result["metadata"].get("processing_steps", []):
+                merged = steps.setdefault(step["step"], {
+                    "step": step["step"], "processing_time": 0.0, "success": True, "dropped": 0
+                })
+                merged["processing_time"] = max(merged["processing_time"], step.get("processing_time", 0))
+                merged["success"] = merged["success"] and step.get("success", False)
+                merged["dropped"] += step.get("dropped", 0)
+
+        # 失敗分片的列保留位置（欄位為 NaN、keep 為 False），其他分片的結果照常輸出
+        merged_frame = pd.concat(parts) if parts else pd.DataFrame()
+        merged_frame = merged_frame.reindex(pd.RangeIndex(len(frame)))
+        processing_time = time.perf_counter() - start_time
+        metadata = {
+            "source_id": plan.source_id,
+            "record_count": len(frame),
+            "processing_steps": list(steps.values()),
+            "execution_mode": "process",
+            "shards": len(shards),
+            "total_processing_time": processing_time,
+            "kept_count": int(keep.sum()),
+            "failed_shards": len(errors),
+        }
+        return BatchProcessingResult(
+            success=not errors,
+            columns={col: merged_frame[col].to_numpy() for col in merged_frame.columns},
+            keep_mask=keep,
+            metadata=metadata,
+            error_message="; ".join(errors) if errors else None,
+            processing_time=processing_time
+        )
+
+    def get_metrics(self) -> Dict[str, Any]:
+        workers = [m.snapshot() for m in self.metrics]
+        return {
+            "running": self.is_running,
+            "workers": self.workers,
+            "start_method": self.start_method,
+            "records": sum(w["records"] for w in workers),
+            "per_worker": workers,
+        }
+
+
+# 全局實例
+processing_pool = ProcessingPool()
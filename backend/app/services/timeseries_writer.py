@@ -0,0 +1,362 @@
+import logging
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+try:
+    from influxdb_client import InfluxDBClient, Point, WritePrecision
+    from influxdb_client.client.write_api import SYNCHRONOUS
+    from influxdb_client.rest import ApiException
+    INFLUXDB_AVAILABLE = True
+except ImportError:
+    INFLUXDB_AVAILABLE = False
+
+
+def is_outage(error: Exception) -> bool:
+    """判斷錯誤是否代表 InfluxDB 無法服務（連線、逾時或 5xx），供斷路器計數
+
+    4xx 是請求本身的問題，InfluxDB 仍正常運作，不應打開斷路器。
+    """
+    if INFLUXDB_AVAILABLE and isinstance(error, ApiException):
+        return error.status is None or error.status >= 500
+    return True
+
+
+class WriterMetrics:
+    """批次寫入的執行期指標"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.points_received = 0
+        self.points_written = 0
+        self.points_spilled = 0
+        self.points_replayed = 0
+        self.points_dropped = 0
+        self.points_rejected = 0
+        self.batches_sent = 0
+        self.batches_failed = 0
+        self.retries = 0
+        self.flush_latency_total = 0.0
+        self.flush_latency_max = 0.0
+        self.batch_size_max = 0
+
+    def incr(self, name: str, amount: int = 1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def observe_batch(self, size: int, latency: float):
+        with self._lock:
+            self.batches_sent += 1
+            self.points_written += size
+            self.flush_latency_total += latency
+            self.flush_latency_max = max(self.flush_latency_max, latency)
+            self.batch_size_max = max(self.batch_size_max, size)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            batches = self.batches_sent
+            return {
+                "points_received": self.points_received,
+                "points_written": self.points_written,
+                "points_spilled": self.points_spilled,
+                "points_replayed": self.points_replayed,
+                "points_dropped": self.points_dropped,
+                "points_rejected": self.points_rejected,
+                "batches_sent": batches,
+                "batches_failed": self.batches_failed,
+                "retries": self.retries,
+                "flush_latency_ms": {
+                    "avg": self.flush_latency_total / batches * 1000 if batches else 0.0,
+                    "max": self.flush_latency_max * 1000,
+                },
+                "batch_size": {
+                    "avg": self.points_written / batches if batches else 0.0,
+                    "max": self.batch_size_max,
+                },
+            }
+
+
+class TimeSeriesWriter:
+    """所有寫入路徑共用的 InfluxDB 批次寫入服務
+
+    寫入點立即轉成 line protocol，依 (bucket, org) 合併暫存；背景執行緒在
+    累積到 batch_size 或每隔 flush_interval 秒時以單一 gzip 請求批量送出。
+    送出失敗會以帶抖動的指數退避重試，仍失敗則溢寫到本地磁碟，待 InfluxDB
+    恢復後重新送出。InfluxDB 以 4xx（429 除外）拒絕的批次重試也不會成功，
+    改寫入 dead-letter 檔案後丟棄。
+    """
+
+    def __init__(self, batch_size: int = None, flush_interval: float = None,
+                 max_retries: int = None, spool_dir: str = None):
+        self.url = os.getenv("INFLUXDB_URL", os.getenv("INFLUX_URL", "http://localhost:8086"))
+        self.token = os.getenv("INFLUXDB_TOKEN", os.getenv("INFLUX_TOKEN", ""))
+        self.org = os.getenv("INFLUXDB_ORG", "IIPlatform")
+        self.bucket = os.getenv("INFLUXDB_BUCKET", "iiplatform")
+
+        self.batch_size = batch_size or int(os.getenv("INFLUX_BATCH_SIZE", "5000"))
+        self.flush_interval = flush_interval or float(os.getenv("INFLUX_FLUSH_INTERVAL", "1.0"))
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("INFLUX_MAX_RETRIES", "3"))
+        self.retry_base_delay = float(os.getenv("INFLUX_RETRY_BASE_DELAY", "0.5"))
+        self.retry_max_delay = float(os.getenv("INFLUX_RETRY_MAX_DELAY", "10"))
+        self.spool_dir = Path(spool_dir or os.getenv("INFLUX_SPOOL_DIR", "spool/influxdb"))
+        self.dead_letter_dir = self.spool_dir / "dead-letter"
+        self.max_spool_bytes = int(os.getenv("INFLUX_MAX_SPOOL_BYTES", str(512 * 1024 * 1024)))
+
+        self._buffers: Dict[Tuple[str, str], List[str]] = defaultdict(list)
+        self._buffered = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._client = None
+        self._write_api = None
+        self._health = None
+        self.metrics = WriterMetrics()
+
+    def attach_health_monitor(self, monitor):
+        """掛上 InfluxDB 健康監控；斷路器打開時直接溢寫而不嘗試連線"""
+        self._health = monitor
+
+    def write(self, record: Any, bucket: str = None, org: str = None) -> bool:
+        """將單筆或多筆記錄加入批次
+
+        record 可以是 Point、與 InfluxDB 客戶端相同格式的 dict、line protocol
+        字串，或以上型別組成的 list。
+        """
+        if not INFLUXDB_AVAILABLE:
+            return False
+
+        records = record if isinstance(record, list) else [record]
+        lines = []
+        for item in records:
+            try:
+                line = self._to_line_protocol(item)
+            except Exception as e:
+                self.metrics.incr("points_dropped")
+                logger.error(f"無法轉換為 line protocol: {e}")
+                continue
+            if line:
+                lines.append(line)
+
+        if not lines:
+            return False
+
+        key = (bucket or self.bucket, org or self.org)
+        with self._lock:
+            self._buffers[key].extend(lines)
+            self._buffered += len(lines)
+            should_flush = self._buffered >= self.batch_size
+
+        self.metrics.incr("points_received", len(lines))
+        self._ensure_started()
+        if should_flush:
+            self._wake.set()
+        return True
+
+    def flush(self):
+        """立即送出所有暫存的寫入點"""
+        with self._lock:
+            buffers = self._buffers
+            self._buffers = defaultdict(list)
+            self._buffered = 0
+
+        with self._flush_lock:
+            if not buffers and not self._has_spool():
+                return
+
+            healthy = self._health is None or self._health.allow_request()
+            for (bucket, org), lines in buffers.items():
+                for start in range(0, len(lines), self.batch_size):
+                    chunk = lines[start:start + self.batch_size]
+                    # 一旦本輪送出失敗，其餘批次直接溢寫，避免重複等待退避
+                    if healthy and self._send_with_retry(bucket, org, chunk):
+                        continue
+                    healthy = False
+                    self._spill(bucket, org, chunk)
+
+            if healthy:
+                self._replay_spool()
+
+    def close(self):
+        """停止背景執行緒並送出剩餘數據"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(self.flush_interval + 5)
+            self._thread = None
+        self.flush()
+        if self._client:
+            self._client.close()
+            self._client = None
+            self._write_api = None
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """獲取批次大小、送出延遲與溢寫狀態等指標"""
+        metrics = self.metrics.snapshot()
+        with self._lock:
+            metrics["buffered_points"] = self._buffered
+        metrics["spool_bytes"] = self._spool_size()
+        return metrics
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._start_lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._stop.clear()
+                    self._thread = threading.Thread(target=self._run, name="influx-batch-writer", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"InfluxDB 批次寫入失敗: {e}")
+
+    def _to_line_protocol(self, record: Any) -> Optional[str]:
+        if isinstance(record, str):
+            return record
+        if isinstance(record, bytes):
+            return record.decode()
+        if isinstance(record, dict):
+            record = Point.from_dict(record, write_precision=WritePrecision.NS)
+        return record.to_line_protocol()
+
+    def _get_write_api(self):
+        if self._write_api is None:
+            self._client = InfluxDBClient(url=self.url, token=self.token, org=self.org, enable_gzip=True)
+            self._write_api = self._client.write_api(write_options=SYNCHRONOUS)
+        return self._write_api
+
+    def _send(self, bucket: str, org: str, lines: List[str]):
+        start = time.monotonic()
+        self._get_write_api().write(
+            bucket=bucket, org=org, record=lines, write_precision=WritePrecision.NS
+        )
+        self.metrics.observe_batch(len(lines), time.monotonic() - start)
+
+    def _send_with_retry(self, bucket: str, org: str, lines: List[str]) -> bool:
+        """送出一個批次；回傳 False 表示應溢寫，被 InfluxDB 拒絕的批次視為已處理"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                self._send(bucket, org, lines)
+                if self._health:
+                    self._health.record_success()
+                return True
+            except Exception as e:
+                self.metrics.incr("batches_failed")
+                if self._is_rejected(e):
+                    self._dead_letter(bucket, org, lines, e)
+                    return True
+                if self._health:
+                    if is_outage(e):
+                        self._health.record_failure(e)
+                    if not self._health.allow_request():
+                        logger.error(f"InfluxDB 斷路器已打開，停止重試: {e}")
+                        return False
+                if attempt >= self.max_retries or self._stop.is_set():
+                    logger.error(f"InfluxDB 批次寫入失敗 ({len(lines)} 點): {e}")
+                    return False
+                self.metrics.incr("retries")
+                delay = min(self.retry_max_delay, self.retry_base_delay * (2 ** attempt))
+                time.sleep(random.uniform(0, delay))
+        return False
+
+    @staticmethod
+    def _is_rejected(error: Exception) -> bool:
+        """InfluxDB 以 4xx 拒絕請求（例如 line protocol 格式錯誤）；429 為限流，仍應重試"""
+        status = getattr(error, "status", None) if isinstance(error, ApiException) else None
+        return status is not None and 400 <= status < 500 and status != 429
+
+    def _dead_letter(self, bucket: str, org: str, lines: List[str], error: Exception):
+        """保存被拒絕的寫入點供人工檢查，不再重送"""
+        self.metrics.incr("points_rejected", len(lines))
+        try:
+            self.dead_letter_dir.mkdir(parents=True, exist_ok=True)
+            with open(self.dead_letter_dir / f"{bucket}__{org}.lp", "a", encoding="utf-8") as f:
+                f.write("\n".join(lines))
+                f.write("\n")
+            logger.error(f"InfluxDB 拒絕批次寫入，{len(lines)} 點已寫入 {self.dead_letter_dir}: {error}")
+        except Exception as e:
+            logger.error(f"寫入 dead-letter 檔案失敗，丟棄 {len(lines)} 點: {e}")
+
+    def _spool_path(self, bucket: str, org: str) -> Path:
+        return self.spool_dir / f"{bucket}__{org}.lp"
+
+    def _spool_files(self) -> List[Path]:
+        """溢寫檔案；重送中途當機留下的 .replay 檔排在前面，先於新的溢寫數據送出"""
+        if not self.spool_dir.exists():
+            return []
+        return sorted(self.spool_dir.glob("*.replay")) + sorted(self.spool_dir.glob("*.lp"))
+
+    def _has_spool(self) -> bool:
+        return bool(self._spool_files())
+
+    def _spool_size(self) -> int:
+        return sum(p.stat().st_size for p in self._spool_files())
+
+    def _spill(self, bucket: str, org: str, lines: List[str], requeue: bool = False) -> bool:
+        """將無法送出的寫入點附加到本地 line protocol 檔案
+
+        requeue 表示寫回重送失敗的溢寫數據：這些點已計入溢寫緩衝，不再檢查容量也不重複計數。
+        """
+        try:
+            self.spool_dir.mkdir(parents=True, exist_ok=True)
+            if not requeue and self._spool_size() >= self.max_spool_bytes:
+                self.metrics.incr("points_dropped", len(lines))
+                logger.error(f"InfluxDB 溢寫緩衝已滿，丟棄 {len(lines)} 點")
+                return False
+            with open(self._spool_path(bucket, org), "a", encoding="utf-8") as f:
+                f.write("\n".join(lines))
+                f.write("\n")
+            if not requeue:
+                self.metrics.incr("points_spilled", len(lines))
+                logger.warning(f"InfluxDB 無法使用，{len(lines)} 點已溢寫至 {self.spool_dir}")
+            return True
+        except Exception as e:
+            self.metrics.incr("points_dropped", len(lines))
+            logger.error(f"溢寫 InfluxDB 數據失敗: {e}")
+            return False
+
+    def _replay_spool(self):
+        """InfluxDB 恢復後重新送出溢寫檔案中的數據"""
+        for path in self._spool_files():
+            bucket, _, org = path.stem.partition("__")
+            processing = path.with_suffix(".replay")
+            try:
+                if path != processing:
+                    if processing.exists():
+                        # 上一次留下的 .replay 檔未能讀取，不覆蓋它
+                        continue
+                    path.rename(processing)
+                with open(processing, encoding="utf-8") as f:
+                    lines = [line for line in f.read().splitlines() if line]
+            except Exception as e:
+                logger.error(f"讀取溢寫檔案失敗: {e}")
+                continue
+
+            for start in range(0, len(lines), self.batch_size):
+                chunk = lines[start:start + self.batch_size]
+                if not self._send_with_retry(bucket, org, chunk):
+                    # 仍無法送出，剩餘部分寫回溢寫檔案
+                    if self._spill(bucket, org, lines[start:], requeue=True):
+                        processing.unlink()
+                    return
+                self.metrics.incr("points_replayed", len(chunk))
+
+            processing.unlink()
+            logger.info(f"已重新送出溢寫數據 {len(lines)} 點: {bucket}")
+
+
+# 全局實例
+timeseries_writer = TimeSeriesWriter()
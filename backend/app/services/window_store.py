@@ -0,0 +1,239 @@
+import logging
+import math
+import os
+import pickle
+import threading
+from collections import OrderedDict, deque
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class RollingWindow:
+    """固定長度的滑動窗口
+
+    數值存在預先配置的 NumPy 環形緩衝區；平均與變異數以 Welford 演算法
+    增量更新（新值加入、舊值移出），最小/最大值以單調佇列維護，每次
+    推入皆為 O(1) 攤銷成本。
+    """
+
+    __slots__ = ("capacity", "values", "head", "count", "seq", "mean", "m2", "min_deque", "max_deque")
+
+    def __init__(self, capacity: int):
+        self.capacity = max(1, int(capacity))
+        self.values = np.zeros(self.capacity, dtype=np.float64)
+        self.head = 0
+        self.count = 0
+        self.seq = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min_deque: deque = deque()
+        self.max_deque: deque = deque()
+
+    def push(self, value: float) -> float:
+        """推入新值，回傳目前窗口平均"""
+        if self.count == self.capacity:
+            old = float(self.values[self.head])
+            n = self.count - 1
+            if n:
+                delta = old - self.mean
+                self.mean -= delta / n
+                self.m2 -= delta * (old - self.mean)
+            else:
+                self.mean = 0.0
+                self.m2 = 0.0
+            self.count = n
+
+        self.values[self.head] = value
+        self.head = (self.head + 1) % self.capacity
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+        # 移除已離開窗口的序號，再維持單調性
+        oldest = self.seq - self.capacity + 1
+        while self.min_deque and self.min_deque[0][0] < oldest:
+            self.min_deque.popleft()
+        while self.max_deque and self.max_deque[0][0] < oldest:
+            self.max_deque.popleft()
+        while self.min_deque and self.min_deque[-1][1] >= value:
+            self.min_deque.pop()
+        while self.max_deque and self.max_deque[-1][1] <= value:
+            self.max_deque.pop()
+        self.min_deque.append((self.seq, value))
+        self.max_deque.append((self.seq, value))
+        self.seq += 1
+
+        return self.mean
+
+    def stats(self) -> Dict[str, float]:
+        variance = max(self.m2, 0.0) / self.count if self.count else 0.0
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "std": math.sqrt(variance),
+            "min": self.min_deque[0][1] if self.min_deque else None,
+            "max": self.max_deque[0][1] if self.max_deque else None,
+            "sum": self.mean * self.count,
+        }
+
+    @property
+    def nbytes(self) -> int:
+        return self.values.nbytes
+
+
+class TumblingWindow:
+    """固定筆數、互不重疊的窗口；窗口滿時輸出聚合結果並重新開始"""
+
+    __slots__ = ("size", "count", "mean", "m2", "min", "max")
+
+    def __init__(self, size: int):
+        self.size = max(1, int(size))
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def push(self, value: float) -> Tuple[Dict[str, float], bool]:
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+        stats = {
+            "count": self.count,
+            "mean": self.mean,
+            "std": math.sqrt(max(self.m2, 0.0) / self.count),
+            "min": self.min,
+            "max": self.max,
+            "sum": self.mean * self.count,
+        }
+        complete = self.count >= self.size
+        if complete:
+            self.reset()
+        return stats, complete
+
+    @property
+    def nbytes(self) -> int:
+        return 0
+
+
+class WindowStore:
+    """以 (設備, 欄位, 窗口類型, 大小) 為鍵的窗口狀態
+
+    窗口總數有上限，超過時淘汰最久未使用的窗口；可選擇將狀態快照到磁碟，
+    重啟後還原。
+    """
+
+    def __init__(self, max_windows: int = None, snapshot_path: str = None):
+        self.max_windows = max_windows or int(os.getenv("WINDOW_MAX_KEYS", "100000"))
+        path = snapshot_path or os.getenv("WINDOW_SNAPSHOT_PATH")
+        self.snapshot_path = Path(path) if path else None
+        self._windows: "OrderedDict[Tuple[str, str, str, int], Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def rolling(self, device_id: str, field: str, size: int) -> RollingWindow:
+        return self._get(("rolling", device_id, field, int(size)), RollingWindow)
+
+    def tumbling(self, device_id: str, field: str, size: int) -> TumblingWindow:
+        return self._get(("tumbling", device_id, field, int(size)), TumblingWindow)
+
+    def _get(self, key: Tuple[str, str, str, int], factory):
+        with self._lock:
+            window = self._windows.get(key)
+            if window is not None:
+                self._windows.move_to_end(key)
+                return window
+            window = factory(key[3])
+            self._windows[key] = window
+            while len(self._windows) > self.max_windows:
+                self._windows.popitem(last=False)
+                self.evictions += 1
+            return window
+
+    def clear(self, device_id: str = None):
+        """清除全部或指定設備的窗口"""
+        with self._lock:
+            if device_id is None:
+                self._windows.clear()
+                return
+            for key in [k for k in self._windows if k[1] == device_id]:
+                del self._windows[key]
+
+    def export(self) -> List[Tuple[Tuple[str, str, str, int], Any]]:
+        """回傳 (鍵, 窗口) 清單，最久未使用的在前"""
+        with self._lock:
+            return list(self._windows.items())
+
+    def load(self, items: List[Tuple[Tuple[str, str, str, int], Any]]) -> int:
+        """合併其他程序匯出的窗口（同鍵覆寫），回傳合併的窗口數"""
+        with self._lock:
+            for key, window in items:
+                self._windows[key] = window
+                self._windows.move_to_end(key)
+            while len(self._windows) > self.max_windows:
+                self._windows.popitem(last=False)
+                self.evictions += 1
+        return len(items)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            windows = list(self._windows.values())
+            devices = {key[1] for key in self._windows}
+        return {
+            "windows": len(windows),
+            "devices": len(devices),
+            "max_windows": self.max_windows,
+            "evictions": self.evictions,
+            "buffer_bytes": sum(w.nbytes for w in windows),
+            "snapshot_path": str(self.snapshot_path) if self.snapshot_path else None,
+        }
+
+    def snapshot(self, path: str = None) -> Optional[str]:
+        """將窗口狀態寫入磁碟（先寫暫存檔再改名）"""
+        target = Path(path) if path else self.snapshot_path
+        if target is None:
+            return None
+        with self._lock:
+            data = pickle.dumps(list(self._windows.items()), protocol=pickle.HIGHEST_PROTOCOL)
+        try:
+            target.parent.mkdir(parents=True, exist_ok=True)
+            tmp = target.with_suffix(target.suffix + ".tmp")
+            tmp.write_bytes(data)
+            tmp.replace(target)
+            logger.info(f"窗口狀態已保存: {target}")
+            return str(target)
+        except Exception as e:
+            logger.error(f"保存窗口狀態失敗: {e}")
+            return None
+
+    def restore(self, path: str = None) -> int:
+        """從磁碟還原窗口狀態，回傳還原的窗口數"""
+        source = Path(path) if path else self.snapshot_path
+        if source is None or not source.exists():
+            return 0
+        try:
+            items = pickle.loads(source.read_bytes())
+        except Exception as e:
+            logger.error(f"還原窗口狀態失敗: {e}")
+            return 0
+        with self._lock:
+            self._windows = OrderedDict(items[-self.max_windows:])
+            restored = len(self._windows)
+        logger.info(f"已還原 {restored} 個窗口: {source}")
+        return restored
+
+
+# 全局實例
+window_store = WindowStore()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Modbus 輪詢排程測試腳本
+以 pymodbus 模擬伺服器驗證區塊合併後的請求數與解碼結果
+"""
+
+import asyncio
+import socket
+import threading
+import time
+
+from pymodbus.datastore import ModbusSequentialDataBlock, ModbusServerContext, ModbusSlaveContext
+from pymodbus.server import ServerAsyncStop, StartAsyncTcpServer
+
+from app.config.data_processing_config import DEFAULT_DATA_SOURCES
+from app.protocols.modbus_scheduler import ModbusPollScheduler, PollTarget, parse_register_mappings
+
+# 測試配置
+HOST = "127.0.0.1"
+DEVICE_COUNT = 10
+POLL_INTERVAL = 0.5
+# 每台設備至少完成的輪詢次數，以及等待的上限秒數
+MIN_CYCLES = 3
+TIMEOUT = 15
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(predicate, timeout=TIMEOUT, interval=0.05):
+    """等待條件成立，逾時回傳 False"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(interval)
+    return predicate()
+
+
+def accepts_connections(port):
+    try:
+        socket.create_connection((HOST, port), timeout=0.2).close()
+        return True
+    except OSError:
+        return False
+
+
+class CountingDataBlock(ModbusSequentialDataBlock):
+    """記錄伺服器收到的讀取請求數"""
+
+    requests = 0
+
+    def getValues(self, address, count=1):
+        CountingDataBlock.requests += 1
+        return super().getValues(address, count)
+
+
+def start_simulator(port):
+    """在背景執行緒啟動 Modbus TCP 模擬伺服器，暫存器 n 的值為 n"""
+    CountingDataBlock.requests = 0
+    block = CountingDataBlock(0, list(range(1000)))
+    context = ModbusServerContext(slaves=ModbusSlaveContext(hr=block, ir=block, zero_mode=True), single=True)
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(
+        target=lambda: loop.run_until_complete(StartAsyncTcpServer(context=context, address=(HOST, port))),
+        daemon=True,
+    )
+    thread.start()
+    assert wait_for(lambda: accepts_connections(port)), "✗ Modbus 模擬伺服器沒有啟動"
+    # 探測連線不會送出讀取請求，但仍從零開始計數
+    CountingDataBlock.requests = 0
+    return loop
+
+
+def build_targets(port):
+    """預設數據源的暫存器對應，再加上一組分散的 40 個量測點"""
+    default_mappings = DEFAULT_DATA_SOURCES["modbus_industrial_device"]["config"]["register_mappings"]
+    wide_mappings = {f"reg_{address}": {"address": address, "scale": 0.5} for address in range(200, 600, 10)}
+    targets = []
+    for i in range(DEVICE_COUNT):
+        mappings = default_mappings if i % 2 == 0 else wide_mappings
+        targets.append(PollTarget(
+            device_id=f"modbus_test_{i}",
+            host=HOST,
+            port=port,
+            unit_id=1,
+            interval=POLL_INTERVAL,
+            points=parse_register_mappings(mappings),
+        ))
+    return targets
+
+
+def test_modbus_polling():
+    """測試區塊合併與批次發布"""
+
+    print("=== Modbus 輪詢排程測試 ===\n")
+    port = free_port()
+    loop = start_simulator(port)
+
+    published = []
+
+    async def collect(records):
+        published.extend(records)
+
+    targets = build_targets(port)
+    points = sum(len(t.points) for t in targets)
+    blocks = sum(len(t.blocks) for t in targets)
+    print(f"1. {DEVICE_COUNT} 台設備，{points} 個量測點合併為 {blocks} 個讀取區塊")
+
+    scheduler = ModbusPollScheduler(publish=collect, publish_interval=0.2)
+    scheduler.start(targets)
+    try:
+        finished = wait_for(lambda: scheduler.metrics.snapshot()["cycles"] >= DEVICE_COUNT * MIN_CYCLES
+                            and {r["device_id"] for r in published} >= {t.device_id for t in targets})
+    finally:
+        scheduler.stop()
+        asyncio.run_coroutine_threadsafe(ServerAsyncStop(), loop)
+    assert finished, f"✗ {TIMEOUT} 秒內沒有完成輪詢: {scheduler.metrics.snapshot()}"
+
+    metrics = scheduler.metrics.snapshot()
+    print(f"2. 完成 {metrics['cycles']} 次輪詢，錯誤 {metrics['errors']} 次，發布 {metrics['batches']} 批")
+    print(f"   逐點讀取需要 {metrics['naive_requests']} 次請求")
+    print(f"   合併後實際送出 {metrics['requests']} 次，伺服器收到 {CountingDataBlock.requests} 次")
+
+    assert metrics["errors"] == 0, f"✗ 輪詢發生錯誤: {metrics}"
+    assert metrics["requests"] == CountingDataBlock.requests, "✗ 請求數與伺服器記錄不一致"
+    print("✓ 請求數與伺服器記錄一致")
+
+    reduction = metrics["naive_requests"] / max(metrics["requests"], 1)
+    assert reduction >= points / blocks * 0.99, f"✗ 請求數沒有如預期減少: 1/{reduction:.1f}"
+    print(f"✓ 請求數減少為 1/{reduction:.1f}")
+
+    sample = next((r for r in published if r["device_id"] == "modbus_test_0"), None)
+    assert sample is not None, "✗ modbus_test_0 沒有發布任何量測值"
+    assert abs(sample["temperature"] - 10.0) < 1e-9 and abs(sample["pressure"] - 1.01) < 1e-9, \
+        f"✗ 解碼結果錯誤: {sample}"
+    wide = next(r for r in published if r["device_id"] == "modbus_test_1")
+    assert all(wide[f"reg_{address}"] == address * 0.5 for address in range(200, 600, 10)), f"✗ 解碼結果錯誤: {wide}"
+    print(f"✓ 解碼與縮放正確: temperature={sample['temperature']}, pressure={sample['pressure']}")
+
+    latency = scheduler.pool.get_latency("modbus_test_1")["modbus_test_1"]
+    print(f"3. modbus_test_1 往返延遲: p50={latency['p50']:.2f}ms p99={latency['p99']:.2f}ms（{latency['count']} 次）")
+    gateway = scheduler.pool.get_metrics()["gateways"][f"{HOST}:{port}"]
+    assert gateway["requests"] == metrics["requests"], f"✗ 閘道連線請求數不符: {gateway}"
+    print(f"✓ {DEVICE_COUNT} 台設備共用一條閘道連線")
+
+
+if __name__ == "__main__":
+    test_modbus_polling()
+    print("\n測試通過")
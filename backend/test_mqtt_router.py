@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+MQTT 主題路由測試腳本
+驗證主題樹比對、各路由解碼器，並以內建的簡易 Broker 驗證共享訂閱分攤訊息
+"""
+
+import asyncio
+import re
+import socket
+import struct
+import threading
+import time
+
+import msgpack
+import orjson
+import paho.mqtt.client as mqtt
+
+from app.protocols.mqtt_handler import MQTTHandler
+from app.protocols.mqtt_router import MQTTRouter
+
+# 測試配置
+HOST = "127.0.0.1"
+MESSAGE_COUNT = 200
+SHARE_GROUP = "ingest"
+TIMEOUT = 15
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(predicate, timeout=TIMEOUT, interval=0.05):
+    """等待條件成立，逾時回傳 False"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(interval)
+    return predicate()
+
+
+class StandInBroker:
+    """僅供測試的 MQTT 3.1.1 Broker：支援 QoS 0、萬用字元與 $share 共享訂閱（輪流分派）"""
+
+    def __init__(self):
+        self.subscriptions = []  # (writer, group, regex)
+        self.counters = {}
+
+    @staticmethod
+    def _compile(topic_filter):
+        parts = []
+        for level in topic_filter.split("/"):
+            if level == "#":
+                return re.compile("^" + "/".join(parts) + ("(/.*)?$" if parts else ".*$"))
+            parts.append("[^/]*" if level == "+" else re.escape(level))
+        return re.compile("^" + "/".join(parts) + "$")
+
+    @staticmethod
+    def _packet(packet_type, body):
+        header = bytearray([packet_type])
+        length = len(body)
+        while True:
+            byte, length = length % 128, length // 128
+            header.append(byte | (0x80 if length else 0))
+            if not length:
+                break
+        return bytes(header) + body
+
+    async def _read_packet(self, reader):
+        first = (await reader.readexactly(1))[0]
+        length, multiplier = 0, 1
+        while True:
+            byte = (await reader.readexactly(1))[0]
+            length += (byte & 0x7F) * multiplier
+            multiplier *= 128
+            if not byte & 0x80:
+                break
+        return first, await reader.readexactly(length)
+
+    def _route(self, topic, payload):
+        message = self._packet(0x30, struct.pack(">H", len(topic)) + topic.encode() + payload)
+        groups = {}
+        delivered = set()
+        for writer, group, pattern in list(self.subscriptions):
+            if not pattern.match(topic):
+                continue
+            if group:
+                groups.setdefault((group, pattern.pattern), []).append(writer)
+            elif writer not in delivered:
+                delivered.add(writer)
+                writer.write(message)
+        for key, members in groups.items():
+            index = self.counters.get(key, 0)
+            self.counters[key] = index + 1
+            members[index % len(members)].write(message)
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                first, body = await self._read_packet(reader)
+                packet_type = first >> 4
+                if packet_type == 1:
+                    writer.write(b"\x20\x02\x00\x00")
+                elif packet_type == 8:
+                    packet_id, offset, granted = body[:2], 2, []
+                    while offset < len(body):
+                        size = struct.unpack(">H", body[offset:offset + 2])[0]
+                        topic_filter = body[offset + 2:offset + 2 + size].decode()
+                        offset += 3 + size
+                        group = None
+                        if topic_filter.startswith("$share/"):
+                            _, group, topic_filter = topic_filter.split("/", 2)
+                        self.subscriptions.append((writer, group, self._compile(topic_filter)))
+                        granted.append(0)
+                    writer.write(self._packet(0x90, packet_id + bytes(granted)))
+                elif packet_type == 3:
+                    size = struct.unpack(">H", body[:2])[0]
+                    self._route(body[2:2 + size].decode(), body[2 + size:])
+                elif packet_type == 12:
+                    writer.write(b"\xd0\x00")
+                elif packet_type == 14:
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.subscriptions = [s for s in self.subscriptions if s[0] is not writer]
+            writer.close()
+
+
+def start_broker(port):
+    broker = StandInBroker()
+    loop = asyncio.new_event_loop()
+    ready = threading.Event()
+
+    async def run():
+        server = await asyncio.start_server(broker.handle, HOST, port)
+        ready.set()
+        async with server:
+            await server.serve_forever()
+
+    threading.Thread(target=lambda: loop.run_until_complete(run()), daemon=True).start()
+    assert ready.wait(5), "✗ 測試用 Broker 沒有啟動"
+    return broker
+
+
+class CollectingIngestion:
+    """取代接收橋接器，記錄交給它的訊息"""
+
+    def __init__(self):
+        self.messages = []
+
+    def submit_mqtt(self, topic, payload):
+        self.messages.append((topic, payload))
+        return True
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+def check_trie():
+    """主題樹比對與解碼器"""
+    calls = []
+    router = MQTTRouter()
+    router.add_route("iot/+/data", lambda t, p: calls.append(("data", t)))
+    router.add_route("iot/+/status", lambda t, p: calls.append(("status", t)))
+    router.add_route("iot/#", lambda t, p: calls.append(("all", t)), decoder="raw")
+    router.add_route("#", lambda t, p: calls.append(("everything", t)), decoder="raw")
+    router.add_route("plant/+/line/+/temp", lambda t, p: calls.append(("temp", p)), decoder="msgpack")
+
+    cases = {
+        # 設備 id 含 data 的狀態訊息不可被分派到 data 路由
+        "iot/data_status_3/status": ["status", "all", "everything"],
+        "iot/command_data/command": ["all", "everything"],
+        "iot": ["all", "everything"],
+        "iot/dev1/data/extra": ["all", "everything"],
+        "plant/a/line/b/temp": ["everything", "temp"],
+        "plant/a/line/temp": ["everything"],
+        "$SYS/broker/load": [],
+    }
+    payloads = {"plant/a/line/b/temp": msgpack.packb({"value": 21.5})}
+    for topic, expected in cases.items():
+        calls.clear()
+        router.dispatch(topic, payloads.get(topic, b'{"status": "online"}'))
+        routed = [name for name, _ in calls]
+        assert routed == expected, f"✗ {topic} 分派到 {routed}，預期 {expected}"
+    calls.clear()
+    router.dispatch("plant/a/line/b/temp", payloads["plant/a/line/b/temp"])
+    assert ("temp", {"value": 21.5}) in calls, f"✗ msgpack 解碼結果錯誤: {calls}"
+    print(f"✓ {len(cases)} 個主題的萬用字元比對正確（含設備 id 含 data/status 的主題）")
+
+    router.dispatch("iot/dev1/data", b"not json")
+    stats = router.get_stats()
+    data_stats = stats["routes"]["iot/+/data"]
+    assert data_stats["decode_errors"] == 1 and data_stats["handled"] == 0, f"✗ 解碼錯誤計數錯誤: {data_stats}"
+    assert stats["routes"]["iot/#"]["handled"] == 5, f"✗ iot/# 路由計數錯誤: {stats}"
+    assert stats["routes"]["iot/+/status"]["matched"] == 1, f"✗ iot/+/status 路由計數錯誤: {stats}"
+    assert stats["unmatched"] == 1, f"✗ 未比對計數錯誤: {stats}"
+    print(f"✓ 路由計數正確: {data_stats}")
+
+    try:
+        router.add_route("iot/#/data", lambda t, p: None)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("✗ 無效的過濾條件沒有被拒絕")
+
+    # 路由快取命中時的分派成本
+    start = time.perf_counter()
+    for i in range(100000):
+        router.dispatch("iot/dev1/status", b'{"status": "online"}')
+    print(f"   快取命中時每則訊息分派 {(time.perf_counter() - start) * 10:.2f} 微秒")
+
+
+def check_shared_subscription():
+    """兩個消費者以共享訂閱分攤訊息"""
+    port = free_port()
+    broker = start_broker(port)
+    consumers = []
+    for i in range(2):
+        handler = MQTTHandler(HOST, port, ingestion=CollectingIngestion(), share_group=SHARE_GROUP,
+                              client_id=f"consumer-{i}")
+        packed = []
+        handler.router.add_route("iot/+/packed", lambda t, p, packed=packed: packed.append(p), decoder="msgpack")
+        handler.packed = packed
+        handler.connect()
+        consumers.append(handler)
+    # 兩個消費者各訂閱 iot/+/data 與 iot/+/packed
+    assert wait_for(lambda: len(broker.subscriptions) >= 4), f"✗ 消費者沒有完成訂閱: {len(broker.subscriptions)}"
+
+    publisher = mqtt.Client(client_id="publisher")
+    publisher.connect(HOST, port)
+    publisher.loop_start()
+    for i in range(MESSAGE_COUNT):
+        publisher.publish(f"iot/device_{i % 10}/data", orjson.dumps({"seq": i, "temperature": 20 + i % 5}))
+        publisher.publish(f"iot/device_{i % 10}/packed", msgpack.packb({"seq": i}))
+    delivered = wait_for(lambda: sum(len(c.ingestion.messages) + len(c.packed) for c in consumers) >= 2 * MESSAGE_COUNT)
+    publisher.loop_stop()
+    publisher.disconnect()
+
+    received = [[payload["seq"] for _, payload in c.ingestion.messages] for c in consumers]
+    packed = [[payload["seq"] for payload in c.packed] for c in consumers]
+    stats = consumers[0].get_stats()["routes"]["iot/+/data"]
+    for c in consumers:
+        c.disconnect()
+
+    print(f"   共享訂閱分攤: JSON {[len(r) for r in received]}，msgpack {[len(p) for p in packed]}")
+    assert delivered, f"✗ {TIMEOUT} 秒內沒有收到全部訊息"
+    assert sorted(received[0] + received[1]) == list(range(MESSAGE_COUNT)), "✗ JSON 訊息有重複或遺失"
+    assert sorted(packed[0] + packed[1]) == list(range(MESSAGE_COUNT)), "✗ msgpack 訊息有重複或遺失"
+    assert all(received) and all(packed), "✗ 訊息沒有分攤到兩個消費者"
+    print(f"✓ {MESSAGE_COUNT} 則訊息由 2 個消費者分攤，沒有重複或遺失")
+
+    assert stats["handled"] == len(received[0]) and stats["decode_errors"] == 0, \
+        f"✗ 路由計數與收到的訊息不符: {stats}"
+    print(f"✓ 消費者 0 的 iot/+/data 路由處理 {stats['handled']} 則，{stats['bytes']} 位元組")
+
+
+def test_mqtt_router():
+    print("=== MQTT 主題路由測試 ===\n")
+    print("1. 主題樹比對")
+    check_trie()
+    print("2. 共享訂閱（內建 Broker）")
+    check_shared_subscription()
+
+
+if __name__ == "__main__":
+    test_mqtt_router()
+    print("\n測試通過")
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+OPC UA 訂閱測試腳本
+以本機 asyncua 伺服器驗證監控項目、deadband 過濾、微批次發布與批次讀寫
+"""
+
+import asyncio
+import socket
+import threading
+import time
+
+from asyncua import Server, ua
+
+from app.protocols.opcua_handler import OPCUAHandler
+from app.protocols.opcua_subscription import OPCUASubscriptionEngine, SubscriptionTarget, parse_node_mappings
+
+# 測試配置
+DEVICE_COUNT = 5
+UPDATE_INTERVAL = 0.1
+# 每台設備至少收到的 temperature 更新次數，以及等待的上限秒數
+MIN_UPDATES = 5
+TIMEOUT = 20
+
+
+def free_endpoint():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return f"opc.tcp://127.0.0.1:{sock.getsockname()[1]}/iot/"
+
+
+ENDPOINT = free_endpoint()
+
+
+def wait_for(predicate, timeout=TIMEOUT, interval=0.05):
+    """等待條件成立，逾時回傳 False"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(interval)
+    return predicate()
+
+
+def start_server():
+    """在背景執行緒啟動 OPC UA 伺服器，每台設備有 temperature、pressure、noise 三個變數
+
+    temperature 每次更新變化 2.0，noise 每次只變化 0.1（低於 deadband）。
+    """
+    loop = asyncio.new_event_loop()
+    ready = threading.Event()
+    state = {}
+
+    async def run():
+        server = Server()
+        await server.init()
+        server.set_endpoint(ENDPOINT)
+        ns = await server.register_namespace("urn:iot:test")
+        variables = {}
+        for i in range(DEVICE_COUNT):
+            device = await server.nodes.objects.add_object(ns, f"device_{i}")
+            for name in ("temperature", "pressure", "noise"):
+                node_id = ua.NodeId(f"device_{i}.{name}", ns)
+                variables[(i, name)] = await device.add_variable(node_id, name, 0.0)
+                await variables[(i, name)].set_writable()
+        state["ns"] = ns
+        state["stop"] = asyncio.Event()
+        async with server:
+            ready.set()
+            step = 0
+            while not state["stop"].is_set():
+                step += 1
+                for i in range(DEVICE_COUNT):
+                    await variables[(i, "temperature")].write_value(20.0 + 2.0 * step)
+                    await variables[(i, "noise")].write_value(0.1 * step)
+                await asyncio.sleep(UPDATE_INTERVAL)
+
+    thread = threading.Thread(target=lambda: loop.run_until_complete(run()), daemon=True)
+    thread.start()
+    assert ready.wait(15), "✗ OPC UA 伺服器沒有啟動"
+    return loop, state
+
+
+def build_targets(ns):
+    targets = []
+    for i in range(DEVICE_COUNT):
+        mappings = {
+            name: {"node_id": f"ns={ns};s=device_{i}.{name}", "deadband": 1.0 if name == "noise" else 0.0}
+            for name in ("temperature", "pressure", "noise")
+        }
+        targets.append(SubscriptionTarget(
+            device_id=f"opcua_test_{i}",
+            endpoint=ENDPOINT,
+            publishing_interval=100,
+            points=parse_node_mappings(mappings, sampling_interval=50),
+        ))
+    return targets
+
+
+async def check_handler(ns):
+    """批次讀寫與瀏覽快取"""
+    handler = OPCUAHandler(ENDPOINT)
+    await handler.connect()
+    try:
+        node_ids = [f"ns={ns};s=device_{i}.pressure" for i in range(DEVICE_COUNT)]
+        written = await handler.write_nodes({node_id: 1.5 * n for n, node_id in enumerate(node_ids)})
+        values = await handler.read_nodes(node_ids)
+        assert all(written.values()), f"✗ 批次寫入失敗: {written}"
+        assert [values[n] for n in node_ids] == [1.5 * n for n in range(DEVICE_COUNT)], f"✗ 批次讀回結果錯誤: {values}"
+        print(f"✓ 一次請求寫入並讀回 {len(node_ids)} 個節點")
+
+        variables = await handler.browse_tree("i=85", max_depth=2)
+        device_variables = [v for v in variables if v["node_id"].startswith(f"ns={ns};")]
+        client, handler.client = handler.client, None
+        cached = await handler.browse_tree("i=85", max_depth=2)
+        handler.client = client
+        assert len(device_variables) == DEVICE_COUNT * 3, f"✗ 瀏覽到 {len(device_variables)} 個設備變數"
+        assert cached == variables, f"✗ 再次瀏覽沒有由快取回應: {len(cached)} 筆"
+        print(f"✓ 瀏覽到 {len(device_variables)} 個設備變數，再次瀏覽由快取回應")
+    finally:
+        await handler.disconnect()
+
+
+def test_opcua_subscription():
+    """測試訂閱、deadband 與微批次發布"""
+
+    print("=== OPC UA 訂閱測試 ===\n")
+    loop, state = start_server()
+    ns = state["ns"]
+
+    published = []
+
+    async def collect(records):
+        published.append(records)
+
+    def temperatures(device_id):
+        return [r["temperature"] for batch in list(published) for r in batch
+                if r["device_id"] == device_id and "temperature" in r]
+
+    targets = build_targets(ns)
+    engine = OPCUASubscriptionEngine(publish=collect, batch_interval=0.5)
+    engine.start(targets)
+    try:
+        updated = wait_for(lambda: all(len(set(temperatures(t.device_id))) >= MIN_UPDATES for t in targets))
+        status = engine.get_status()
+    finally:
+        engine.stop()
+
+    try:
+        asyncio.run(check_handler(ns))
+    finally:
+        loop.call_soon_threadsafe(state["stop"].set)
+
+    session = status["endpoints"][ENDPOINT]
+    metrics = engine.metrics.snapshot()
+    print(f"1. {DEVICE_COUNT} 台設備建立 {session['monitored_items']} 個監控項目（失敗 {session['failed_items']} 個）")
+    print(f"2. 收到 {metrics['notifications']} 次資料變更通知，發布 {metrics['batches']} 批 {metrics['published']} 筆")
+
+    assert session["monitored_items"] == DEVICE_COUNT * 3 and session["failed_items"] == 0, f"✗ 監控項目建立失敗: {session}"
+    print("✓ 監控項目以批次請求建立")
+
+    assert updated, f"✗ {TIMEOUT} 秒內沒有收到每台設備 {MIN_UPDATES} 次 temperature 更新"
+    records = [r for batch in published for r in batch]
+    assert published and all(len(batch) <= DEVICE_COUNT for batch in published), \
+        f"✗ 每批筆數超過設備數: {[len(b) for b in published]}"
+    assert metrics["notifications"] > len(records), f"✗ 通知沒有合併: {metrics['notifications']} 次通知，{len(records)} 筆"
+    print(f"✓ 通知合併為微批次（每批最多 {max(len(b) for b in published)} 筆）")
+
+    device_temperatures = temperatures("opcua_test_0")
+    noises = {r["noise"] for r in records if r["device_id"] == "opcua_test_0" and "noise" in r}
+    assert device_temperatures == sorted(device_temperatures), f"✗ temperature 順序錯誤: {device_temperatures}"
+    # noise 每次只變 0.1，低於 deadband 1.0（asyncua 伺服器以相鄰兩次取樣的差值判斷，只會送出初始值）
+    assert len(noises) < len(set(device_temperatures)), \
+        f"✗ deadband 過濾不如預期: temperature={device_temperatures} noise={sorted(noises)}"
+    print(f"✓ deadband 過濾有效: temperature 更新 {len(set(device_temperatures))} 次，noise 只通知 {len(noises)} 個值")
+
+
+if __name__ == "__main__":
+    test_opcua_subscription()
+    print("\n測試通過")
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+權限服務測試腳本
+以記憶體中的 SQLite 驗證角色/用戶/資源權限的解析、快取命中與提交後的快取失效
+"""
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app import models
+from app.services.permission_service import PermissionService, permission_cache
+
+
+def build_session():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    models.Base.metadata.create_all(engine)
+    return engine, sessionmaker(bind=engine)()
+
+
+def seed(db):
+    """operator 角色可讀取設備；alice 另外被授予 devices.write、撤銷 alerts.read"""
+    role = models.Role(name="operator", display_name="操作員")
+    db.add(role)
+    db.flush()
+    permissions = {
+        (module, action): models.Permission(
+            name=f"{module}.{action}", display_name=f"{module} {action}", module=module, action=action
+        )
+        for module, action in (("devices", "read"), ("devices", "write"), ("alerts", "read"))
+    }
+    db.add_all(permissions.values())
+    db.flush()
+    db.add_all([
+        models.RolePermission(role_id=role.id, permission_id=permissions[("devices", "read")].id),
+        models.RolePermission(role_id=role.id, permission_id=permissions[("alerts", "read")].id),
+    ])
+    alice = models.User(username="alice", display_name="Alice", email="alice@example.com",
+                        hashed_password="x", role_id=role.id)
+    db.add(alice)
+    db.flush()
+    db.add_all([
+        models.UserPermission(user_id=alice.id, permission_id=permissions[("devices", "write")].id, granted=True),
+        models.UserPermission(user_id=alice.id, permission_id=permissions[("alerts", "read")].id, granted=False),
+        models.ResourcePermission(user_id=alice.id, resource_type="dashboards", resource_id=7, permission="edit"),
+    ])
+    db.commit()
+    return alice, permissions
+
+
+def test_permission_service():
+    print("=== 權限服務測試 ===\n")
+    engine, db = build_session()
+    alice, permissions = seed(db)
+    # 提交後的快取失效作用在全局快取上
+    permission_cache.invalidate_all()
+    service = PermissionService(db)
+
+    resolved = service.get_user_permissions(alice.id)
+    assert resolved == {"devices": ["read", "write"], "alerts": []}, f"✗ 權限解析錯誤: {resolved}"
+    assert service.check_permission(alice.id, "dashboards", "edit", resource_id=7)
+    assert not service.check_permission(alice.id, "dashboards", "edit", resource_id=8)
+    print(f"✓ 角色、用戶覆寫與資源權限解析正確: {resolved}")
+
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    for _ in range(1000):
+        assert service.check_permission(alice.id, "devices", "write")
+        assert not service.check_permission(alice.id, "alerts", "read")
+    assert not statements, f"✗ 快取命中時仍查詢資料庫: {len(statements)} 次"
+    print(f"✓ 2000 次權限檢查沒有查詢資料庫（{service.cache.get_stats()}）")
+
+    db.add(models.UserPermission(user_id=alice.id, permission_id=permissions[("alerts", "read")].id, granted=True))
+    db.rollback()
+    assert not service.check_permission(alice.id, "alerts", "read"), "✗ 回滾的變更使快取失效"
+
+    assert service.grant_permission_to_user(alice.id, permissions[("alerts", "read")].id, granted_by=None)
+    assert service.check_permission(alice.id, "alerts", "read"), "✗ 授權提交後快取沒有失效"
+    print("✓ 授權提交後重新載入，回滾的變更不影響快取")
+
+    for link in db.query(models.RolePermission).filter(
+        models.RolePermission.permission_id == permissions[("devices", "read")].id
+    ):
+        db.delete(link)
+    db.commit()
+    assert not service.check_permission(alice.id, "devices", "read"), "✗ 角色權限變更後快取沒有失效"
+    print("✓ 角色權限變更後所有用戶的快取失效")
+
+
+if __name__ == "__main__":
+    test_permission_service()
+    print("\n測試通過")